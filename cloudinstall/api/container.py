@@ -22,7 +22,8 @@ import os
 import codecs
 import errno
 from collections import deque
-from cloudinstall import utils
+from cloudinstall import trace, utils
+from cloudinstall.log import stop_logger
 import stat
 import tempfile
 import time
@@ -180,6 +181,8 @@ class LXCContainer:
         log.debug("Running command without waiting "
                   "for response.: {}".format(cmd))
         args = deque(shlex.split(cmd))
+        trace.export(config.cfg_path, utils.install_user())
+        stop_logger()
         os.execlp(args.popleft(), *args)
 
     @classmethod
@@ -248,6 +251,37 @@ class LXCContainer:
                                                out['err'].strip()))
         return out['status']
 
+    @classmethod
+    def clone(cls, src, dst):
+        """ creates a copy-on-write snapshot clone of a stopped container
+
+        :param str src: name of container to clone from
+        :param str dst: name of new container
+        """
+        out = utils.get_command_output(
+            'sudo lxc-clone -s -B overlayfs -o {0} -n {1}'.format(src, dst))
+        if out['status'] > 0:
+            raise Exception("Unable to clone container {0}: "
+                            "{1} ({2})".format(src, out['output'],
+                                               out['err'].strip()))
+        return out['status']
+
+    @classmethod
+    def copy(cls, src, dst):
+        """ creates a full copy of a stopped container, which keeps
+        working once src is destroyed
+
+        :param str src: name of container to copy from
+        :param str dst: name of new container
+        """
+        out = utils.get_command_output(
+            'sudo lxc-clone -o {0} -n {1}'.format(src, dst))
+        if out['status'] > 0:
+            raise Exception("Unable to copy container {0}: "
+                            "{1} ({2})".format(src, out['output'],
+                                               out['err'].strip()))
+        return out['status']
+
     @classmethod
     def add_bind_mounts(cls, name, mounts):
         container_abspath = os.path.join(cls.container_root, name)
@@ -489,6 +523,8 @@ class LXDContainer:
         log.debug("Running command without waiting "
                   "for response.: {}".format(cmd))
         args = deque(shlex.split(cmd))
+        trace.export(config.cfg_path, utils.install_user())
+        stop_logger()
         os.execlp(args.popleft(), *args)
 
     @classmethod
@@ -598,6 +634,32 @@ class LXDContainer:
 
         return 0
 
+    @classmethod
+    def clone(cls, src, dst):
+        """ copies a stopped container, copy-on-write where the storage
+        backend supports it
+
+        :param str src: name of container to copy from
+        :param str dst: name of new container
+        """
+        out = utils.get_command_output('lxc copy {} {}'.format(src, dst),
+                                       user_sudo=True)
+        if out['status'] > 0:
+            raise Exception("Unable to copy container {}: "
+                            "out:{}\nerr:{}".format(src, out['output'],
+                                                    out['err']))
+        return out['status']
+
+    @classmethod
+    def copy(cls, src, dst):
+        """ copies a stopped container, LXD keeps the copy working once
+        src is destroyed
+
+        :param str src: name of container to copy from
+        :param str dst: name of new container
+        """
+        return cls.clone(src, dst)
+
     @classmethod
     def add_bind_mounts(cls, name, mounts):
         return ["lxc.mount.entry = {} {} "
@@ -18,50 +18,313 @@ Provides async operations for various api calls and other non-blocking
 work.
 """
 
+import itertools
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from threading import Event
+import os
+import random
+from concurrent.futures import Future
+from queue import PriorityQueue
+from threading import Condition, Event, Lock, Thread
 import time
 
+from cloudinstall import trace
+from cloudinstall.profiler import profiler
+
 log = logging.getLogger("cloudinstall.async")
 
 
 class ThreadCancelledException(Exception):
     """Exception meaning intentional cancellation"""
 
-AsyncPool = ThreadPoolExecutor(1)
-log.debug('AsyncPool={}'.format(AsyncPool))
-
 
 ShutdownEvent = Event()
 
+# Waiters block on this condition instead of polling ShutdownEvent.
+# It is notified on shutdown and whenever notify_waiters() signals
+# that some watched state (juju or maas status) has changed.
+_wakeup = Condition()
+_wakeup_generation = 0
+
+# name -> dict(count, polls, total, max, timeouts)
+WaitStats = {}
+_wait_stats_lock = Lock()
+
+# Lower values run first within a lane
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+# lane name -> number of worker threads
+# Override with eg. UCI_ASYNC_LANES="io=4,postproc=2"
+LANE_WORKERS = {
+    'deploy': 1,
+    'relations': 1,
+    'postproc': 1,
+    'io': 2,
+    # long running watchers that poll in the background
+    'refresh': 1,
+    # charms added to juju ahead of their deploy
+    'prefetch': 4,
+}
+
+
+class Lane:
+    """ A named queue of background tasks served by a fixed number of
+    worker threads, highest priority first.
+    """
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self._queue = PriorityQueue()
+        self._seq = itertools.count()
+        self._threads = []
+        self._lock = Lock()
+        self._closed = False
+        self.stats = dict(submitted=0, completed=0, failed=0,
+                          cancelled=0, wait_time=0.0, run_time=0.0,
+                          max_depth=0)
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            t = Thread(target=self._worker,
+                       name="{}-{}".format(self.name, len(self._threads)),
+                       daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def submit(self, func, priority=PRIORITY_NORMAL):
+        """ Queues func, returns a concurrent.futures.Future """
+        f = Future()
+        with self._lock:
+            if self._closed:
+                f.cancel()
+                return f
+            self._start_workers()
+            self.stats['submitted'] += 1
+            self._queue.put((priority, next(self._seq),
+                             (func, f, time.time())))
+            self.stats['max_depth'] = max(self.stats['max_depth'],
+                                          self._queue.qsize())
+        return f
 
-def submit(func, exc_callback):
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            _, _, task = self._queue.get()
+            if task is None:
+                return
+            func, f, queued_at = task
+            if ShutdownEvent.is_set() or not f.set_running_or_notify_cancel():
+                with self._lock:
+                    self.stats['cancelled'] += 1
+                continue
+            profiler.profile_current_thread()
+            started = time.time()
+            task_span = trace.span(getattr(func, '__qualname__', str(func)),
+                                   'task', lane=self.name,
+                                   queued=started - queued_at)
+            result = error = None
+            try:
+                result = func()
+                outcome = 'completed'
+            except BaseException as e:
+                error = e
+                outcome = 'failed'
+            finished = time.time()
+            task_span.end()
+            # counted before the future resolves, so whoever waits on it
+            # sees the task in the stats
+            with self._lock:
+                self.stats[outcome] += 1
+                self.stats['wait_time'] += started - queued_at
+                self.stats['run_time'] += finished - started
+            if error is None:
+                f.set_result(result)
+            else:
+                f.set_exception(error)
+            log.debug("{lane}: {func} {outcome}, waited {w:.2f}s, "
+                      "ran {r:.2f}s, {d} queued".format(
+                          lane=self.name,
+                          func=getattr(func, '__qualname__', func),
+                          outcome=outcome, w=started - queued_at,
+                          r=finished - started, d=self.queue_depth()))
+
+    def shutdown(self):
+        """ Cancels queued tasks and stops the workers once their
+        current task returns.
+        """
+        with self._lock:
+            self._closed = True
+            while not self._queue.empty():
+                _, _, task = self._queue.get()
+                if task is not None and task[1].cancel():
+                    self.stats['cancelled'] += 1
+            for _ in self._threads:
+                # sentinels sort ahead of any real task
+                self._queue.put((PRIORITY_HIGH - 1, next(self._seq), None))
+
+
+def _lane_workers():
+    workers = dict(LANE_WORKERS)
+    for spec in os.getenv('UCI_ASYNC_LANES', '').split(','):
+        if '=' not in spec:
+            continue
+        name, count = spec.split('=', 1)
+        try:
+            workers[name.strip()] = max(1, int(count))
+        except ValueError:
+            log.warning("Ignoring bad UCI_ASYNC_LANES entry: {}".format(spec))
+    return workers
+
+
+Lanes = {name: Lane(name, n) for name, n in _lane_workers().items()}
+log.debug('Lanes={}'.format(_lane_workers()))
+
+
+def submit(func, exc_callback, lane='deploy', priority=PRIORITY_NORMAL):
+    """ Runs func in the background on the named lane.
+
+    exc_callback is called with any exception raised by func.
+    """
     def cb(cb_f):
+        if cb_f.cancelled():
+            return
         e = cb_f.exception()
         if e:
             exc_callback(e)
     if ShutdownEvent.is_set():
         log.debug("ignoring async.submit due to impending shutdown.")
         return
-    f = AsyncPool.submit(func)
+    f = Lanes[lane].submit(func, priority)
     f.add_done_callback(cb)
+    return f
+
+
+def lane_stats():
+    """ returns per-lane task metrics, including current queue depth """
+    stats = {}
+    for name, lane in Lanes.items():
+        with lane._lock:
+            stats[name] = dict(lane.stats, workers=lane.workers,
+                               depth=lane.queue_depth())
+    return stats
 
 
 def shutdown():
     ShutdownEvent.set()
-    AsyncPool.shutdown(wait=False)
+    notify_waiters()
+    for lane in Lanes.values():
+        lane.shutdown()
+
+
+def notify_waiters():
+    """Wakes up any wakeable sleeps early so they can re-check their
+    predicates, eg. after a status change was noticed.
+    """
+    global _wakeup_generation
+    with _wakeup:
+        _wakeup_generation += 1
+        _wakeup.notify_all()
 
 
-def sleep_until(s):
+def sleep_until(s, wakeable=False):
     """returns after 's' seconds.
 
     If the ShutdownEvent is raised before the wait is over,
     raises a ThreadCancelledException.
 
+    If wakeable is True, returns early when notify_waiters() is
+    called.
+
+    """
+    with _wakeup:
+        generation = _wakeup_generation
+
+        def woken():
+            return ShutdownEvent.is_set() or \
+                (wakeable and _wakeup_generation != generation)
+
+        _wakeup.wait_for(woken, timeout=max(s, 0))
+    if ShutdownEvent.is_set():
+        raise ThreadCancelledException("Thread cancelled while sleeping")
+    return True
+
+
+def _record_wait(name, polls, elapsed, timed_out):
+    with _wait_stats_lock:
+        stats = WaitStats.setdefault(name, dict(count=0, polls=0,
+                                                total=0.0, max=0.0,
+                                                timeouts=0))
+        stats['count'] += 1
+        stats['polls'] += polls
+        stats['total'] += elapsed
+        stats['max'] = max(stats['max'], elapsed)
+        if timed_out:
+            stats['timeouts'] += 1
+
+
+def wait_until(predicate, name=None, interval=1, backoff=1.0,
+               max_interval=None, jitter=0.1, timeout=None,
+               wake_on_change=False):
+    """Calls predicate() until it returns a true value.
+
+    Sleeps 'interval' seconds between calls, multiplying the interval by
+    'backoff' after each call up to 'max_interval'. Each sleep is
+    randomized by +/- 'jitter' (a fraction of the interval) so that
+    concurrent waiters do not poll in lockstep.
+
+    If wake_on_change is True, a call to notify_waiters() cuts the
+    current sleep short.
+
+    returns the predicate's value, or False if 'timeout' seconds passed
+    first. Raises ThreadCancelledException on shutdown.
+
     """
+    if name is None:
+        name = getattr(predicate, '__name__', 'wait')
+    if max_interval is None:
+        max_interval = interval
+    with trace.span(name, 'wait') as wait_span:
+        result = _wait_until(predicate, name, interval, backoff,
+                             max_interval, jitter, timeout, wake_on_change)
+        wait_span.set_arg('result', bool(result))
+        return result
+
+
+def _wait_until(predicate, name, interval, backoff, max_interval, jitter,
+                timeout, wake_on_change):
     start = time.time()
-    while not ShutdownEvent.wait(timeout=.1):
-        if time.time() - start >= s:
-            return True
-    raise ThreadCancelledException("Thread cancelled while sleeping")
+    deadline = None if timeout is None else start + timeout
+    delay = interval
+    polls = 0
+    while True:
+        polls += 1
+        result = predicate()
+        if result:
+            elapsed = time.time() - start
+            _record_wait(name, polls, elapsed, False)
+            log.debug("wait '{}' done after {} polls in {:.2f}s".format(
+                name, polls, elapsed))
+            return result
+
+        sleep_for = delay * random.uniform(1 - jitter, 1 + jitter)
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                elapsed = time.time() - start
+                _record_wait(name, polls, elapsed, True)
+                log.debug("wait '{}' timed out after {} polls "
+                          "in {:.2f}s".format(name, polls, elapsed))
+                return False
+            sleep_for = min(sleep_for, remaining)
+        sleep_until(sleep_for, wakeable=wake_on_change)
+        delay = min(delay * backoff, max_interval)
+
+
+def wait_stats():
+    """ returns a copy of the per-wait timing metrics """
+    with _wait_stats_lock:
+        return {k: dict(v) for k, v in WaitStats.items()}
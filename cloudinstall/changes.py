@@ -0,0 +1,206 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Changes between juju status snapshots
+
+JujuState diffs each full status it fetches against the previous one
+and publishes the differences as Change events on its ChangeBus, so
+consumers can react to, or wait for, e.g. a unit becoming active
+instead of scanning the whole status on a timer. Statuses are only
+diffed as they are fetched for their callers.
+"""
+
+from collections import namedtuple
+import logging
+import threading
+
+from cloudinstall import async
+
+log = logging.getLogger('cloudinstall.changes')
+
+# Change kinds, and the fields they report
+MACHINE = 'machine'     # agent_state
+UNIT = 'unit'           # agent_state, workload
+RELATION = 'relation'   # related
+ADDRESS = 'address'     # public_address, of machines and units
+
+# One changed value: old is None for new entities, new is None for
+# removed ones. entity is a machine id, a unit name or, for relations,
+# a 'service:endpoint' and the values are the related service.
+Change = namedtuple('Change', ['kind', 'entity', 'field', 'old', 'new'])
+
+
+def _agent_state(entity):
+    agent = entity.get('Agent') or {}
+    return agent.get('Status') or entity.get('AgentState')
+
+
+def _machines(status):
+    """ machine id -> status, of machines and their containers """
+    machines = {}
+    pending = list((status.get('Machines') or {}).items())
+    while pending:
+        mid, machine = pending.pop()
+        machines[mid] = machine
+        pending.extend((machine.get('Containers') or {}).items())
+    return machines
+
+
+def _units(status):
+    """ unit name -> status, of units and their subordinates """
+    units = {}
+    for service in (status.get('Services') or {}).values():
+        for uname, unit in (service.get('Units') or {}).items():
+            units[uname] = unit
+            units.update(unit.get('Subordinates') or {})
+    return units
+
+
+def _relations(status):
+    """ set of ('service:endpoint', other service) """
+    return set(("{}:{}".format(name, endpoint), other)
+               for name, service in (status.get('Services') or {}).items()
+               for endpoint, others in
+               (service.get('Relations') or {}).items()
+               for other in others)
+
+
+def _workload(unit):
+    return (unit.get('Workload') or {}).get('Status')
+
+
+def _diff_fields(kind, old, new, fields):
+    changes = []
+    for entity in sorted(set(old) | set(new)):
+        for field, kind_, get in fields:
+            old_value = get(old[entity]) if entity in old else None
+            new_value = get(new[entity]) if entity in new else None
+            if old_value != new_value:
+                changes.append(Change(kind_ or kind, entity, field,
+                                      old_value, new_value))
+    return changes
+
+
+def diff(old, new):
+    """ Returns the Changes from FullStatus old to new, either may be
+    None
+    """
+    old, new = old or {}, new or {}
+    changes = _diff_fields(
+        MACHINE, _machines(old), _machines(new),
+        [('agent_state', None, _agent_state),
+         ('public_address', ADDRESS, lambda m: m.get('DNSName') or None)])
+    changes += _diff_fields(
+        UNIT, _units(old), _units(new),
+        [('agent_state', None, _agent_state),
+         ('workload', None, _workload),
+         ('public_address', ADDRESS,
+          lambda u: u.get('PublicAddress') or None)])
+    old_relations, new_relations = _relations(old), _relations(new)
+    changes += [Change(RELATION, endpoint, 'related', None, other)
+                for endpoint, other in sorted(new_relations - old_relations)]
+    changes += [Change(RELATION, endpoint, 'related', other, None)
+                for endpoint, other in sorted(old_relations - new_relations)]
+    return changes
+
+
+def _matches(value, expected):
+    if expected is None:
+        return True
+    if callable(expected):
+        return expected(value)
+    return value == expected
+
+
+class Subscription:
+
+    def __init__(self, callback, **filters):
+        self.callback = callback
+        self.filters = filters
+
+    def matches(self, change):
+        return all(_matches(getattr(change, f), expected)
+                   for f, expected in self.filters.items())
+
+
+class ChangeBus:
+
+    """ Delivers published Changes to the subscribers they match.
+
+    Callbacks run in the publishing thread and should be quick.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []
+
+    def subscribe(self, callback, kind=None, entity=None, field=None,
+                  new=None):
+        """ Calls callback(change) for each change matching the given
+        filters. A filter is a value to compare with, or a predicate.
+
+        :returns: the subscription, for unsubscribe()
+        """
+        subscription = Subscription(callback, kind=kind, entity=entity,
+                                    field=field, new=new)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def publish(self, changes):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for change in changes:
+            for subscription in subscriptions:
+                if not subscription.matches(change):
+                    continue
+                try:
+                    subscription.callback(change)
+                except Exception:
+                    log.exception("Error handling {}".format(change))
+
+    def wait_for(self, kind=None, entity=None, field=None, new=None,
+                 name=None, timeout=None, poll=None):
+        """ Blocks until a change matching the filters is published.
+
+        Relies on whoever publishes also calling async.notify_waiters(),
+        as JujuState does, to return promptly.
+
+        :param poll: called before each check, e.g. JujuState.status to
+                     fetch the status, and publish its changes, once its
+                     cache expires
+        :returns: the change, or None if 'timeout' seconds passed
+        """
+        seen = []
+        subscription = self.subscribe(seen.append, kind=kind, entity=entity,
+                                      field=field, new=new)
+
+        def published():
+            if poll is not None and not seen:
+                poll()
+            return len(seen) > 0
+        try:
+            async.wait_until(published,
+                             name=name or 'juju status change',
+                             interval=5, timeout=timeout,
+                             wake_on_change=True)
+        finally:
+            self.unsubscribe(subscription)
+        return seen[0] if seen else None
@@ -0,0 +1,167 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Charm config
+
+charmconf.yaml holds the config options of every service, keyed by
+service name. It is parsed and validated once per content, and each
+deploy gets only its own service's section, serialized once, rather
+than the whole file.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import yaml
+
+log = logging.getLogger('cloudinstall.charm_config')
+
+# yaml types juju accepts for an option value
+OPTION_TYPES = (str, bool, int, float)
+
+# path -> CharmConfig, and the (mtime, size) it was loaded at
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+class CharmConfigError(Exception):
+    """ Invalid charm config """
+
+
+def validate(options, source='charm config'):
+    """ Checks options is a mapping of service names to mappings of
+    option names to values juju accepts
+
+    :raises CharmConfigError: naming every invalid entry
+    """
+    if options is None:
+        return
+    if not isinstance(options, dict):
+        raise CharmConfigError("{} is not a mapping of service "
+                               "names".format(source))
+    errors = []
+    for service, section in sorted(options.items(), key=str):
+        if section is None:
+            continue
+        if not isinstance(service, str) or not isinstance(section, dict):
+            errors.append("{}: not a mapping of options".format(service))
+            continue
+        for option, value in sorted(section.items(), key=str):
+            if not isinstance(option, str):
+                errors.append("{}: bad option name {!r}".format(service,
+                                                                option))
+            elif value is not None and not isinstance(value, OPTION_TYPES):
+                errors.append("{}: {} is not a string, number or "
+                              "boolean".format(service, option))
+    if errors:
+        raise CharmConfigError("Invalid {}: {}".format(source,
+                                                       ", ".join(errors)))
+
+
+class CharmConfig:
+
+    """ The parsed options of a charm config file """
+
+    def __init__(self, raw=None, digest=None):
+        self.raw = raw
+        self.digest = digest
+        self.options = (yaml.safe_load(raw) if raw else None) or {}
+        validate(self.options)
+        self._yaml = {}
+        self._lock = threading.Lock()
+
+    def section(self, service_name):
+        """ Returns the options of service_name, or {} """
+        return self.options.get(service_name) or {}
+
+    def yaml_for(self, service_name):
+        """ Returns the config YAML deploying service_name needs, only
+        its own section, or "" if it has no options
+        """
+        with self._lock:
+            if service_name not in self._yaml:
+                section = self.section(service_name)
+                self._yaml[service_name] = yaml.safe_dump(
+                    {service_name: section},
+                    default_flow_style=False) if section else ""
+            return self._yaml[service_name]
+
+
+def load(path):
+    """ Returns the CharmConfig of path, parsed again only when its
+    content changes. A missing file has no options.
+    """
+    try:
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        stamp = None
+    with _loaded_lock:
+        cached = _loaded.get(path)
+        if cached and cached[1] == stamp:
+            return cached[0]
+        if stamp is None:
+            charm_config = CharmConfig()
+        else:
+            with open(path) as f:
+                raw = f.read()
+            digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+            if cached and cached[0].digest == digest:
+                charm_config = cached[0]
+            else:
+                log.debug("Loading charm config from {}".format(path))
+                charm_config = CharmConfig(raw, digest)
+        _loaded[path] = (charm_config, stamp)
+        return charm_config
+
+
+def inputs_digest(*inputs):
+    """ Hash of the inputs a charm config is rendered from """
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode(
+        'utf-8')).hexdigest()
+
+
+def _inputs_path(path):
+    return path + '.inputs'
+
+
+def is_current(path, digest):
+    """ True if path was rendered from inputs with digest and has not
+    been changed since
+    """
+    try:
+        with open(_inputs_path(path)) as f:
+            recorded = json.load(f)
+        with open(path, 'rb') as f:
+            content = hashlib.sha1(f.read()).hexdigest()
+    except (OSError, ValueError):
+        return False
+    return recorded == dict(inputs=digest, content=content)
+
+
+def record_inputs(path, digest, content):
+    """ Records that content, written to path, was rendered from inputs
+    with digest
+    """
+    recorded = dict(inputs=digest,
+                    content=hashlib.sha1(content.encode('utf-8')).hexdigest())
+    try:
+        with open(_inputs_path(path), 'w') as f:
+            json.dump(recorded, f)
+    except OSError as e:
+        log.warning("Unable to record charm config inputs: {}".format(e))
@@ -0,0 +1,258 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Charm metadata manifest
+
+Placement and the services views only need the static attributes of
+the charm classes. Those are kept in a manifest, built at package time
+for the bundled charms (make charm-manifest) and on first use for a
+plugin directory, so a charm module is imported only once one of its
+charms is deployed or post-processed.
+
+A manifest records the modification time of every module it was built
+from and is rebuilt, then cached under ~/.cloud-install, when they
+change.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pkgutil
+import sys
+from importlib import import_module
+
+from cloudinstall import utils
+
+log = logging.getLogger('cloudinstall.charm_manifest')
+
+VERSION = 1
+
+CHARMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'charms')
+PACKAGED_MANIFEST = os.path.join(CHARMS_DIR, 'manifest.json')
+
+# Static class attributes recorded for each charm
+ATTRIBUTES = ['charm_name', 'charm_rev', 'display_name', 'related',
+              'isolate', 'constraints', 'deploy_priority',
+              'display_priority', 'allow_multi_units',
+              'allowed_assignment_types', 'disabled', 'subordinate',
+              'openstack_release_min', 'depends', 'conflicts', 'is_core',
+              'contrib', 'available_sources']
+
+# CharmBase.openstack_release_min, used when no release was chosen yet
+DEFAULT_RELEASE = 'i'
+
+# directory -> [CharmMetadata], charm modules don't change while running
+_loaded = {}
+
+
+class CharmMetadata:
+    """ Stands in for a charm class, from its manifest entry. Using
+    anything not in the manifest, such as instantiating the charm,
+    imports the charm module.
+    """
+
+    def __init__(self, entry, plugin_path=None):
+        from cloudinstall.placement.controller import AssignmentType
+
+        self.module_name = entry['module']
+        self.plugin_path = plugin_path
+        self._name = entry['name']
+        self._required_num_units = entry.get('required_num_units')
+        self._charm_class = None
+        for attr, value in entry['attributes'].items():
+            setattr(self, attr, value)
+        self.allowed_assignment_types = [
+            AssignmentType[t] for t in self.allowed_assignment_types]
+
+    def load(self):
+        """ Returns the charm class, importing its module """
+        if self._charm_class is None:
+            if self.plugin_path and self.plugin_path not in sys.path:
+                sys.path.insert(0, self.plugin_path)
+            module = import_module(self.module_name)
+            self._charm_class = module.__charm_class__
+        return self._charm_class
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.load(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def name(self):
+        return self._name
+
+    def required_num_units(self):
+        if self._required_num_units is None:
+            return self.load().required_num_units()
+        return self._required_num_units
+
+    # Charm classes compare equal to their metadata, see CharmType
+    def __eq__(self, other):
+        if isinstance(other, CharmMetadata):
+            return self._name == other._name
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._name)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return "<charm {} ({})>".format(self._name, self.module_name)
+
+
+def _overrides(charm_class, attr):
+    defining = next(c for c in charm_class.__mro__ if attr in vars(c))
+    return defining.__module__ != 'cloudinstall.charms'
+
+
+def _entry(module_name, charm_class):
+    attributes = {attr: getattr(charm_class, attr) for attr in ATTRIBUTES}
+    attributes['allowed_assignment_types'] = [
+        t.name for t in charm_class.allowed_assignment_types]
+    entry = dict(module=module_name, name=charm_class.name(),
+                 attributes=attributes)
+    # anything but a constant is left to the charm class
+    if not _overrides(charm_class, 'required_num_units'):
+        entry['required_num_units'] = charm_class.required_num_units()
+    return entry
+
+
+def _sources(directory):
+    return {f: os.path.getmtime(os.path.join(directory, f))
+            for f in os.listdir(directory) if f.endswith('.py')}
+
+
+def build(directory, package, plugin_path=None):
+    """ Returns the manifest of the charm modules in directory, which
+    are imported as package.<module>
+    """
+    if plugin_path and plugin_path not in sys.path:
+        sys.path.insert(0, plugin_path)
+    charms = []
+    for _, mname, _ in pkgutil.iter_modules([directory]):
+        module = import_module('{}.{}'.format(package, mname))
+        if hasattr(module, '__charm_class__'):
+            charms.append(_entry(module.__name__, module.__charm_class__))
+    return dict(version=VERSION, sources=_sources(directory), charms=charms)
+
+
+def write(manifest, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _cache_path(directory):
+    digest = hashlib.sha1(directory.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(utils.install_home(), '.cloud-install',
+                        'charm-manifests', digest + '.json')
+
+
+def load(directory, package, packaged=None, plugin_path=None):
+    """ Returns the manifest of the charm modules in directory: the
+    packaged or cached one if up to date, else a new one, cached.
+    """
+    directory = os.path.abspath(directory)
+    sources = _sources(directory)
+    cache_path = _cache_path(directory)
+    for path in [packaged, cache_path]:
+        manifest = _read(path) if path else None
+        if (manifest and manifest.get('version') == VERSION and
+                manifest.get('sources') == sources):
+            return manifest
+
+    log.info("Building charm manifest for {}".format(directory))
+    manifest = build(directory, package, plugin_path)
+    try:
+        write(manifest, cache_path)
+    except OSError as e:
+        log.warning("Unable to cache charm manifest: {}".format(e))
+    return manifest
+
+
+def _metadata(directory, package, packaged=None, plugin_path=None):
+    if directory not in _loaded:
+        manifest = load(directory, package, packaged, plugin_path)
+        _loaded[directory] = [CharmMetadata(entry, plugin_path)
+                              for entry in manifest['charms']]
+    return _loaded[directory]
+
+
+def openstack_release():
+    release_path = os.path.join(utils.install_home(),
+                                '.cloud-install/openstack_release')
+    if os.path.exists(release_path):
+        return utils.slurp(release_path)
+    return DEFAULT_RELEASE
+
+
+def charm_classes(ext_charm_path=None):
+    """ Returns CharmMetadata for the charms utils.load_charms() would
+    load, without importing them
+
+    :param ext_charm_path: Top level dir housing plugin 'charms/'
+    """
+    charms = list(_metadata(CHARMS_DIR, 'cloudinstall.charms',
+                            PACKAGED_MANIFEST))
+    if ext_charm_path:
+        if not os.path.exists(ext_charm_path):
+            raise Exception(
+                "Non-existent plugin path '{}' specified.".format(
+                    ext_charm_path))
+        plugin_path = os.path.abspath(ext_charm_path)
+        for charm in _metadata(os.path.join(plugin_path, 'charms'),
+                               'charms', plugin_path=plugin_path):
+            # Override any system charms
+            idx = [i for i, c in enumerate(charms)
+                   if c.name() == charm.name()]
+            if idx:
+                charms[idx[0]] = charm
+            else:
+                charms.append(charm)
+
+    release = openstack_release()[0].lower()
+    return [c for c in charms if c.openstack_release_min <= release]
+
+
+def by_name(name, ext_charm_path=None):
+    """ Returns the CharmMetadata of charm name, or None """
+    for charm in charm_classes(ext_charm_path):
+        if charm.name() == name:
+            return charm
+    return None
+
+
+if __name__ == '__main__':
+    # make charm-manifest: the manifest shipped with the package
+    write(build(CHARMS_DIR, 'cloudinstall.charms'), PACKAGED_MANIFEST)
+    print("Wrote {}".format(PACKAGED_MANIFEST))
@@ -0,0 +1,251 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Local charm repository
+
+With --next-charms, and for every charm with --use-nclxd, charms are
+deployed from bzr (or git) branches through a local repository under
+~/.cloud-install/local-charms. Checkouts are kept between runs and
+updated in place, all the charms an install needs are fetched in
+parallel ahead of their deploys, and the content hash of each charm is
+recorded with the charm url juju gave it, so an unchanged charm is
+deployed again without uploading it.
+"""
+
+from concurrent.futures import Future
+from functools import partial
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+
+from cloudinstall import async
+
+log = logging.getLogger('cloudinstall.charm_repo')
+
+NEXT_BRANCH = "lp:~openstack-charmers/charms/trusty/{}/next"
+STABLE_BRANCH = "lp:charms/trusty/{}"
+
+STATE_FILENAME = '.charm-repo.json'
+
+CHECKOUT = {'bzr': ['bzr', 'co', '--lightweight'],
+            'git': ['git', 'clone', '--depth', '1']}
+UPDATE = {'bzr': ['bzr', 'update'],
+          'git': ['git', 'pull', '--ff-only']}
+
+# config root -> LocalCharmRepo
+_repos = {}
+_repos_lock = threading.Lock()
+
+
+def charm_source(charm, config):
+    """ Returns the (branch, series) charm is deployed from through the
+    local repository, or None when it comes from the charm store
+
+    :param charm: charm class or CharmMetadata
+    """
+    if config.getopt('use_nclxd'):
+        # nclxd needs the charms under the series it runs, the charm
+        # store only has them under the LTS one
+        series = config.getopt('ubuntu_series')
+    else:
+        series = 'trusty'
+    if config.getopt('next_charms') and 'next' in charm.available_sources:
+        return NEXT_BRANCH.format(charm.charm_name), series
+    if config.getopt('use_nclxd') and \
+       'charmstore' in charm.available_sources:
+        return STABLE_BRANCH.format(charm.charm_name), series
+    return None
+
+
+def vcs(branch):
+    """ 'git' for git urls and local git repositories, else 'bzr' """
+    if branch.endswith('.git') or \
+       branch.startswith(('git://', 'git+ssh://', 'git@')) or \
+       os.path.isdir(os.path.join(branch, '.git')):
+        return 'git'
+    return 'bzr'
+
+
+def content_hash(directory):
+    """ Hash of the files in a charm checkout, without its VCS data """
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d not in ('.bzr', '.git'))
+        for name in sorted(files):
+            fpath = os.path.join(root, name)
+            digest.update(os.path.relpath(fpath, directory).encode('utf-8'))
+            if os.path.islink(fpath):
+                digest.update(os.readlink(fpath).encode('utf-8'))
+                continue
+            digest.update(b'x' if os.access(fpath, os.X_OK) else b'-')
+            with open(fpath, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class LocalCharmRepo:
+
+    """ Checkouts of charm branches, laid out for juju deploy
+    --repository as <series>/<charm name>.
+
+    Each checkout is fetched at most once per run: a deploy waits for
+    a fetch its charm's prefetch() started, if any.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._fetches = {}
+        self._state = self._read_state()
+
+    @property
+    def state_path(self):
+        return os.path.join(self.root, STATE_FILENAME)
+
+    def path(self, charm_name, series):
+        return os.path.join(self.root, series, charm_name)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = self.state_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._state, f, indent=1, sort_keys=True)
+            os.rename(tmp_path, self.state_path)
+        except OSError as e:
+            log.warning("Unable to save local charm repository "
+                        "state: {}".format(e))
+
+    def _run(self, cmd, cwd=None):
+        try:
+            subprocess.check_output(cmd, cwd=cwd, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            log.warning("error running {}: rc={} out={}".format(
+                " ".join(cmd), e.returncode, e.output))
+            raise
+
+    def fetch(self, charm_name, branch, series='trusty'):
+        """ Checks out or updates charm_name from branch
+
+        :returns: the content hash of the checkout
+        """
+        key = "{}/{}".format(series, charm_name)
+        with self._lock:
+            fetching = self._fetches.get(key)
+            if fetching is None:
+                fetching = self._fetches[key] = Future()
+                fetching.set_running_or_notify_cancel()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return fetching.result()
+        try:
+            fetching.set_result(self._fetch(key, charm_name, branch, series))
+        except Exception as e:
+            with self._lock:
+                del self._fetches[key]
+            fetching.set_exception(e)
+        return fetching.result()
+
+    def _fetch(self, key, charm_name, branch, series):
+        directory = self.path(charm_name, series)
+        kind = vcs(branch)
+        with self._lock:
+            entry = dict(self._state.get(key, {}))
+
+        updated = False
+        if entry.get('branch') == branch and \
+           os.path.isdir(os.path.join(directory, '.' + kind)):
+            log.debug("{}: updating {} from {}".format(charm_name, directory,
+                                                       branch))
+            try:
+                self._run(UPDATE[kind], cwd=directory)
+                updated = True
+            except subprocess.CalledProcessError:
+                log.warning("{}: update failed, checking out "
+                            "again".format(charm_name))
+        if not updated:
+            log.debug("{}: checking out {} into {}".format(charm_name, branch,
+                                                           directory))
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(os.path.dirname(directory), exist_ok=True)
+            self._run(CHECKOUT[kind] + [branch, directory])
+
+        digest = content_hash(directory)
+        if entry.get('hash') != digest:
+            log.info("{}: fetched {} ({})".format(charm_name, branch,
+                                                  digest[:12]))
+        with self._lock:
+            self._state[key] = dict(entry, branch=branch, hash=digest)
+            self._save_state()
+        return digest
+
+    def prefetch(self, charm_name, branch, series='trusty'):
+        """ Fetches charm_name in the background """
+        def failed(e):
+            # the deploy fetches it again
+            log.warning("Unable to prefetch {} from {}: {}".format(
+                charm_name, branch, e))
+        # ahead of charm store prefetches, a deploy waits for its fetch
+        async.submit(partial(self.fetch, charm_name, branch, series),
+                     failed, lane='prefetch', priority=async.PRIORITY_HIGH)
+
+    def uploaded(self, charm_name, series, environment):
+        """ Returns the charm url environment has the current checkout
+        of charm_name under, or None if it was not uploaded there
+        """
+        key = "{}/{}".format(series, charm_name)
+        with self._lock:
+            entry = self._state.get(key, {})
+            upload = entry.get('uploads', {}).get(environment, {})
+            if entry.get('hash') and upload.get('hash') == entry['hash']:
+                return upload['charm_url']
+        return None
+
+    def record_upload(self, charm_name, series, environment, charm_url):
+        """ Records that environment has the current checkout of
+        charm_name as charm_url
+        """
+        key = "{}/{}".format(series, charm_name)
+        with self._lock:
+            entry = self._state.get(key)
+            if entry is None:
+                return
+            uploads = dict(entry.get('uploads', {}))
+            uploads[environment] = dict(hash=entry['hash'],
+                                        charm_url=charm_url)
+            entry['uploads'] = uploads
+            self._save_state()
+
+
+def get(config):
+    """ Returns the local charm repository of config """
+    root = os.path.join(config.cfg_path, 'local-charms')
+    with _repos_lock:
+        if root not in _repos:
+            _repos[root] = LocalCharmRepo(root)
+        return _repos[root]
@@ -17,15 +17,16 @@ import logging
 from os import path
 import os
 import sys
-import yaml
 from queue import Queue
-import shutil
 import subprocess
-import requests
 
+import macumba.api
 from macumba.errors import MacumbaError, ServerError
 from cloudinstall import async
-from cloudinstall import utils
+from cloudinstall import charm_config
+from cloudinstall import charm_manifest
+from cloudinstall import charm_repo
+from cloudinstall import trace
 from cloudinstall.service import JujuUnitNotFoundException
 from cloudinstall.placement.controller import AssignmentType
 
@@ -37,27 +38,29 @@ CHARM_CONFIG_FILENAME = path.expanduser("~/.cloud-install/charmconf.yaml")
 def get_charm_config():
     """Returns charm config as python dict and raw yaml, if the file exists.
     Returns {}, None if the file does not exist.
+
+    The file is parsed again only when it changes, see
+    cloudinstall.charm_config.
     """
-    charm_config = {}
-    charm_config_raw = None
-    if path.exists(CHARM_CONFIG_FILENAME):
-        with open(CHARM_CONFIG_FILENAME) as f:
-            charm_config_raw = f.read()
-            charm_config = yaml.load(charm_config_raw)
-    return charm_config, charm_config_raw
+    conf = charm_config.load(CHARM_CONFIG_FILENAME)
+    return conf.options, conf.raw
+
+
+def get_service_config_yaml(service_name):
+    """Returns the config yaml deploying service_name needs: its own
+    section of the charm config, or "" if it has none.
+    """
+    return charm_config.load(CHARM_CONFIG_FILENAME).yaml_for(service_name)
 
 
 def query_cs(charm, series='trusty'):
     """ This helper routine will query the charm store to pull latest revisions
-    and charmstore url for the api.
+    and charmstore url for the api, see macumba.api.query_cs
 
     :param str charm: charm name
     :param str series: series, defaults. trusty
     """
-    charm_store_url = 'https://manage.jujucharms.com/api/3/charm'
-    url = path.join(charm_store_url, series, charm)
-    r = requests.get(url)
-    return r.json()
+    return macumba.api.query_cs("{}/{}".format(series, charm))
 
 
 class DisplayPriorities:
@@ -78,13 +81,12 @@ def get_charm(charm_name, juju, juju_state, ui, config):
     :rtype: Charm
     :returns: charm class
     """
-    for charm in utils.load_charms():
-        c = charm.__charm_class__(juju=juju,
-                                  juju_state=juju_state,
-                                  ui=ui,
-                                  config=config)
-        if charm_name == c.name():
-            return c
+    charm_class = charm_manifest.by_name(charm_name)
+    if charm_class is not None:
+        return charm_class(juju=juju,
+                           juju_state=juju_state,
+                           ui=ui,
+                           config=config)
 
 
 class CharmPostNoWorkloadException(Exception):
@@ -95,7 +97,22 @@ class CharmPostProcessException(Exception):
     """ Exception during post-processing """
 
 
-class CharmBase:
+class CharmType(type):
+
+    """ Charm classes are equal to one another, and to their
+    charm_manifest.CharmMetadata, when their charm names are.
+    """
+
+    def __eq__(cls, other):
+        if isinstance(other, (CharmType, charm_manifest.CharmMetadata)):
+            return cls.name() == other.name()
+        return NotImplemented
+
+    def __hash__(cls):
+        return hash(cls.name())
+
+
+class CharmBase(metaclass=CharmType):
 
     """ Base charm class """
 
@@ -207,63 +224,51 @@ export OS_REGION_NAME=\"RegionOne\"
         The default should be sufficient but if more functionality
         is needed this should be overridden.
 
+        machine_spec may be a list of machine specs, to deploy one unit
+        to each of them in a single call.
+
         returns True if deploy command was deferred for some reason.
         returns False if no error occurred and deploy command was issued.
 
         Note that the False (no-error) return value does not indicate
         that service is up and running.
         """
-        config_yaml = ""
+        placement = None
+        if isinstance(machine_spec, list):
+            placement = machine_spec
+            machine_spec = placement[0] if len(placement) == 1 else ""
+            if num_units is None and not self.subordinate:
+                num_units = len(placement)
 
         _charm_name_rev = self.charm_name
 
-        charm_config, charm_config_raw = get_charm_config()
-        log.debug("charm_config = {} ".format(charm_config))
-        if self.charm_name in charm_config:
-            config_yaml = charm_config_raw
+        config_yaml = get_service_config_yaml(self.charm_name)
+        log.debug("config_yaml = %s ", config_yaml)
 
         # Set revision
         # TODO: remove
         # if self.charm_rev:
         #     _charm_name_rev = "{}-{}".format(self.charm_name, self.charm_rev)
 
-        if self.config.getopt('use_nclxd'):
-            # nclxd support is only enabled on vivid and later, and we
-            # need to deploy from a local repo that has the right
-            # series in its path. The charmstore uses the LTS series
-            # name even for charms that support later series.
-
-            # Note, the constraint of vivid or later is checked in
-            # bin/openstack-install.
-            current_series = self.config.getopt('ubuntu_series')
-        else:
-            current_series = 'trusty'
-
-        if self.config.getopt('next_charms') and 'next' \
-           in self.available_sources:
-            self.bzr_get("lp:~openstack-charmers/charms/trusty/{}"
-                         "/next".format(self.charm_name), current_series)
-            self.local_deploy(machine_spec, current_series)
-            return False
+        source = charm_repo.charm_source(self, self.config)
+        if source is not None:
+            branch, series = source
+            self.bzr_get(branch, series)
+            return self.local_deploy_units(placement or [machine_spec],
+                                           series)
 
         if 'charmstore' not in self.available_sources:
             raise Exception("{} is not found in available "
                             "sources: {}".format(self.charm_name,
                                                  self.available_sources))
 
-        # if --use-nclxd and not --next-charms, just download LTS charms
-        if self.config.getopt('use_nclxd'):
-            branch = "lp:charms/trusty/{}".format(self.charm_name)
-            self.bzr_get(branch, current_series)
-            self.local_deploy(machine_spec, current_series)
-            return False
-
         if self.subordinate:
             assert(num_units is None)
             num_units = 0
             assert(len(self.constraints) == 0)
             self.constraints = None
             machine_spec = None
+            placement = None
         else:
             if num_units is None:
                 num_units = 1
@@ -271,12 +276,16 @@ export OS_REGION_NAME=\"RegionOne\"
         try:
             # TODO - might not need to pass self.constraints to deploy
 
-            log.debug('calling deploy({}, {}, {}, {}, {})'.format(
+            kwds = {}
+            if placement and len(placement) > 1:
+                kwds['placement'] = placement
+            log.debug('calling deploy({}, {}, {}, {}, {}, {})'.format(
                 _charm_name_rev, self.charm_name, num_units,
-                self.constraints, machine_spec))
+                self.constraints, machine_spec, kwds))
 
             self.juju.deploy(_charm_name_rev, self.charm_name, num_units,
-                             config_yaml, self.constraints, machine_spec)
+                             config_yaml, self.constraints, machine_spec,
+                             **kwds)
         except MacumbaError as e:
             log.exception("Error deploying: {}".format(e))
             raise Exception(
@@ -286,37 +295,55 @@ export OS_REGION_NAME=\"RegionOne\"
         return False
 
     def bzr_get(self, branch_name, series="trusty"):
-        """ checkout charms outside of charmstore
+        """ checkout charms outside of charmstore, into the local charm
+        repository, see cloudinstall.charm_repo
 
         :params str branch_name: bzr repository path,
                 eg. lp:~openstack-charmers/charms/trusty/nova-compute
         :params str series: series, defaults trusty
+        :returns: content hash of the checkout
         """
-        self.ui.status_info_message("BZR branching '{}'".format(branch_name))
-        localrepo = os.path.join(self.config.cfg_path,
-                                 'local-charms',
-                                 series, self.charm_name)
-        log.debug("{}: branching {} into dir {}".format(self.charm_name,
-                                                        branch_name,
-                                                        localrepo))
-
-        shutil.rmtree(localrepo, ignore_errors=True)
-        os.makedirs(localrepo, exist_ok=True)
+        self.ui.status_info_message("Fetching charm '{}'".format(branch_name))
+        return charm_repo.get(self.config).fetch(self.charm_name,
+                                                 branch_name, series)
+
+    def _environment_uuid(self):
         try:
-            subprocess.check_output(['bzr', 'co', '--lightweight',
-                                     branch_name, localrepo],
-                                    stderr=subprocess.STDOUT)
+            return self.juju.info()['UUID']
         except Exception as e:
-            log.warning("error checking out charm: "
-                        "rc={} out={}".format(e.returncode,
-                                              e.output))
-            raise e
+            log.debug("Unable to get environment uuid: {}".format(e))
+            return None
+
+    def deploy_uploaded(self, charm_url, mspec):
+        """ Deploys a local charm the environment already has, returns
+        True in case of an error.
+        """
+        config_yaml = get_service_config_yaml(self.charm_name)
+        if self.subordinate:
+            num_units, constraints, mspec = 0, None, ""
+        else:
+            num_units, constraints = 1, self.constraints
+        try:
+            self.juju.deploy(charm_url, self.charm_name, num_units,
+                             config_yaml, constraints, mspec)
+        except MacumbaError as e:
+            log.warning("Unable to deploy {}: {}".format(charm_url, e))
+            return True
+        self.ui.status_info_message(
+            "Deployed {} from local: {}".format(self.charm_name, charm_url))
+        return False
 
     def local_deploy(self, mspec, series="trusty"):
-        localrepo = os.path.join(self.config.cfg_path,
-                                 'local-charms')
+        repo = charm_repo.get(self.config)
+        environment = self._environment_uuid()
+        if environment is not None:
+            charm_url = repo.uploaded(self.charm_name, series, environment)
+            # unchanged since juju got it, no need to upload it again
+            if charm_url and not self.deploy_uploaded(charm_url, mspec):
+                return False
+
         kwds = dict(constraints=self.constraints_arg(),
-                    repodir=localrepo,
+                    repodir=repo.root,
                     charm_name=self.charm_name,
                     series=series,
                     mspec=mspec)
@@ -331,9 +358,14 @@ export OS_REGION_NAME=\"RegionOne\"
         if not self.subordinate:
             cmd += ' --to ' + mspec
 
-        charm_config, _ = get_charm_config()
-        if self.charm_name in charm_config:
-            cmd += ' --config ' + CHARM_CONFIG_FILENAME
+        config_yaml = get_service_config_yaml(self.charm_name)
+        if config_yaml:
+            config_path = path.join(self.config.cfg_path, 'charmconf',
+                                    self.charm_name + '.yaml')
+            os.makedirs(path.dirname(config_path), exist_ok=True)
+            with open(config_path, 'w') as f:
+                f.write(config_yaml)
+            cmd += ' --config ' + config_path
 
         try:
             infostr = ("Deploying {} from local: {}".format(self.charm_name,
@@ -351,13 +383,39 @@ export OS_REGION_NAME=\"RegionOne\"
                                                             e.output))
             return True
 
+        if environment is not None:
+            try:
+                status = self.juju.status([self.charm_name])
+                charm_url = status['Services'][self.charm_name]['Charm']
+                repo.record_upload(self.charm_name, series, environment,
+                                   charm_url)
+            except Exception as e:
+                log.debug("Unable to record charm url of {}: {}".format(
+                    self.charm_name, e))
+
+    def local_deploy_units(self, machine_specs, series="trusty"):
+        """ Deploys from the local repo to the first machine spec, then
+        adds the other units in one call. Returns True in case of an error.
+        """
+        if self.local_deploy(machine_specs[0], series):
+            return True
+        if len(machine_specs) > 1:
+            return self.add_unit(machine_specs[1:])
+        return False
+
     def add_unit(self, machine_spec, num_units=1):
-        """Add num_units of an already-deployed service onto machine_spec.
+        """Add num_units of an already-deployed service onto machine_spec,
+        or one unit to each of a list of machine specs.
 
         Returns true in case of an error.
         """
+        placement = None
+        if isinstance(machine_spec, list):
+            placement, machine_spec = machine_spec, ""
+            num_units = len(placement)
         try:
-            self.juju.add_unit(self.charm_name, num_units, machine_spec)
+            self.juju.add_unit(self.charm_name, num_units, machine_spec,
+                               placement)
         except MacumbaError:
             log.exception("Error adding unit")
             return True
@@ -458,8 +516,10 @@ class CharmQueue:
                 try:
                     log.debug("Calling juju.add_relation({}, {})".format(
                         relation_a, relation_b))
-                    self.juju.add_relation(relation_a,
-                                           relation_b)
+                    with trace.span("{} {}".format(relation_a, relation_b),
+                                    'relations'):
+                        self.juju.add_relation(relation_a,
+                                               relation_b)
                     completed_relations.append((relation_a,
                                                 relation_b))
                 except ServerError as e:
@@ -490,19 +550,28 @@ class CharmQueue:
 
         async.sleep_until(0)
 
-        log.debug("Starting charm post processing watcher.")
-        while not self.charm_post_proc_q.empty():
-            try:
-                charm = self.charm_post_proc_q.get()
-                charm.post_proc()
-            except CharmPostNoWorkloadException as e:
-                log.debug(e)
-                self.charm_post_proc_q.task_done()
-            except CharmPostProcessException as e:
-                log.debug(e)
-                self.charm_post_proc_q.put(charm)
-                self.charm_post_proc_q.task_done()
+        def post_proc_pass():
+            """ Runs post_proc once for every queued charm, re-queueing
+            the ones that are not ready yet.
+            """
+            for _ in range(self.charm_post_proc_q.qsize()):
+                try:
+                    charm = self.charm_post_proc_q.get()
+                    with trace.span(charm.charm_name, 'postproc'):
+                        charm.post_proc()
+                except CharmPostNoWorkloadException as e:
+                    log.debug(e)
+                    self.charm_post_proc_q.task_done()
+                except CharmPostProcessException as e:
+                    log.debug(e)
+                    self.charm_post_proc_q.put(charm)
+                    self.charm_post_proc_q.task_done()
             log.debug("Post processing queue size: {}".format(
                 self.charm_post_proc_q.qsize()))
-            async.sleep_until(10)
+            return self.charm_post_proc_q.empty()
+
+        log.debug("Starting charm post processing watcher.")
+        async.wait_until(post_proc_pass, name='charm post processing',
+                         interval=2, backoff=1.5, max_interval=10,
+                         wake_on_change=True)
         self.config.setopt('postproc_complete', True)
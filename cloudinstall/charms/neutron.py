@@ -15,7 +15,7 @@
 
 import os
 import logging
-from cloudinstall import utils
+from cloudinstall import remote
 from cloudinstall.charms import CharmBase, CharmPostProcessException  # noqa
 from cloudinstall.placement.controller import AssignmentType
 
@@ -55,16 +55,14 @@ class CharmNeutron(CharmBase):
 
         self.ui.status_info_message("Validating network parameters "
                                     "for Neutron")
-        utils.remote_cp(
-            unit.machine_id,
-            src=os.path.join(self.config.tmpl_path, "neutron-network.sh"),
-            dst="/tmp/neutron-network.sh",
-            juju_home=self.config.juju_home(use_expansion=True))
-        out = utils.remote_run(
+        out = remote.run_one(
+            self.juju,
             unit.machine_id,
             cmds="sudo bash /tmp/neutron-network.sh {}".format(
                 self.config.getopt('install_type')),
-            juju_home=self.config.juju_home(use_expansion=True))
+            files=[(os.path.join(self.config.tmpl_path,
+                                 "neutron-network.sh"),
+                    "/tmp/neutron-network.sh")])
         if out['status'] > 0:
             log.error("Neutron error: {}".format(out))
             raise CharmPostProcessException(out)
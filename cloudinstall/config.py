@@ -14,10 +14,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import argparse
 import datetime
 import os
 import yaml
 import cloudinstall.utils as utils
+from cloudinstall.profiler import profiler
 import logging
 
 
@@ -85,9 +87,9 @@ class Config:
 
     @property
     def share_path(self):
-        """ base share path
+        """ base share path, overridable to run from a source tree
         """
-        return "/usr/share/openstack"
+        return self._config.get('share_path', "/usr/share/openstack")
 
     @property
     def tmpl_path(self):
@@ -143,6 +145,9 @@ class Config:
             self.save()
         except Exception as e:
             log.error("Failed to set {} in config: {}".format(key, e))
+        if key == 'current_state':
+            # shared by InstallState and ControllerState values
+            profiler.mark_phase("state-{}".format(val))
 
     def getopt(self, key):
         if key in self._config:
@@ -217,3 +222,22 @@ class Config:
     @property
     def juju_api_password(self):
         return self.juju_env['password']
+
+
+def saved_config_file():
+    """ Returns path of the config the installer saves for later runs """
+    return os.path.join(utils.install_home(), '.cloud-install/config.yaml')
+
+
+def get_saved_option(key, cfg_file=None):
+    """ Returns the value of key in the saved installer config, as printed
+    by openstack-config and 'openstack-install -g'.
+
+    :raises ConfigException: when there is no saved config
+    """
+    cfg_file = cfg_file or saved_config_file()
+    if not os.path.isfile(cfg_file):
+        raise ConfigException("No existing config file found.")
+    cfg = Config(utils.populate_config(argparse.Namespace(
+        config_file=cfg_file)))
+    return cfg.getopt(key)
@@ -29,8 +29,11 @@ from tempfile import TemporaryDirectory
 from cloudinstall.state import InstallState
 from cloudinstall.netutils import get_ip_set
 
-from cloudinstall import utils
+from cloudinstall import metrics, recorder, utils
+from cloudinstall.alarms import AlarmMonitor
 from cloudinstall.config import INSTALL_TYPE_MULTI
+from cloudinstall.core import Controller
+from cloudinstall.gui import Header
 
 
 log = logging.getLogger('cloudinstall.c.i.multi')
@@ -167,12 +170,7 @@ class MultiInstall:
 
         # Return control back to landscape_install if need be
         if not self.config.is_landscape():
-            args = ['openstack-status']
-            if self.config.getopt('edit_placement'):
-                args.append('--edit-placement')
-
-            self.drop_privileges()
-            os.execvp('openstack-status', args)
+            self.start_deployment()
         else:
             log.debug("Finished MAAS step, now deploying Landscape.")
             return LandscapeInstallFinal(self,
@@ -180,16 +178,57 @@ class MultiInstall:
                                          self.config,
                                          self.loop).run()
 
+    def start_deployment(self):
+        """ Hands over to the deployment Controller, what openstack-status
+        runs, within this process: the UI, event loop, loaded modules and
+        MAAS client carry over.
+        """
+        # Files written since set_perms() belong to root
+        self.set_perms()
+        self.drop_privileges()
+
+        metrics.install(self.config)
+        if os.getenv('UCI_RECORD'):
+            recorder.install(os.getenv('UCI_RECORD'), self.config)
+        utils.spew(self.config.pidfile, str(os.getppid()),
+                   utils.install_user())
+
+        # Stop the installer's display refresh before handing over the UI
+        AlarmMonitor.remove_all()
+        self.display_controller.set_header(Header())
+        core = Controller(ui=self.display_controller, config=self.config,
+                          loop=self.loop)
+        machine_wait_view = getattr(self.display_controller,
+                                    'machine_wait_view', None)
+        if machine_wait_view is not None:
+            core.maas = machine_wait_view.maas_client
+            core.maas_state = machine_wait_view.maas_state
+        log.info("Starting deployment of OpenStack")
+        core.start(run_loop=False)
+
     def drop_privileges(self):
+        """ Switches to SUDO_USER for good: the rest of the process,
+        threads included, runs unprivileged
+        """
         if os.geteuid() != 0:
             return
 
         user_name = os.getenv("SUDO_USER")
+        if not user_name:
+            raise MaasInstallError("Unable to drop root privileges, "
+                                   "SUDO_USER is not set.")
         pwnam = pwd.getpwnam(user_name)
         os.initgroups(user_name, pwnam.pw_gid)
         os.setregid(pwnam.pw_gid, pwnam.pw_gid)
         os.setreuid(pwnam.pw_uid, pwnam.pw_uid)
 
+        # Setting the real uid also set the saved one, root is gone
+        try:
+            os.setuid(0)
+        except PermissionError:  # NOQA
+            return
+        raise MaasInstallError("Unable to drop root privileges.")
+
     def add_bootstrap_to_no_proxy(self):
         """Finds bootstrap node IP and adds it to the current setting of
         no-proxy in the juju env.
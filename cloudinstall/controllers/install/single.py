@@ -16,12 +16,12 @@
 """ Single Install Controller """
 
 import glob
+import hashlib
 from ipaddress import IPv4Network
 import logging
 import os
 import json
 from tempfile import NamedTemporaryFile
-import time
 import platform
 import shutil
 from subprocess import call, check_call, check_output, STDOUT
@@ -194,25 +194,30 @@ class SingleInstall:
                                                               out['output'],
                                                               out['err']))
 
-    def create_container_and_wait(self):
-        """ Creates container and waits for cloud-init to finish
-        """
-        self.tasker.start_task("Creating Container",
-                               self.read_container_status)
-        self.cdriver.create(self.container_name, self.userdata)
+    def golden_image_name(self):
+        """ Name of the prepared container matching this install
 
+        The name is keyed by a hash of the rendered userdata, the
+        ubuntu series and the candidate versions of the packages
+        installed into the container, so any change to those builds a
+        new golden image instead of reusing a stale one.
+        """
+        pkgs = utils.get_command_output(
+            'apt-cache policy openstack openstack-single')
+        key = hashlib.sha256()
+        key.update(utils.slurp(self.userdata).encode('utf-8'))
+        key.update(str(self.config.getopt('ubuntu_series')).encode('utf-8'))
+        key.update(str(self.config.getopt('topcontainer_type')).encode(
+            'utf-8'))
+        key.update(pkgs['output'].encode('utf-8'))
+        return 'openstack-golden-{}'.format(key.hexdigest()[:12])
+
+    def container_mounts(self):
+        """ Per-install bind mounts for the top level container """
         mounts = [(self.config.cfg_path, 'home/ubuntu/.cloud-install', "dir")]
         topcontainer_type = self.config.getopt("topcontainer_type")
         if topcontainer_type == 'lxc':
             mounts += [("/var/cache/lxc", "var/cache/lxc", "dir")]
-        elif topcontainer_type == 'lxd':
-            self.cdriver.add_devices(self.container_name,
-                                     [('tun', 'unix-char',
-                                       'path=/dev/net/tun'),
-                                      ('kvm', 'unix-char',
-                                       'path=/dev/kvm')])
-        else:
-            raise Exception("Uknown container type " + topcontainer_type)
 
         charm_plugin_dir = self.config.getopt('charm_plugin_dir')
         if charm_plugin_dir \
@@ -227,34 +232,56 @@ class SingleInstall:
             for d in extra_mounts.split(','):
                 mountpoint = os.path.basename(d)
                 mounts.append((d, "home/ubuntu/" + mountpoint, "dir"))
+        return mounts
 
-        mount_configs = self.cdriver.add_bind_mounts(self.container_name,
-                                                     mounts)
-
-        cfgs = [
-            'lxc.mount.auto = cgroup:mixed',
-            'lxc.start.auto = 1',
-            'lxc.start.delay = 5'] + mount_configs
+    def add_container_devices(self, name):
+        topcontainer_type = self.config.getopt("topcontainer_type")
+        if topcontainer_type == 'lxd':
+            self.cdriver.add_devices(name,
+                                     [('tun', 'unix-char',
+                                       'path=/dev/net/tun'),
+                                      ('kvm', 'unix-char',
+                                       'path=/dev/kvm')])
+        elif topcontainer_type != 'lxc':
+            raise Exception("Uknown container type " + topcontainer_type)
 
-        self.cdriver.add_config_entries(self.container_name, cfgs)
+    def start_container(self, name, cfgs):
+        """ Applies config entries and starts container 'name'
+        """
+        self.cdriver.add_config_entries(name, cfgs)
 
         lxc_logfile = os.path.join(self.config.cfg_path, 'lxc.log')
 
-        self.cdriver.start(self.container_name, lxc_logfile)
+        self.cdriver.start(name, lxc_logfile)
 
-        self.cdriver.wait_checked(self.container_name,
-                                  lxc_logfile)
+        self.cdriver.wait_checked(name, lxc_logfile)
 
-        self.tasker.start_task("Initializing Container",
-                               self.read_cloud_init_output)
-        tries = 0
-        while not self.cloud_init_finished(tries):
-            time.sleep(1)
-            tries += 1
+    def wait_for_cloud_init(self, name):
+        tries = [0]
+
+        def finished():
+            done = self.cloud_init_finished(tries[0], name=name)
+            tries[0] += 1
+            return done
+
+        async.wait_until(finished, name='cloud-init finished',
+                         interval=1, backoff=1.2, max_interval=5)
+
+    def install_dependencies(self, name):
+        log.debug("Installing openstack & openstack-single directly, "
+                  "and juju-local, libvirt-bin and lxc via deps")
+        self.cdriver.run(name,
+                         "sudo DEBIAN_FRONTEND=noninteractive apt-get -qy "
+                         "-o Dpkg::Options::=--force-confdef "
+                         "-o Dpkg::Options::=--force-confold "
+                         "install openstack openstack-single ",
+                         output_cb=self.set_progress_output)
+        log.debug("done installing deps")
 
+    def configure_container_network(self):
+        """ Network setup that is unique to each install """
         # we do this here instead of using cloud-init, for greater
         # control over ordering
-        log.debug("Container started, cloud-init done.")
 
         # for wily+ hosts and containers, restart the preexisting
         # lxc-net to pick up our config:
@@ -270,17 +297,114 @@ class SingleInstall:
         lxc_network = self.write_lxc_net_config()
         self.add_static_route(lxc_network)
 
+    def build_golden_image(self, golden_name):
+        """ Builds a stopped, fully prepared container that later
+        installs clone from.
+
+        Only configuration shared by every install goes into the
+        golden image, per-install mounts and networking are applied to
+        each clone.
+
+        The image is built under a temporary name and only copied to
+        golden_name once complete, so a build that fails or is
+        interrupted is never reused. It is a full copy rather than a
+        snapshot clone, which would lose its root filesystem with the
+        build container.
+        """
+        log.info("Building golden image {}".format(golden_name))
+        self.display_controller.status_info_message(
+            "Building golden image {}".format(golden_name))
+        build_name = golden_name + '-build'
+        if self.cdriver.exists(build_name):
+            log.info("Removing incomplete build {}".format(build_name))
+            self.destroy_container(build_name)
+        try:
+            self.cdriver.create(build_name, self.userdata)
+            self.add_container_devices(build_name)
+            self.start_container(build_name,
+                                 ['lxc.mount.auto = cgroup:mixed'])
+            self.wait_for_cloud_init(build_name)
+            self.install_dependencies(build_name)
+            self.cdriver.stop(build_name)
+            self.cdriver.copy(build_name, golden_name)
+        finally:
+            self.destroy_container(build_name)
+
+    def destroy_container(self, name):
+        """ Stops and destroys container name, if it exists """
+        if not self.cdriver.exists(name):
+            return
+        try:
+            self.cdriver.stop(name)
+        except Exception as e:
+            log.debug("Stopping {}: {}".format(name, e))
+        try:
+            self.cdriver.destroy(name)
+        except Exception as e:
+            log.warning("Unable to remove container {}: {}".format(name, e))
+
+    def clone_container_and_wait(self):
+        """ Clones the container from the golden image, building the
+        image first if it doesn't exist yet
+        """
+        golden_name = self.golden_image_name()
+        if not self.cdriver.exists(golden_name):
+            self.tasker.start_task("Creating Container",
+                                   self.read_progress_output)
+            self.build_golden_image(golden_name)
+        else:
+            self.tasker.start_task("Creating Container",
+                                   self.read_container_status)
+            log.info("Reusing golden image {}".format(golden_name))
+
+        self.cdriver.clone(golden_name, self.container_name)
+
+        mount_configs = self.cdriver.add_bind_mounts(self.container_name,
+                                                     self.container_mounts())
+        cfgs = [
+            'lxc.mount.auto = cgroup:mixed',
+            'lxc.start.auto = 1',
+            'lxc.start.delay = 5'] + mount_configs
+        self.start_container(self.container_name, cfgs)
+
+        self.tasker.start_task("Initializing Container",
+                               self.read_cloud_init_output)
+        self.wait_for_cloud_init(self.container_name)
+        log.debug("Container cloned from {}, cloud-init done.".format(
+            golden_name))
+        self.configure_container_network()
+
         self.tasker.start_task("Installing Dependencies",
                                self.read_progress_output)
-        log.debug("Installing openstack & openstack-single directly, "
-                  "and juju-local, libvirt-bin and lxc via deps")
-        self.cdriver.run(self.container_name,
-                         "sudo DEBIAN_FRONTEND=noninteractive apt-get -qy "
-                         "-o Dpkg::Options::=--force-confdef "
-                         "-o Dpkg::Options::=--force-confold "
-                         "install openstack openstack-single ",
-                         output_cb=self.set_progress_output)
-        log.debug("done installing deps")
+        log.debug("Dependencies already installed in golden image")
+
+    def create_container_and_wait(self):
+        """ Creates container and waits for cloud-init to finish
+        """
+        self.tasker.start_task("Creating Container",
+                               self.read_container_status)
+        self.cdriver.create(self.container_name, self.userdata)
+        self.add_container_devices(self.container_name)
+
+        mount_configs = self.cdriver.add_bind_mounts(self.container_name,
+                                                     self.container_mounts())
+
+        cfgs = [
+            'lxc.mount.auto = cgroup:mixed',
+            'lxc.start.auto = 1',
+            'lxc.start.delay = 5'] + mount_configs
+
+        self.start_container(self.container_name, cfgs)
+
+        self.tasker.start_task("Initializing Container",
+                               self.read_cloud_init_output)
+        self.wait_for_cloud_init(self.container_name)
+        log.debug("Container started, cloud-init done.")
+        self.configure_container_network()
+
+        self.tasker.start_task("Installing Dependencies",
+                               self.read_progress_output)
+        self.install_dependencies(self.container_name)
 
     def read_container_status(self):
         return self.cdriver.get_status(self.container_name)
@@ -307,7 +431,7 @@ class SingleInstall:
         except Exception:
             return "Waiting..."
 
-    def cloud_init_finished(self, tries, maxlenient=20):
+    def cloud_init_finished(self, tries, maxlenient=20, name=None):
         """checks cloud-init result.json in container to find out status
 
         For the first `maxlenient` tries, it treats a container with
@@ -318,10 +442,13 @@ class SingleInstall:
         returns True if cloud-init finished with no errors, False if
         it's not done yet, and raises an exception if it had errors.
 
+        'name' defaults to the install's container.
         """
+        if name is None:
+            name = self.container_name
         cmd = 'sh -c "sudo cat /run/cloud-init/result.json 2> /dev/null"'
         try:
-            result_json = self.cdriver.run(self.container_name, cmd)
+            result_json = self.cdriver.run(name, cmd)
 
         except NoContainerIPException as e:
             log.debug("Container has no IPs according to lxc-info. "
@@ -520,7 +647,10 @@ class SingleInstall:
 
         self.set_perms()
 
-        self.create_container_and_wait()
+        if self.config.getopt('golden_image'):
+            self.clone_container_and_wait()
+        else:
+            self.create_container_and_wait()
 
         # Copy over host ssh keys
         for fname in glob.glob(os.path.join(utils.install_home(),
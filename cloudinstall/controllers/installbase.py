@@ -21,6 +21,7 @@ from cloudinstall.config import (INSTALL_TYPE_SINGLE,
                                  INSTALL_TYPE_LANDSCAPE)
 from cloudinstall.state import InstallState
 from cloudinstall.alarms import AlarmMonitor
+from cloudinstall.core import Controller
 import cloudinstall.utils as utils
 from cloudinstall.config import OPENSTACK_RELEASE_LABELS
 from cloudinstall.controllers.install import (SingleInstall,
@@ -97,6 +98,12 @@ class InstallController:
 
     def update(self, *args, **kwargs):
         "periodically check for display changes"
+        if not self.config.getopt('headless') and \
+           isinstance(self.ui.controller, Controller):
+            # the deployment Controller took over the UI, see
+            # MultiInstall.start_deployment. The help and metrics views
+            # set ui.controller too, those don't stop the refresh.
+            return
         if self.config.getopt('current_state') == InstallState.RUNNING:
             pass
         elif self.config.getopt('current_state') == InstallState.NODE_WAIT:
@@ -148,6 +155,9 @@ class InstallController:
                 self.loop.exit(1)
             try:
                 self.do_install()
+            except SystemExit:
+                # the deployment or --install-only is done
+                raise
             except:
                 log.exception("Fatal error")
                 self.loop.exit(1)
@@ -16,12 +16,18 @@
 import logging
 import time
 
+from functools import partial
 from os import path, getenv
 
 from operator import attrgetter
 
 from cloudinstall import async
+from cloudinstall import changes
+from cloudinstall import charm_manifest
+from cloudinstall import charm_repo
 from cloudinstall.config import OPENSTACK_RELEASE_LABELS
+from cloudinstall import remote
+from cloudinstall import trace
 from cloudinstall import utils
 from cloudinstall.alarms import AlarmMonitor
 from cloudinstall.state import ControllerState
@@ -33,6 +39,8 @@ from cloudinstall.log import PrettyLog
 from cloudinstall.placement.controller import (PlacementController,
                                                AssignmentType)
 
+import macumba.api
+from macumba.api import query_cs, query_cs_many
 from macumba.v1 import JujuClient
 from macumba.jobs import Jobs as JujuJobs
 
@@ -40,8 +48,24 @@ from macumba.jobs import Jobs as JujuJobs
 log = logging.getLogger('cloudinstall.core')
 
 
+def _result_error(result):
+    """ returns the message of the error in a juju API bulk call result,
+    or None. The error is null, {Message, Code} or an ErrorResult
+    wrapping one of those.
+    """
+    error = result.get('Error')
+    if isinstance(error, dict) and 'Message' not in error:
+        error = error.get('Error')
+    if not error:
+        return None
+    return error.get('Message') or str(error)
+
+
 class FakeJujuState:
 
+    def __init__(self):
+        self.changes = changes.ChangeBus()
+
     @property
     def services(self):
         return []
@@ -57,6 +81,14 @@ class Controller:
 
     """ Controller for Juju deployments and Maas machine init """
 
+    # seconds between services view refreshes without juju changes, for
+    # what isn't in the juju status, like the glance sync status
+    SERVICES_REFRESH_INTERVAL = 10
+
+    # seconds wait_for_deployed_services_ready() waits for a unit to
+    # start before checking them all again
+    UNITS_STARTED_TIMEOUT = 60
+
     def __init__(self, ui, config, loop):
         self.ui = ui
         self.ui.controller = self
@@ -67,6 +99,8 @@ class Controller:
         self.maas = None
         self.maas_state = None
         self.nodes = []
+        self.services_changed = True
+        self.services_refreshed = 0
         self.juju_m_idmap = None  # for single, {instance_id: machine id}
         self.deployed_charm_classes = []
         self.placement_controller = None
@@ -118,15 +152,22 @@ class Controller:
         """
         if not self.juju_state:
             return
+        if self.ui.services_view and not self.services_changed and \
+           time.time() - self.services_refreshed < \
+           self.SERVICES_REFRESH_INTERVAL:
+            self.ui.update_phase_status(self.config)
+            return
+        self.services_changed = False
+        self.services_refreshed = time.time()
+
         deployed_services = sorted(self.juju_state.services,
                                    key=attrgetter('service_name'))
         deployed_service_names = [s.service_name for s in deployed_services]
 
         charm_classes = sorted(
-            [m.__charm_class__ for m in
-             utils.load_charms(self.config.getopt('charm_plugin_dir'))
-             if m.__charm_class__.charm_name in
-             deployed_service_names],
+            [c for c in charm_manifest.charm_classes(
+                self.config.getopt('charm_plugin_dir'))
+             if c.charm_name in deployed_service_names],
             key=attrgetter('charm_name'))
 
         self.nodes = list(zip(charm_classes, deployed_services))
@@ -141,6 +182,19 @@ class Controller:
             else:
                 self.ui.refresh_services_view(self.nodes, self.config)
 
+    def juju_status_changed(self, change):
+        self.services_changed = True
+
+    def juju_connection_changed(self, state, url):
+        if state == macumba.api.CONNECTION_LOST:
+            self.ui.status_error_message("Lost the connection to the Juju "
+                                         "API, reconnecting")
+        elif state == macumba.api.CONNECTION_RESTORED:
+            self.ui.status_info_message("Reconnected to the Juju API")
+        else:
+            self.ui.status_error_message("Unable to reconnect to the Juju "
+                                         "API")
+
     def authenticate_juju(self):
         uuid = self.config.juju_env['environ-uuid']
         if not len(self.config.juju_env['state-servers']) > 0:
@@ -151,6 +205,10 @@ class Controller:
         self.juju = JujuClient(
             url=url,
             password=self.config.juju_api_password)
+        if self.juju_connection_changed not in \
+           macumba.api.connection_observers:
+            macumba.api.connection_observers.append(
+                self.juju_connection_changed)
         self.juju.login()
         self.juju_state = JujuState(self.juju)
         log.debug('Authenticated against Juju: {}'.format(url))
@@ -161,11 +219,18 @@ class Controller:
             self.juju_state = FakeJujuState()
             self.maas_state = FakeMaasState()
         else:
+            if not macumba.api.CHARMSTORE_CACHE_PATH:
+                macumba.api.CHARMSTORE_CACHE_PATH = path.join(
+                    utils.install_home(), '.cloud-install',
+                    'charmstore-cache.json')
+            if self.config.getopt('charmstore_offline'):
+                macumba.api.CHARMSTORE_OFFLINE = True
             self.authenticate_juju()
-            if self.config.is_multi():
+            if self.config.is_multi() and self.maas is None:
                 creds = self.config.getopt('maascreds')
                 self.maas, self.maas_state = connect_to_maas(creds)
 
+        self.juju_state.changes.subscribe(self.juju_status_changed)
         self.placement_controller = PlacementController(
             self.maas_state, self.config)
 
@@ -234,6 +299,11 @@ class Controller:
                          self.ui.show_exception_message)
 
     def begin_deployment(self):
+        self.prefetch_charms()
+        # multi installs move each machine on its own, see
+        # deploy_pipelined(), unless --serial-deploy
+        pipelined = self.config.is_multi() and \
+            not self.config.getopt('serial_deploy')
         if self.config.is_multi():
 
             # now all machines are added
@@ -241,65 +311,123 @@ class Controller:
             self.maas.nodes_accept_all()
             self.maas.tag_name(self.maas.nodes)
 
-            while not self.all_maas_machines_ready():
-                time.sleep(3)
+            if not pipelined:
+                async.wait_until(self.all_maas_machines_ready,
+                                 name='maas machines ready',
+                                 interval=3, backoff=1.5, max_interval=15,
+                                 wake_on_change=True)
 
-            self.add_machines_to_juju_multi()
+                self.add_machines_to_juju_multi()
 
         elif self.config.is_single():
             self.add_machines_to_juju_single()
 
+        if not pipelined:
+            self.wait_for_juju_machines_started()
+
+        self.config.setopt('current_state', ControllerState.SERVICES.value)
+        ppc = self.config.getopt("postproc_complete")
+        rc = self.config.getopt("relations_complete")
+        if not ppc or not rc:
+            if self.config.is_single():
+                self.configure_single_networking()
+
+            if pipelined:
+                self.deploy_pipelined()
+            else:
+                self.deploy_using_placement()
+            self.wait_for_deployed_services_ready()
+            self.enqueue_deployed_charms()
+        else:
+            self.ui.status_info_message("Ready")
+
+    def wait_for_juju_machines_started(self):
         # Quiet out some of the logging
-        _previous_summary = None
-        while not self.all_juju_machines_started():
+        _previous_summary = [None]
+
+        def juju_machines_started():
+            if self.all_juju_machines_started():
+                return True
             sd = self.juju_state.machines_summary()
             summary = ", ".join(["{} {}".format(v, k) for k, v
                                  in sd.items()])
-            if summary != _previous_summary:
+            if summary != _previous_summary[0]:
                 self.ui.status_info_message("Waiting for machines to "
                                             "start: {}".format(summary))
-                _previous_summary = summary
+                _previous_summary[0] = summary
+            return False
 
-            async.sleep_until(1)
+        async.wait_until(juju_machines_started,
+                         name='juju machines started',
+                         interval=1, backoff=1.5, max_interval=10,
+                         wake_on_change=True)
 
         if len(self.juju_state.machines()) == 0:
             raise Exception("Expected some juju machines started.")
 
-        self.config.setopt('current_state', ControllerState.SERVICES.value)
-        ppc = self.config.getopt("postproc_complete")
-        rc = self.config.getopt("relations_complete")
-        if not ppc or not rc:
-            if self.config.is_single():
-                controller_machine = self.juju_m_idmap['controller']
-                self.configure_lxc_network(controller_machine)
-
-                # Add second nic to VMS after lxc network
-                # is configured
-                if not self.config.getopt('attached_interfaces'):
-                    for i in range(1, 4):
-                        additional_iface_mac = utils.macgen()
-                        cmd = ("virsh attach-interface --domain "
-                               "ubuntu-local-machine-{} "
-                               "--type bridge --source lxcbr0 --model virtio "
-                               "--mac {} --config --live".format(
-                                   i,
-                                   additional_iface_mac))
-                        log.debug("Adding second interface "
-                                  "to machine: {}".format(cmd))
-                        out = utils.get_command_output(cmd)
-                        log.debug("Result: {}".format(out))
-                        utils.remote_run(
-                            i,
-                            cmds="sudo /sbin/sysctl -w net.ipv4.ip_forward=1",
-                            juju_home=self.config.juju_home(
-                                use_expansion=True))
-                    self.config.setopt('attached_interfaces', True)
-
-            self.deploy_using_placement()
-            self.wait_for_deployed_services_ready()
-            self.enqueue_deployed_charms()
-        else:
-            self.ui.status_info_message("Ready")
+    def configure_single_networking(self):
+        controller_machine = self.juju_m_idmap['controller']
+        self.configure_lxc_network(controller_machine)
+
+        # Add second nic to VMS after lxc network
+        # is configured
+        if not self.config.getopt('attached_interfaces'):
+            for i in range(1, 4):
+                additional_iface_mac = utils.macgen()
+                cmd = ("virsh attach-interface --domain "
+                       "ubuntu-local-machine-{} "
+                       "--type bridge --source lxcbr0 --model virtio "
+                       "--mac {} --config --live".format(
+                           i,
+                           additional_iface_mac))
+                log.debug("Adding second interface "
+                          "to machine: {}".format(cmd))
+                out = utils.get_command_output(cmd)
+                log.debug("Result: {}".format(out))
+            remote.run(self.juju, range(1, 4),
+                       "sudo /sbin/sysctl -w net.ipv4.ip_forward=1")
+            self.config.setopt('attached_interfaces', True)
+
+    def prefetch_charms(self):
+        """ Adds every assigned charm to juju in the background, so the
+        state server downloads them while machines are still coming up
+        instead of during each deploy. Charms deployed from branches are
+        fetched into the local charm repository instead.
+        """
+        repo = charm_repo.get(self.config)
+        charm_names = []
+        # in the order they are deployed
+        for c in sorted(self.placement_controller.assigned_charm_classes(),
+                        key=attrgetter('deploy_priority')):
+            source = charm_repo.charm_source(c, self.config)
+            if source is not None:
+                repo.prefetch(c.charm_name, *source)
+            elif 'charmstore' in c.available_sources:
+                charm_names.append(c.charm_name)
+        if not charm_names:
+            return
+        try:
+            # one charm store request for all, the deploys reuse them
+            query_cs_many(charm_names)
+        except Exception as e:
+            log.warning("Unable to look up charms in the charm store: "
+                        "{}".format(e))
+        for charm_name in charm_names:
+            # deploys add these themselves if they get there first
+            async.submit(partial(self.prefetch_charm, charm_name),
+                         self.ui.show_exception_message, lane='prefetch',
+                         priority=async.PRIORITY_LOW)
+
+    def prefetch_charm(self, charm_name):
+        try:
+            charm_url = query_cs(charm_name)['Id']
+            self.juju.add_charm(charm_url)
+        except Exception as e:
+            # the deploy will fetch it
+            log.warning("Unable to prefetch charm {}: {}".format(charm_name,
+                                                                 e))
+            return
+        log.debug("Prefetched charm {}".format(charm_url))
 
     def all_maas_machines_ready(self):
         self.maas_state.invalidate_nodes_cache()
@@ -324,15 +452,17 @@ class Controller:
             return False
         return True
 
-    def add_machines_to_juju_multi(self):
-        """Adds each of the machines used for the placement to juju, if it
-        isn't already there."""
+    def add_machines_to_juju_multi(self, machines=None):
+        """Adds each of the machines used for the placement, or the given
+        ones, to juju, if it isn't already there."""
 
         self.juju_state.invalidate_status_cache()
         juju_ids = [jm.instance_id for jm in self.juju_state.machines()]
 
+        if machines is None:
+            machines = self.placement_controller.machines_pending()
         machine_params = []
-        for maas_machine in self.placement_controller.machines_pending():
+        for maas_machine in machines:
             if maas_machine.instance_id in juju_ids:
                 # ignore machines that are already added to juju
                 continue
@@ -342,11 +472,10 @@ class Controller:
             machine_params.append(mp)
 
         if len(machine_params) > 0:
-            import pprint
-            log.debug("calling add_machines with params:"
-                      " {}".format(pprint.pformat(machine_params)))
+            log.debug("calling add_machines with params: %s",
+                      PrettyLog(machine_params))
             rv = self.juju.add_machines(machine_params)
-            log.debug("add_machines returned '{}'".format(rv))
+            log.debug("add_machines returned '%s'", rv)
 
     def all_juju_machines_started(self):
         self.juju_state.invalidate_status_cache()
@@ -356,25 +485,31 @@ class Controller:
         return n_allocated >= n_needed
 
     def add_machines_to_juju_single(self):
+        """Adds the pending placeholder machines to juju, unless a juju
+        machine annotated with their instance_id exists already.
+
+        Reads the annotations, adds the machines and annotates them in
+        one API call each.
+        """
         self.juju_state.invalidate_status_cache()
         self.juju_m_idmap = {}
-        for jm in self.juju_state.machines():
-            response = self.juju.get_annotations(jm.machine_id,
-                                                 'machine')
-            ann = response['Annotations']
-            if 'instance_id' in ann:
-                self.juju_m_idmap[ann['instance_id']] = jm.machine_id
+        tags = ["machine-{}".format(jm.machine_id)
+                for jm in self.juju_state.machines()]
+        if tags:
+            response = self.juju.get_entities_annotations(tags)
+            for tag, result in zip(tags, response['Results']):
+                error = _result_error(result)
+                if error:
+                    raise Exception("Error getting annotations of "
+                                    "{}: {}".format(tag, error))
+                ann = result['Annotations'] or {}
+                if 'instance_id' in ann:
+                    self.juju_m_idmap[ann['instance_id']] = \
+                        tag.split('-', 1)[1]
 
         log.debug("existing juju machines: {}".format(self.juju_m_idmap))
 
-        def get_created_machine_id(iid, response):
-            d = response['Machines'][0]
-            if d['Error']:
-                raise Exception("Error adding machine '{}':"
-                                "{}".format(iid, response))
-            else:
-                return d['Machine']
-
+        new_machines = []
         for machine in self.placement_controller.machines_pending():
             if machine.instance_id in self.juju_m_idmap:
                 machine.machine_id = self.juju_m_idmap[machine.instance_id]
@@ -384,38 +519,60 @@ class Controller:
                 continue
             log.debug("adding machine with "
                       "constraints={}".format(machine.constraints))
-            rv = self.juju.add_machine(constraints=machine.constraints)
-            m_id = get_created_machine_id(machine.instance_id, rv)
-            machine.machine_id = m_id
-            rv = self.juju.set_annotations(m_id, 'machine',
-                                           {'instance_id':
-                                            machine.instance_id})
-            self.juju_m_idmap[machine.instance_id] = m_id
-
-    def run_apt_go_fast(self, machine_id):
-        utils.remote_cp(machine_id,
-                        src=path.join(self.config.share_path,
-                                      "tools/apt-go-fast"),
-                        dst="/tmp/apt-go-fast",
-                        juju_home=self.config.juju_home(use_expansion=True))
-        utils.remote_run(machine_id,
-                         cmds="sudo sh /tmp/apt-go-fast",
-                         juju_home=self.config.juju_home(use_expansion=True))
-
-    def configure_lxc_network(self, machine_id):
-        # upload our lxc-host-only template and setup bridge
-        log.info('Copying network specifications to machine')
+            new_machines.append(machine)
+        if not new_machines:
+            return
+
+        rv = self.juju.add_machines([
+            self.juju.machine_params(constraints=machine.constraints)
+            for machine in new_machines])
+        errors = []
+        annotations = {}
+        for machine, result in zip(new_machines, rv['Machines']):
+            error = _result_error(result)
+            if error:
+                errors.append("Error adding machine '{}':"
+                              "{}".format(machine.instance_id, error))
+                continue
+            machine.machine_id = result['Machine']
+            annotations["machine-{}".format(machine.machine_id)] = {
+                'instance_id': machine.instance_id}
+            self.juju_m_idmap[machine.instance_id] = machine.machine_id
+
+        # annotate what was added even if some failed, so that a restart
+        # doesn't add those again
+        if annotations:
+            rv = self.juju.set_entities_annotations(annotations)
+            errors += ["Error annotating machines: {}".format(error)
+                       for error in map(_result_error, rv['Results'] or [])
+                       if error]
+        if errors:
+            raise Exception("\n".join(errors))
+
+    def run_apt_go_fast(self, machine_ids):
+        remote.run(self.juju, machine_ids,
+                   cmds="sudo sh /tmp/apt-go-fast",
+                   files=[(path.join(self.config.share_path,
+                                     "tools/apt-go-fast"),
+                           "/tmp/apt-go-fast")])
+
+    def configure_lxc_network(self, machine_ids):
+        """ uploads our lxc-host-only template and sets up the bridge on
+        all machine_ids in a single remote call
+        """
+        if type(machine_ids) is not list:
+            machine_ids = [machine_ids]
+        log.info('Copying network specifications to machines')
         srcpath = path.join(self.config.tmpl_path, 'lxc-host-only')
         destpath = "/tmp/lxc-host-only"
-        utils.remote_cp(machine_id, src=srcpath, dst=destpath,
-                        juju_home=self.config.juju_home(use_expansion=True))
-        log.debug('Updating network configuration for machine')
-        utils.remote_run(machine_id,
-                         cmds="sudo chmod +x /tmp/lxc-host-only",
-                         juju_home=self.config.juju_home(use_expansion=True))
-        utils.remote_run(machine_id,
-                         cmds="sudo /tmp/lxc-host-only",
-                         juju_home=self.config.juju_home(use_expansion=True))
+        results = remote.run(self.juju, machine_ids,
+                             cmds=["sudo chmod +x {}".format(destpath),
+                                   "sudo {}".format(destpath)],
+                             files=[(srcpath, destpath)])
+        for m_id, out in results.items():
+            if out['status'] > 0:
+                log.error("Updating network configuration for machine "
+                          "{} failed: {}".format(m_id, out))
 
     def deploy_using_placement(self):
         """Deploy charms using machine placement from placement controller,
@@ -437,7 +594,7 @@ class Controller:
                              undeployed_charm_classes()]
             self.ui.set_pending_deploys(pending_names)
 
-        while len(undeployed_charm_classes()) > 0:
+        def deploy_pass():
             update_pending_display()
 
             for charm_class in undeployed_charm_classes():
@@ -455,7 +612,8 @@ class Controller:
                     self.deployed_charm_classes.append(charm_class)
                     continue
 
-                err = self.try_deploy(charm_class)
+                with trace.span(charm_class.charm_name, 'deploy'):
+                    err = self.try_deploy(charm_class)
                 name = charm_class.display_name
                 if err:
                     log.debug(
@@ -472,11 +630,94 @@ class Controller:
             num_remaining = len(undeployed_charm_classes())
             if num_remaining > 0:
                 log.debug("{} charms pending deploy.".format(num_remaining))
-                log.debug("deployed_charm_classes={}".format(
-                    PrettyLog(self.deployed_charm_classes)))
-
-                async.sleep_until(5)
+                log.debug("deployed_charm_classes=%s",
+                          PrettyLog(self.deployed_charm_classes))
             update_pending_display()
+            return num_remaining == 0
+
+        async.wait_until(deploy_pass, name='deploy using placement',
+                         interval=5, wake_on_change=True)
+
+    def deploy_pipelined(self):
+        """Moves each placed machine through MAAS ready, added to juju and
+        started on its own, deploying each charm as soon as all machines
+        it is assigned to have started. A slow machine only holds up the
+        charms placed on it.
+
+        Relations between the services are set once both ends are
+        deployed, by the CharmQueue, so charms need no other ordering.
+        """
+        self.ui.status_info_message("Deploying services as their machines "
+                                    "start")
+        pc = self.placement_controller
+        charm_classes = sorted(pc.assigned_charm_classes(),
+                               key=attrgetter('deploy_priority'))
+        machines = pc.machines_pending()
+        machine_ids = set(m.instance_id for m in machines)
+        cons = self.config.getopt('constraints')
+        # instance ids of the machines added to juju, which juju only
+        # reports once they are provisioned
+        added = set()
+        _previous_summary = [None]
+
+        def undeployed_charm_classes():
+            return [c for c in charm_classes
+                    if c not in self.deployed_charm_classes]
+
+        def machines_started(charm_class, started):
+            return all(m.instance_id in started
+                       for ml in pc.get_assignments(charm_class).values()
+                       for m in ml if not pc.is_placeholder(m.instance_id))
+
+        def pipeline_pass():
+            self.juju_state.invalidate_status_cache()
+            juju_machines = self.juju_state.machines()
+            added.update(jm.instance_id for jm in juju_machines)
+            started = set(jm.instance_id for jm in juju_machines
+                          if jm.agent_state == 'started')
+
+            self.maas_state.invalidate_nodes_cache()
+            ready = set(m.instance_id for status in
+                        [MaasMachineStatus.READY, MaasMachineStatus.ALLOCATED]
+                        for m in self.maas_state.machines(
+                            status, constraints=cons))
+            new_machines = [m for m in machines
+                            if m.instance_id in ready and
+                            m.instance_id not in added]
+            if new_machines:
+                self.add_machines_to_juju_multi(new_machines)
+                added.update(m.instance_id for m in new_machines)
+
+            service_names = [s.service_name for s in
+                             self.juju_state.services]
+            for charm_class in undeployed_charm_classes():
+                if charm_class.charm_name in service_names:
+                    self.deployed_charm_classes.append(charm_class)
+                    continue
+                if not machines_started(charm_class, started):
+                    continue
+                with trace.span(charm_class.charm_name, 'deploy'):
+                    err = self.try_deploy(charm_class)
+                if not err:
+                    log.debug("Issued deploy for {}".format(
+                        charm_class.display_name))
+                    self.deployed_charm_classes.append(charm_class)
+                    self.juju_state.invalidate_status_cache()
+
+            pending = undeployed_charm_classes()
+            self.ui.set_pending_deploys([c.display_name for c in pending])
+            summary = ("{} of {} machines ready, {} started, {} services "
+                       "waiting".format(len(ready & machine_ids),
+                                        len(machines), len(started),
+                                        len(pending)))
+            if summary != _previous_summary[0]:
+                self.ui.status_info_message(summary)
+                _previous_summary[0] = summary
+            return len(pending) == 0
+
+        async.wait_until(pipeline_pass, name='pipelined deploy',
+                         interval=1, backoff=1.5, max_interval=10,
+                         wake_on_change=True)
 
     def try_deploy(self, charm_class):
         "returns True if deploy is deferred and should be tried again."
@@ -488,38 +729,35 @@ class Controller:
 
         asts = self.placement_controller.get_assignments(charm_class)
         errs = []
-        first_deploy = True
+        placed = []
         for atype, ml in asts.items():
             for machine in ml:
                 mspec = self.get_machine_spec(machine, atype)
                 if mspec is None:
                     errs.append(machine)
-                    continue
-
-                if first_deploy:
-                    msg = "Deploying {c}".format(c=charm_class.display_name)
-                    if mspec != '':
-                        msg += " to machine {mspec}".format(mspec=mspec)
-                    self.ui.status_info_message(msg)
-                    deploy_err = charm.deploy(mspec)
-                    if deploy_err:
-                        errs.append(machine)
-                    else:
-                        first_deploy = False
                 else:
-                    # service already deployed, need to add-unit
-                    msg = ("Adding one unit of "
-                           "{c}".format(c=charm_class.display_name))
-                    if mspec != '':
-                        msg += " to machine {mspec}".format(mspec=mspec)
-                    self.ui.status_info_message(msg)
-                    deploy_err = charm.add_unit(machine_spec=mspec)
-                    if deploy_err:
-                        errs.append(machine)
-                if not deploy_err:
-                    self.placement_controller.mark_deployed(machine,
-                                                            charm_class,
-                                                            atype)
+                    placed.append((machine, atype, mspec))
+
+        if placed:
+            # all units in one ServiceDeploy call
+            mspecs = [mspec for _, _, mspec in placed]
+            if len(mspecs) == 1:
+                msg = "Deploying {c}".format(c=charm_class.display_name)
+            else:
+                msg = "Deploying {n} units of {c}".format(
+                    n=len(mspecs), c=charm_class.display_name)
+            targets = [mspec for mspec in mspecs if mspec != '']
+            if targets:
+                msg += " to machine{s} {mspecs}".format(
+                    s='s' if len(targets) > 1 else '',
+                    mspecs=", ".join(targets))
+            self.ui.status_info_message(msg)
+            if charm.deploy(mspecs):
+                errs += [machine for machine, _, _ in placed]
+            else:
+                self.placement_controller.mark_all_deployed(
+                    [(machine, charm_class, atype)
+                     for machine, atype, _ in placed])
 
         had_err = len(errs) > 0
         if had_err and not self.config.getopt('headless'):
@@ -536,9 +774,8 @@ class Controller:
             # placeholder machines do not use a machine spec
             return ""
 
-        jm = next((m for m in self.juju_state.machines()
-                   if (m.instance_id == maas_machine.instance_id or
-                       m.machine_id == maas_machine.machine_id)), None)
+        jm = self.juju_state.machine_by_instance_id(
+            maas_machine.instance_id, maas_machine.machine_id)
         if jm is None:
             log.error("could not find juju machine matching {}"
                       " (instance id {})".format(maas_machine,
@@ -567,18 +804,15 @@ class Controller:
         self.ui.status_info_message(
             "Waiting for deployed services to be in a ready state.")
 
-        not_ready_len = 0
+        # re-checked as units start, or every UNITS_STARTED_TIMEOUT
+        # seconds for any start missed before waiting on the next one
         while not self.juju_state.all_agents_started():
-            not_ready = [(a, b) for a, b in self.juju_state.get_agent_states()
-                         if b != 'started']
-            if len(not_ready) == not_ready_len:
-                async.sleep_until(3)
-                continue
-
-            not_ready_len = len(not_ready)
-            log.info("Checking availability of {} ".format(
-                ", ".join(["{}:{}".format(a, b) for a, b in not_ready])))
-            async.sleep_until(3)
+            started = self.juju_state.changes.wait_for(
+                kind=changes.UNIT, field='agent_state', new='started',
+                name='unit started', timeout=self.UNITS_STARTED_TIMEOUT,
+                poll=self.juju_state.status)
+            if started:
+                log.info("{} started".format(started.entity))
 
         self.config.setopt('deploy_complete', True)
         self.ui.status_info_message(
@@ -597,20 +831,22 @@ class Controller:
             charm_q.watch_post_proc()
         else:
             async.submit(charm_q.watch_relations,
-                         self.ui.show_exception_message)
+                         self.ui.show_exception_message,
+                         lane='relations')
             async.submit(charm_q.watch_post_proc,
-                         self.ui.show_exception_message)
+                         self.ui.show_exception_message,
+                         lane='postproc')
 
         charm_q.is_running = True
 
         # Exit cleanly if we've finished all deploys, relations,
         # post processing, and running in headless mode.
         if self.config.getopt('headless'):
-            while not self.config.getopt('postproc_complete'):
-                self.ui.status_info_message(
-                    "Waiting for services to be started.")
-                # FIXME: Is this needed?
-                # time.sleep(10)
+            self.ui.status_info_message(
+                "Waiting for services to be started.")
+            async.wait_until(lambda: self.config.getopt('postproc_complete'),
+                             name='postproc complete',
+                             interval=1, backoff=1.5, max_interval=10)
             self.ui.status_info_message(
                 "All services deployed, relations set, and started")
             self.loop.exit(0)
@@ -651,8 +887,12 @@ class Controller:
                                      self.maas_state, self.config)
         self.loop.redraw_screen()
 
-    def start(self):
+    def start(self, run_loop=True):
         """ Starts UI loop
+
+        :param bool run_loop: False when taking over a loop that is
+                              already running, see
+                              MultiInstall.start_deployment
         """
         if self.config.getopt('headless'):
             self.initialize()
@@ -666,5 +906,6 @@ class Controller:
             AlarmMonitor.add_alarm(self.loop.set_alarm_in(0, self.update),
                                    "controller-start")
             self.config.setopt("gui_started", True)
-            self.loop.run()
-            self.loop.close()
+            if run_loop:
+                self.loop.run()
+                self.loop.close()
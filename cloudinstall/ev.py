@@ -73,6 +73,14 @@ class EventLoop:
                 self.ui.focus_previous()
             if key in ['h', 'H', '?']:
                 self.ui.show_help_info()
+            if key in ['m', 'M']:
+                self.ui.show_metrics_info()
+            if key in ['p', 'P'] and 'toggle_profiler' in self._callback_map:
+                if self._callback_map['toggle_profiler']():
+                    self.ui.status_info_message("Profiling started")
+                else:
+                    self.ui.status_info_message(
+                        "Profiling stopped, see ~/.cloud-install/profiles")
             if key in ['a', 'A', 'f6']:
                 if self.config.getopt('current_state') != \
                    ControllerState.SERVICES:
@@ -34,6 +34,7 @@ from cloudinstall.ui.views import (ErrorView,
                                    ServicesView,
                                    MachineWaitView,
                                    HelpView,
+                                   MetricsView,
                                    NodeInstallWaitView,
                                    StepInfoView)
 from cloudinstall.ui.utils import Color
@@ -155,6 +156,10 @@ class PegasusGUI(WidgetWrap):
         self.controller = self.frame.body
         self.frame.body = HelpView()
 
+    def show_metrics_info(self):
+        self.controller = self.frame.body
+        self.frame.body = MetricsView()
+
     def show_step_info(self, msg):
         self.frame.body = StepInfoView(msg)
 
@@ -187,6 +192,10 @@ class PegasusGUI(WidgetWrap):
     def set_openstack_rel(self, release):
         self.frame.header.set_openstack_rel(release)
 
+    def set_header(self, header):
+        self.header = header
+        self.frame.header = header
+
     def clear_status(self):
         try:
             self.frame.footer.clear()
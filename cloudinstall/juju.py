@@ -18,8 +18,11 @@
 
 from collections import Counter
 import logging
+import threading
 import time
 
+from cloudinstall import async
+from cloudinstall import changes
 from cloudinstall.machine import Machine
 from cloudinstall.service import Service
 
@@ -40,6 +43,17 @@ class JujuState:
         self.juju = juju
         self.start_time = time.time()
         self._juju_status = None
+        self._previous_status = None
+        # one full status fetch at a time, the others use its result
+        self._status_lock = threading.RLock()
+        # changes between successive full statuses
+        self.changes = changes.ChangeBus()
+        self._changes_lock = threading.Lock()
+        # sorted patterns -> (fetch time, status)
+        self._scoped_statuses = {}
+        self._previous_scoped_statuses = {}
+        # juju machine ids by instance id, from the machines seen so far
+        self._machine_ids = {}
         self.valid_states = ['pending', 'started', 'down']
 
     def get_agent_states(self):
@@ -61,7 +75,7 @@ class JujuState:
         return all([state == "started" for _, state in
                     self.get_agent_states()])
 
-    def status(self):
+    def status(self, patterns=None):
         """Returns juju status.
         Caches value for 20 seconds.
 
@@ -71,26 +85,68 @@ class JujuState:
         If request times out (macumba default is 60 seconds), retries
         5 times.
 
+        A fetched status that differs from the previous one publishes
+        the differences on self.changes, then wakes up any waiters
+        blocked in async.wait_until(wake_on_change=True). Nothing fetches
+        the status in the background, changes are found by callers.
+
+        :param list patterns: only fetch the machines, services and
+                              units matching these. Scoped statuses are
+                              cached separately, and the full status
+                              stands in for them while it is cached.
         """
-        elapsed_time = time.time() - self.start_time
+        if patterns:
+            return self._scoped_status(tuple(sorted(patterns)))
+
+        with self._status_lock:
+            elapsed_time = time.time() - self.start_time
+            if not self._juju_status or elapsed_time > 20:
+                self._juju_status = None
+                self._juju_status = self._fetch_status()
+                self.start_time = time.time()
+                self._publish_changes(self._juju_status)
+            return self._juju_status
+
+    def _publish_changes(self, status):
+        # in order, however many threads fetch the status
+        with self._changes_lock:
+            if status == self._previous_status:
+                return
+            self.changes.publish(changes.diff(self._previous_status, status))
+            self._previous_status = status
+        async.notify_waiters()
+
+    def _scoped_status(self, patterns):
+        if self._juju_status and time.time() - self.start_time <= 20:
+            return self._juju_status
+
+        fetched, status = self._scoped_statuses.get(patterns, (0, None))
+        if status is None or time.time() - fetched > 20:
+            status = self._fetch_status(patterns)
+            self._scoped_statuses[patterns] = (time.time(), status)
+            if status != self._previous_scoped_statuses.get(patterns):
+                self._previous_scoped_statuses[patterns] = status
+                async.notify_waiters()
+        return status
+
+    def _fetch_status(self, patterns=None):
         n_retries = 0
-        if not self._juju_status or elapsed_time > 20:
-            self._juju_status = None
-            while self._juju_status is None:
-                try:
-                    self._juju_status = self.juju.status()
-                except RequestTimeout:
-                    n_retries += 1
-                    if n_retries == 5:
-                        raise Exception("Connection failure with juju API")
-            self.start_time = time.time()
-        return self._juju_status
+        while True:
+            try:
+                if patterns:
+                    return self.juju.status(list(patterns))
+                return self.juju.status()
+            except RequestTimeout:
+                n_retries += 1
+                if n_retries == 5:
+                    raise Exception("Connection failure with juju API")
 
     def invalidate_status_cache(self):
         """Invalidates cache of status.  Use this to force fetching from
         server more often than every 20 seconds.
         """
         self._juju_status = None
+        self._scoped_statuses.clear()
 
     def machines_summary(self):
         """ Returns summary of known machines and their status
@@ -127,21 +183,45 @@ class JujuState:
                 return m
         return Machine('-', {})
 
-    def machines(self):
+    def machines(self, patterns=None):
         """ Machines property
 
+        :param list patterns: only query the machines matching these
         :returns: machines known to juju (except bootstrap)
         :rtype: list
         """
-        ret = self.status()
+        ret = self.status(patterns)
         machines = []
 
         for machine_id, machine in ret.get('Machines', {}).items():
             if '0' == machine_id:
                 continue
-            machines.append(Machine(machine_id, machine))
+            m = Machine(machine_id, machine)
+            if m.instance_id not in [None, '', 'pending']:
+                self._machine_ids[m.instance_id] = machine_id
+            machines.append(m)
         return machines
 
+    def machine_by_instance_id(self, instance_id, machine_id=-1):
+        """ Returns the juju machine provisioned as instance_id, or as
+        machine_id if that is known, else None
+
+        Once the juju machine id is known, from machine_id or an earlier
+        listing, only that machine is queried.
+        """
+        def find(machines):
+            return next((m for m in machines
+                         if (m.instance_id == instance_id or
+                             m.machine_id == machine_id)), None)
+
+        if machine_id == -1:
+            machine_id = self._machine_ids.get(instance_id, -1)
+        if machine_id != -1:
+            m = find(self.machines([str(machine_id)]))
+            if m is not None:
+                return m
+        return find(self.machines())
+
     def machine_or_container(self, machine_id):
         """ returns machine or container matching the id
         """
@@ -176,16 +256,17 @@ class JujuState:
                  m.agent['Status'] in self.valid_states)]
 
     def service(self, name):
-        """ Return a single service entry
+        """ Return a single service entry, only querying that service
 
         :param str name: service/charm name
         :returns: a service entry or None
         :rtype: :class:`~cloudinstall.service.Service`
         """
-        for s in self.services:
-            if s.service_name == name:
-                return s
-        return Service(name, {})
+        ret = self.status([name])
+        service = ret.get('Services', {}).get(name)
+        if service is None:
+            return Service(name, {})
+        return Service(name, service)
 
     @property
     def services(self):
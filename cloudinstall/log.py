@@ -20,14 +20,34 @@
 """
 
 from __future__ import unicode_literals
+import atexit
+import copy
 import logging
 import os
 import pprint
+import queue
+import threading
+import time
 
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import (QueueHandler, QueueListener,
+                              TimedRotatingFileHandler)
+
+# Per logger budgets, overridable with UCI_LOG_MAX_SIZE and UCI_LOG_RATE
+LOG_MAX_SIZE = 16384  # characters per message
+LOG_RATE = 600  # records per logger per LOG_RATE_WINDOW seconds
+LOG_RATE_WINDOW = 60
+
+_listener = None
 
 
 class PrettyLog():
+    """ Defers pretty printing 'obj' to the thread writing the log,
+    skipping it for records below the logger's level or over the
+    logger's rate.
+
+    Pass it as a logging argument for that to happen:
+    log.debug("status: %s", PrettyLog(status))
+    """
 
     def __init__(self, obj):
         self.obj = obj
@@ -35,6 +55,144 @@ class PrettyLog():
     def __repr__(self):
         return pprint.pformat(self.obj)
 
+    __str__ = __repr__
+
+
+class LogBudget:
+    """ Drops records from loggers exceeding their rate and truncates
+    oversized messages, keeping count of what was suppressed.
+
+    admit() runs where the record is logged, before anything is
+    formatted, trim() where it is written.
+    """
+
+    def __init__(self, max_size=LOG_MAX_SIZE, rate=LOG_RATE,
+                 window=LOG_RATE_WINDOW):
+        self.max_size = max_size
+        self.rate = rate
+        self.window = window
+        # logger name -> [window start, records in window, suppressed]
+        self.windows = {}
+        self.suppressed = {}
+        self.truncated = {}
+        self.lock = threading.Lock()
+
+    def admit(self, record):
+        """ False for records over their logger's rate """
+        now = time.time()
+        with self.lock:
+            w = self.windows.setdefault(record.name, [now, 0, 0])
+            if now - w[0] >= self.window:
+                if w[2]:
+                    record.budget_note = "[{} records from {} suppressed " \
+                        "in the last {:.0f}s]".format(w[2], record.name,
+                                                      now - w[0])
+                w[:] = [now, 0, 0]
+            w[1] += 1
+            if w[1] > self.rate and record.levelno < logging.WARNING:
+                w[2] += 1
+                self.suppressed[record.name] = \
+                    self.suppressed.get(record.name, 0) + 1
+                return False
+        return True
+
+    def trim(self, record):
+        """ Formats the message, truncated to max_size and preceded by
+        the count of records suppressed before it, if any
+        """
+        note = getattr(record, 'budget_note', None)
+        msg = record.getMessage()
+        if len(msg) > self.max_size:
+            with self.lock:
+                self.truncated[record.name] = \
+                    self.truncated.get(record.name, 0) + 1
+            msg = "{}... [{} characters truncated]".format(
+                msg[:self.max_size], len(msg) - self.max_size)
+        if note:
+            msg = note + "\n" + msg
+        record.msg = msg
+        record.args = None
+
+    def summary(self):
+        with self.lock:
+            return ["{}: {} records suppressed, {} truncated".format(
+                name, self.suppressed.get(name, 0),
+                self.truncated.get(name, 0))
+                for name in sorted(set(self.suppressed) |
+                                   set(self.truncated))]
+
+
+# logging arguments safe to format later, on the listener thread
+IMMUTABLE_TYPES = (str, bytes, int, float, complex, bool, type(None))
+
+
+def _immutable(arg):
+    if isinstance(arg, (tuple, frozenset)):
+        return all(_immutable(a) for a in arg)
+    return isinstance(arg, IMMUTABLE_TYPES)
+
+
+class LazyQueueHandler(QueueHandler):
+    """ Queues records without formatting them, so the listener thread
+    does the formatting and file I/O instead of the logging thread.
+    Records over their logger's budget rate are dropped first.
+
+    Arguments that can change meanwhile, such as a PrettyLog of live
+    state, are queued as a copy of what they were when logged. The few
+    that can't be copied are formatted here. Errors go to handleError,
+    as for any handler.
+    """
+
+    def __init__(self, q, budget=None):
+        super().__init__(q)
+        if budget is not None:
+            self.addFilter(budget.admit)
+
+    def prepare(self, record):
+        args = record.args
+        if args and not _immutable(
+                tuple(args.values()) if isinstance(args, dict) else args):
+            try:
+                record.args = copy.deepcopy(args)
+            except Exception:
+                record.msg = record.getMessage()
+                record.args = None
+        return record
+
+
+class BudgetQueueListener(QueueListener):
+
+    def __init__(self, q, *handlers, budget=None):
+        super().__init__(q, *handlers, respect_handler_level=True)
+        self.budget = budget or LogBudget()
+
+    def handle(self, record):
+        try:
+            if record.exc_info and not record.exc_text:
+                # format tracebacks before the budget rewrites the message
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+            self.budget.trim(record)
+        except Exception:
+            # drop it, an exception here would end the listener thread
+            # and every record after this one with it
+            if self.handlers:
+                self.handlers[0].handleError(record)
+            return
+        super().handle(record)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        super().stop()
+        lines = self.budget.summary()
+        if lines:
+            record = logging.LogRecord(
+                'cloudinstall.log', logging.INFO, __file__, 0,
+                "Log budget summary:\n  " + "\n  ".join(lines), None, None)
+            for handler in self.handlers:
+                handler.handle(record)
+
 
 def setup_logger(name=__name__, headless=False):
     """setup logging
@@ -64,6 +222,11 @@ def setup_logger(name=__name__, headless=False):
         # Disable log filtering
         $ UCI_NOFILTER=1 openstack-status
 
+    Records are written by a listener thread. Messages longer than
+    `UCI_LOG_MAX_SIZE` characters are truncated, and records below
+    WARNING beyond `UCI_LOG_RATE` per logger per minute are dropped,
+    with a count of suppressed records logged afterwards.
+
     :params str name: logger name
     :returns: a log object
 
@@ -102,8 +265,27 @@ def setup_logger(name=__name__, headless=False):
         commandslog.addFilter(f)
         if headless:
             consolelog.addFilter(f)
-    logger.addHandler(commandslog)
+
+    handlers = [commandslog]
     if headless:
-        logger.addHandler(consolelog)
+        handlers.append(consolelog)
+    budget = LogBudget(
+        max_size=int(os.environ.get('UCI_LOG_MAX_SIZE', LOG_MAX_SIZE)),
+        rate=int(os.environ.get('UCI_LOG_RATE', LOG_RATE)))
+    log_queue = queue.Queue()
+    global _listener
+    _listener = BudgetQueueListener(log_queue, *handlers, budget=budget)
+    _listener.start()
+    atexit.register(_listener.stop)
+    logger.addHandler(LazyQueueHandler(log_queue, budget))
 
     return logger
+
+
+def stop_logger():
+    """ Writes out queued records and stops the listener thread.
+
+    Call before exec'ing another program, exit handlers don't run then.
+    """
+    if _listener is not None:
+        _listener.stop()
@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from cloudinstall import async
+from cloudinstall.log import PrettyLog
 from cloudinstall.machine import Machine
 from cloudinstall.utils import human_to_mb
 from maasclient.auth import MaasAuth
@@ -294,14 +296,20 @@ class MaasState:
     def __init__(self, maas_client):
         self.maas_client = maas_client
         self._maas_client_nodes = None
+        self._previous_nodes = None
         self.start_time = time.time()
 
     def nodes(self, constraints=None):
         """ Cache MAAS nodes
+
+        Wakes up status waiters when the node list changed.
         """
         elapsed_time = time.time() - self.start_time
         if not self._maas_client_nodes or elapsed_time > 20:
             self._maas_client_nodes = self.maas_client.nodes
+            if self._maas_client_nodes != self._previous_nodes:
+                self._previous_nodes = self._maas_client_nodes
+                async.notify_waiters()
             self._filtered_nodes = self._maas_client_nodes
             if constraints:
                 cd = dict(x.split('=') for x in constraints.split(' '))
@@ -367,9 +375,10 @@ class MaasState:
     def machines_summary(self):
         """ Returns summary of known machines and their states.
         """
-        log.debug("in summary, self.nodes is {}".format(self.nodes()))
+        nodes = self.nodes()
+        log.debug("in summary, self.nodes is %s", PrettyLog(nodes))
         return Counter([MaasMachineStatus(m['status'])
-                        for m in self.nodes()])
+                        for m in nodes])
 
 
 def connect_to_maas(creds=None):
@@ -0,0 +1,217 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" API call metrics
+
+Records count, latency, payload size, timeouts and errors of every juju
+API call and MAAS request, keyed by facade/request or MAAS endpoint.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+
+from requests.exceptions import Timeout
+
+from cloudinstall import async
+import maasclient
+import macumba.api
+from macumba.errors import RequestTimeout
+
+log = logging.getLogger('cloudinstall.metrics')
+
+# Upper bounds (seconds) of the latency histogram buckets, the last
+# bucket counts everything slower.
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class RequestStats:
+    """ Aggregated metrics for one kind of request """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, elapsed, sent, received, error=False, timeout=False):
+        self.count += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.bytes_sent += sent
+        self.bytes_received += received
+        if timeout:
+            self.timeouts += 1
+        elif error:
+            self.errors += 1
+        for i, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    def percentile(self, p):
+        """ returns the upper bound of the bucket holding the p-th
+        percentile, None if it is in the overflow bucket.
+        """
+        if self.count == 0:
+            return 0
+        target = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.histogram):
+            seen += n
+            if seen >= target:
+                return BUCKETS[i] if i < len(BUCKETS) else None
+        return None
+
+    def to_dict(self):
+        return dict(count=self.count,
+                    errors=self.errors,
+                    timeouts=self.timeouts,
+                    total_time=self.total_time,
+                    max_time=self.max_time,
+                    mean_time=self.total_time / self.count
+                    if self.count else 0,
+                    bytes_sent=self.bytes_sent,
+                    bytes_received=self.bytes_received,
+                    histogram=dict(zip([str(b) for b in BUCKETS] + ['inf'],
+                                       self.histogram)))
+
+
+class Metrics:
+    """ Thread safe registry of RequestStats """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+
+    def record(self, key, elapsed, sent=0, received=0, error=False,
+               timeout=False):
+        with self._lock:
+            stats = self.requests.setdefault(key, RequestStats())
+            stats.add(elapsed, sent, received, error, timeout)
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+
+    def to_dict(self):
+        with self._lock:
+            return {k: v.to_dict() for k, v in self.requests.items()}
+
+    def summary(self):
+        """ returns a list of text lines, slowest total time first """
+        with self._lock:
+            items = sorted(self.requests.items(),
+                           key=lambda kv: kv[1].total_time, reverse=True)
+            lines = []
+            for key, s in items:
+                p95 = s.percentile(95)
+                lines.append(
+                    "{key}: {count} calls, {total:.1f}s total, "
+                    "{mean:.2f}s mean, {mx:.2f}s max, p95<={p95}, "
+                    "{err} errors, {to} timeouts, "
+                    "{sent}B sent, {recv}B received".format(
+                        key=key, count=s.count, total=s.total_time,
+                        mean=s.total_time / s.count, mx=s.max_time,
+                        p95="{}s".format(p95) if p95 is not None else "inf",
+                        err=s.errors, to=s.timeouts,
+                        sent=s.bytes_sent, recv=s.bytes_received))
+            return lines
+
+
+registry = Metrics()
+
+
+def maas_endpoint(method, url, params=None):
+    """ Builds a low cardinality key for a MAAS request, replacing
+    object ids in the url by {id}.
+
+    eg. POST /nodes/node-1234/ op=release -> "POST nodes/{id} op=release"
+    """
+    parts = [p for p in url.split('/') if p]
+    parts = [p if i % 2 == 0 else '{id}' for i, p in enumerate(parts)]
+    key = "{} {}".format(method, "/".join(parts))
+    if isinstance(params, dict) and 'op' in params:
+        key += " op={}".format(params['op'])
+    return key
+
+
+def record_juju_call(facade, request, elapsed, sent, received, error):
+    registry.record("juju {}.{}".format(facade, request), elapsed,
+                    sent, received, error=error is not None,
+                    timeout=isinstance(error, RequestTimeout))
+
+
+def record_maas_request(method, url, params, elapsed, sent, received,
+                        status_code, error):
+    failed = error is not None or \
+        (status_code is not None and status_code >= 400)
+    registry.record("maas " + maas_endpoint(method, url, params), elapsed,
+                    sent, received, error=failed,
+                    timeout=isinstance(error, Timeout))
+
+
+def log_summary():
+    lines = registry.summary()
+    if not lines:
+        return
+    log.info("API call metrics:\n  " + "\n  ".join(lines))
+
+
+def dump(path):
+    """ Writes all metrics, including wait and lane stats, as JSON """
+    data = dict(requests=registry.to_dict(),
+                waits=async.wait_stats(),
+                lanes=async.lane_stats())
+    try:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+    except OSError as e:
+        log.warning("Unable to write metrics to {}: {}".format(path, e))
+
+
+def _report_periodically(interval):
+    try:
+        while True:
+            async.sleep_until(interval)
+            log_summary()
+    except async.ThreadCancelledException:
+        pass
+
+
+def install(config, interval=300):
+    """ Starts recording juju and MAAS calls, logs a summary every
+    'interval' seconds and dumps metrics.json in the config dir at exit.
+    """
+    if record_juju_call not in macumba.api.call_observers:
+        macumba.api.call_observers.append(record_juju_call)
+    if record_maas_request not in maasclient.request_observers:
+        maasclient.request_observers.append(record_maas_request)
+
+    path = os.path.join(config.cfg_path, 'metrics.json')
+    atexit.register(dump, path)
+    atexit.register(log_summary)
+
+    if interval:
+        threading.Thread(target=_report_periodically, args=(interval,),
+                         name="metrics-reporter", daemon=True).start()
@@ -20,8 +20,9 @@ import logging
 import yaml
 from multiprocessing import cpu_count
 
+from cloudinstall import charm_manifest
+from cloudinstall.log import PrettyLog
 from cloudinstall.maas import (satisfies, MaasMachineStatus)
-from cloudinstall.utils import load_charms
 from cloudinstall.state import CharmState
 
 log = logging.getLogger('cloudinstall.placement')
@@ -294,9 +295,8 @@ class PlacementController:
         return ms
 
     def charm_classes(self):
-        cl = [m.__charm_class__ for m in
-              load_charms(self.config.getopt('charm_plugin_dir'))
-              if not m.__charm_class__.disabled]
+        cl = [c for c in charm_manifest.charm_classes(
+            self.config.getopt('charm_plugin_dir')) if not c.disabled]
 
         return cl
 
@@ -323,8 +323,16 @@ class PlacementController:
         self.update_and_save()
 
     def mark_deployed(self, machine, charm_class, atype):
-        self.deployments[machine.instance_id][atype].append(charm_class)
-        self.assignments[machine.instance_id][atype].remove(charm_class)
+        self.mark_all_deployed([(machine, charm_class, atype)])
+
+    def mark_all_deployed(self, deployments):
+        """ Moves assignments to deployments, saving once
+
+        :param deployments: [(machine, charm_class, atype)]
+        """
+        for machine, charm_class, atype in deployments:
+            self.deployments[machine.instance_id][atype].append(charm_class)
+            self.assignments[machine.instance_id][atype].remove(charm_class)
         self.update_and_save()
 
     def _get_machines_by_atype(self, a_dict, charm_class):
@@ -636,8 +644,7 @@ class PlacementController:
             l = ad[AssignmentType.DEFAULT]
             l.append(charm_class)
 
-        import pprint
-        log.debug(pprint.pformat(assignments))
+        log.debug("gen_defaults() = %s", PrettyLog(assignments))
         return assignments
 
     def gen_single(self):
@@ -688,6 +695,5 @@ class PlacementController:
                 ad = assignments[controller.instance_id]
                 ad[AssignmentType.LXC].append(charm_class)
 
-        import pprint
-        log.debug("gen_single() = '{}'".format(pprint.pformat(assignments)))
+        log.debug("gen_single() = '%s'", PrettyLog(assignments))
         return assignments
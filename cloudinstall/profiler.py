@@ -0,0 +1,263 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Profiler hooks
+
+Profiles the main (urwid) thread and the async lane workers, writing one
+set of files per phase (installer task or controller state) to
+~/.cloud-install/profiles/:
+
+  sampling       samples all profiled stacks every few milliseconds,
+                 writes <prog>-<n>-<phase>.collapsed (for flamegraph.pl)
+                 and an approximate .pstats built from the samples
+  deterministic  runs cProfile in each profiled thread, writes .pstats
+
+Enable with --profile MODE, UCI_PROFILE=MODE, or toggle with the 'p'
+hotkey.
+"""
+
+import atexit
+import cProfile
+import logging
+import marshal
+import os
+import re
+import sys
+import threading
+from collections import Counter
+
+log = logging.getLogger('cloudinstall.profiler')
+
+MODES = ['sampling', 'deterministic']
+SAMPLE_INTERVAL = 0.005
+
+
+def _subtract(a, b):
+    """ a - b for pstats entries (cc, nc, tt, ct, callers) """
+    callers = {}
+    for k, v in a[4].items():
+        prev = b[4].get(k, (0, 0, 0, 0))
+        callers[k] = tuple(x - y for x, y in zip(v, prev))
+    return (a[0] - b[0], a[1] - b[1], a[2] - b[2], a[3] - b[3], callers)
+
+
+def _add(a, b):
+    callers = dict(a[4])
+    for k, v in b[4].items():
+        prev = callers.get(k, (0, 0, 0, 0))
+        callers[k] = tuple(x + y for x, y in zip(v, prev))
+    return (a[0] + b[0], a[1] + b[1], a[2] + b[2], a[3] + b[3], callers)
+
+
+def _frame_key(code):
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+class Profiler:
+
+    def __init__(self):
+        self.mode = None
+        self.outdir = None
+        self.phase = 'startup'
+        self.seq = 0
+        self.interval = SAMPLE_INTERVAL
+        self._lock = threading.Lock()
+        self._threads = {}  # ident -> name of threads to profile
+        # deterministic: ident -> cProfile.Profile, stats at phase start
+        self._profiles = {}
+        self._baseline = {}
+        # sampling: (thread name, stack keys root first) -> count
+        self._samples = Counter()
+        self._stop_sampling = threading.Event()
+        self._local = threading.local()
+
+    @property
+    def active(self):
+        return self.mode is not None
+
+    def start(self, mode, outdir, interval=SAMPLE_INTERVAL):
+        if mode not in MODES:
+            raise Exception("Unknown profiler mode '{}', use one "
+                            "of {}".format(mode, ", ".join(MODES)))
+        if self.active:
+            return
+        os.makedirs(outdir, exist_ok=True)
+        self.outdir = outdir
+        self.interval = interval
+        self.mode = mode
+        log.info("Profiling in {} mode to {}".format(mode, outdir))
+        self.profile_current_thread()
+        if mode == 'sampling':
+            self._stop_sampling.clear()
+            threading.Thread(target=self._sample, name="profiler",
+                             daemon=True).start()
+
+    def stop(self):
+        if not self.active:
+            return
+        self.dump()
+        if self.mode == 'sampling':
+            self._stop_sampling.set()
+        elif getattr(self._local, 'profile', None) is not None:
+            self._local.profile.disable()
+            self._local.profile = None
+        log.info("Profiling stopped, profiles are in {}".format(self.outdir))
+        with self._lock:
+            self.mode = None
+            self._threads = {}
+            self._profiles = {}
+            self._baseline = {}
+            self._samples = Counter()
+
+    def toggle(self, mode='sampling', outdir=None):
+        """ returns True if profiling is now on """
+        if self.active:
+            self.stop()
+            return False
+        self.start(mode, outdir or self.outdir)
+        return True
+
+    def profile_current_thread(self):
+        """ Adds the calling thread to the profiled threads. Lane workers
+        call this before each task, it does nothing when inactive.
+        """
+        own = getattr(self._local, 'profile', None)
+        if not self.active:
+            if own is not None:
+                # profiling was stopped from another thread
+                own.disable()
+                self._local.profile = None
+            return
+        t = threading.current_thread()
+        if t.ident in self._threads:
+            return
+        with self._lock:
+            self._threads[t.ident] = t.name
+            if self.mode == 'deterministic':
+                p = cProfile.Profile()
+                self._profiles[t.ident] = p
+                self._local.profile = p
+                p.enable()
+
+    def mark_phase(self, name):
+        """ Writes out what was collected for the current phase and
+        starts a new one.
+        """
+        if not self.active or name == self.phase:
+            return
+        self.dump()
+        self.phase = name
+        self.seq += 1
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop_sampling.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, name in self._threads.items():
+                    frame = frames.get(ident)
+                    if frame is None or ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_key(frame.f_code))
+                        frame = frame.f_back
+                    self._samples[(name, tuple(reversed(stack)))] += 1
+
+    def _sampled_stats(self, samples):
+        """ approximates pstats data from sampled stacks """
+        stats = {}
+        for (_, stack), n in samples.items():
+            t = n * self.interval
+            seen = set()
+            for i, key in enumerate(stack):
+                cc, nc, tt, ct, callers = stats.get(key, (0, 0, 0, 0, {}))
+                if i == len(stack) - 1:
+                    tt += t
+                if key not in seen:
+                    ct += t
+                    seen.add(key)
+                if i > 0:
+                    c = callers.get(stack[i - 1], (0, 0, 0, 0))
+                    callers[stack[i - 1]] = (c[0] + n, c[1] + n,
+                                             c[2], c[3] + t)
+                stats[key] = (cc + n, nc + n, tt, ct, callers)
+        return stats
+
+    def _deterministic_stats(self):
+        stats = {}
+        for ident, p in list(self._profiles.items()):
+            p.snapshot_stats()
+            current = dict(p.stats)
+            baseline = self._baseline.get(ident, {})
+            for key, entry in current.items():
+                if key in baseline:
+                    entry = _subtract(entry, baseline[key])
+                if key in stats:
+                    entry = _add(stats[key], entry)
+                stats[key] = entry
+            self._baseline[ident] = current
+        return stats
+
+    def _path(self, ext):
+        prog = os.path.basename(sys.argv[0]) or 'cloudinstall'
+        phase = re.sub(r'[^\w.-]+', '_', self.phase)
+        return os.path.join(self.outdir, "{}-{:02d}-{}.{}".format(
+            prog, self.seq, phase, ext))
+
+    def dump(self):
+        """ Writes the current phase's profile files """
+        if not self.active:
+            return
+        with self._lock:
+            if self.mode == 'sampling':
+                samples = self._samples
+                self._samples = Counter()
+                stats = self._sampled_stats(samples)
+            else:
+                samples = None
+                stats = self._deterministic_stats()
+        try:
+            with open(self._path('pstats'), 'wb') as f:
+                marshal.dump(stats, f)
+            if samples is not None:
+                with open(self._path('collapsed'), 'w') as f:
+                    for (name, stack), n in sorted(samples.items()):
+                        frames = ["{}:{}".format(os.path.basename(k[0]),
+                                                 k[2]) for k in stack]
+                        f.write("{} {}\n".format(";".join([name] + frames),
+                                                 n))
+        except OSError as e:
+            log.warning("Unable to write profile: {}".format(e))
+
+
+profiler = Profiler()
+
+
+def setup(config, loop=None, mode=None):
+    """ Starts profiling if requested by mode, from --profile, or
+    UCI_PROFILE, and registers the 'toggle_profiler' hotkey callback with
+    the event loop. config.yaml has no say, so profiling a run does not
+    carry over to the next ones.
+    """
+    mode = mode or os.getenv('UCI_PROFILE')
+    outdir = os.path.join(config.cfg_path, 'profiles')
+    if mode:
+        profiler.start(mode, outdir)
+    atexit.register(profiler.stop)
+    if loop is not None:
+        loop.register_callback(
+            'toggle_profiler',
+            lambda: profiler.toggle(mode or 'sampling', outdir))
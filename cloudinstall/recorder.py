@@ -0,0 +1,172 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Juju and MAAS API traffic recording
+
+With UCI_RECORD=<file> set, openstack-status writes every juju API call
+and MAAS request, with its reply and timing, to <file> as gzipped JSON
+lines:
+
+    {"version": 1, "start": <epoch>, "install_type": "Multi", ...}
+    {"t": 12.3, "dt": 0.1, "juju": <request>, "reply": <reply message>}
+    {"t": 12.5, "dt": 0.05, "maas": ["GET", "/nodes/", <params>],
+     "status": 200, "body": <decoded JSON or text>}
+
+t is seconds since the recording started and dt the call duration.
+Replay a recording with 'python3 -m cloudinstall.simulator.replay'.
+"""
+
+import atexit
+import gzip
+import json
+import logging
+import re
+import threading
+import time
+
+import yaml
+
+log = logging.getLogger('cloudinstall.recorder')
+
+VERSION = 1
+
+# Values of keys, or charm options, named like these are never written
+# to a recording, at any depth
+SECRET_WORDS = ('password', 'passwd', 'secret', 'credential', 'token')
+SECRET_PARTS = ('key',)
+
+# YAML documents passed as strings, e.g. ServiceDeploy ConfigYAML
+YAML_SUFFIX = 'YAML'
+
+
+def _is_secret(name):
+    if not isinstance(name, str):
+        return False
+    # 'admin-password', 'AdminSecret', 'monitor_secret', 'api-key'
+    parts = re.findall('[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])', name)
+    lowered = name.lower()
+    return (any(word in lowered for word in SECRET_WORDS) or
+            any(part.lower() in SECRET_PARTS for part in parts))
+
+
+def _scrub_yaml(document):
+    try:
+        parsed = yaml.safe_load(document)
+    except yaml.YAMLError:
+        return '***'
+    if not isinstance(parsed, (dict, list)):
+        return document
+    return yaml.safe_dump(_scrub(parsed), default_flow_style=False)
+
+
+def _scrub(params):
+    """ Returns params with secret values replaced by '***' """
+    if isinstance(params, list):
+        return [_scrub(v) for v in params]
+    if not isinstance(params, dict):
+        return params
+    scrubbed = {}
+    for k, v in params.items():
+        if _is_secret(k):
+            scrubbed[k] = '***'
+        elif isinstance(v, str) and isinstance(k, str) and \
+                k.endswith(YAML_SUFFIX):
+            scrubbed[k] = _scrub_yaml(v)
+        else:
+            scrubbed[k] = _scrub(v)
+    return scrubbed
+
+
+class Recorder:
+    """ Writes API exchanges to a recording file, from any thread """
+
+    # Entries written between flushes; a flush costs some compression
+    FLUSH_EVERY = 50
+
+    def __init__(self, path, **header):
+        self.path = path
+        self.start = time.time()
+        self._lock = threading.Lock()
+        self._unflushed = 0
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        header.update(version=VERSION, start=self.start)
+        self._write(header)
+
+    def _write(self, entry):
+        line = json.dumps(entry, separators=(',', ':'), sort_keys=True)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + "\n")
+            self._unflushed += 1
+            if self._unflushed >= self.FLUSH_EVERY:
+                self._file.flush()
+                self._unflushed = 0
+
+    def _offset(self, start_time):
+        return round(start_time - self.start, 4)
+
+    def juju_message(self, params, reply, start_time, elapsed):
+        request = dict(params)
+        request.pop('RequestId', None)
+        request['Params'] = _scrub(request.get('Params'))
+        self._write(dict(t=self._offset(start_time), dt=round(elapsed, 4),
+                         juju=request, reply=_scrub(reply)))
+
+    def maas_response(self, method, url, params, start_time, elapsed,
+                      response, error):
+        entry = dict(t=self._offset(start_time), dt=round(elapsed, 4),
+                     maas=[method, url, _scrub(params)])
+        if response is None:
+            entry.update(status=None, body=str(error))
+        else:
+            try:
+                body = response.json()
+            except ValueError:
+                body = response.text
+            entry.update(status=response.status_code, body=body)
+        self._write(entry)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load(path):
+    """ returns (header, entries) of a recording """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if not lines or lines[0].get('version') != VERSION:
+        raise Exception("{} is not a version {} API "
+                        "recording".format(path, VERSION))
+    return lines[0], lines[1:]
+
+
+def install(path, config=None):
+    """ Starts recording juju and MAAS traffic to path, until exit """
+    import macumba.api
+    import maasclient
+
+    header = {}
+    if config is not None:
+        header['install_type'] = config.getopt('install_type')
+    recorder = Recorder(path, **header)
+    macumba.api.message_observers.append(recorder.juju_message)
+    maasclient.response_observers.append(recorder.maas_response)
+    atexit.register(recorder.close)
+    log.info("Recording API traffic to {}".format(path))
+    return recorder
@@ -0,0 +1,123 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Remote execution on juju machines
+
+Runs commands through the juju API (Client.Run) over the existing
+connection, instead of forking 'juju run' and 'juju scp' for each
+command and machine.
+"""
+
+import base64
+import logging
+
+from cloudinstall import trace
+
+log = logging.getLogger('cloudinstall.remote')
+
+# Marker for the heredocs used to ship files along with commands
+FILE_MARKER = 'CLOUDINSTALL_EOF'
+
+
+def file_command(src, dst, mode=None):
+    """ Returns a shell snippet that recreates local file 'src' at 'dst'
+    on the remote machine.
+    """
+    with open(src, 'rb') as f:
+        data = base64.encodebytes(f.read()).decode('ascii')
+    cmd = "base64 -d > {dst} <<'{marker}'\n{data}{marker}".format(
+        dst=dst, data=data, marker=FILE_MARKER)
+    if mode:
+        cmd += "\nchmod {mode} {dst}".format(mode=mode, dst=dst)
+    return cmd
+
+
+def build_script(cmds, files=None):
+    """ Joins file uploads and commands into one script that stops at
+    the first failing step.
+
+    :param cmds: command string or list of command strings
+    :param files: list of (src, dst) tuples to upload first
+    """
+    if type(cmds) is not list:
+        cmds = [cmds]
+    steps = ["set -e"]
+    for src, dst in files or []:
+        steps.append(file_command(src, dst))
+    steps.extend(cmds)
+    return "\n".join(steps)
+
+
+def _decode(value):
+    if not value:
+        return ""
+    try:
+        return base64.b64decode(value).decode('utf-8', 'replace')
+    except (TypeError, ValueError):
+        return value
+
+
+def parse_results(response):
+    """ Converts a Client.Run response into a dict of machine id to
+    dict(status=, output=, err=), the same shape that
+    utils.get_command_output returns.
+    """
+    results = {}
+    for r in response.get('Results', []) or []:
+        err = _decode(r.get('Stderr'))
+        status = r.get('Code', 0)
+        error = r.get('Error')
+        if isinstance(error, dict):
+            error = error.get('Message')
+        if error:
+            err = (err + "\n" + error).strip()
+            if status == 0:
+                status = 1
+        target = r.get('UnitId') or r.get('MachineId')
+        results[target] = dict(status=status,
+                               output=_decode(r.get('Stdout')),
+                               err=err)
+    return results
+
+
+def run(juju, machine_ids, cmds, files=None, timeout=600):
+    """ Runs cmds, after uploading files, on every machine in
+    machine_ids with a single API call.
+
+    :param juju: connected macumba JujuClient
+    :param list machine_ids: juju machine ids
+    :param cmds: command string or list of command strings
+    :param files: list of (src, dst) tuples to upload first
+    :returns: dict of machine id to dict(status=, output=, err=)
+    """
+    machine_ids = [str(m) for m in machine_ids]
+    script = build_script(cmds, files)
+    log.debug("Remote running ({cmds}) on machines {m}, "
+              "files: {f}".format(cmds=cmds, m=machine_ids, f=files))
+    with trace.span("run on {}".format(",".join(machine_ids)), 'remote',
+                    cmds=cmds):
+        response = juju.run(script, machines=machine_ids, timeout=timeout)
+    results = parse_results(response)
+    for m in machine_ids:
+        if m not in results:
+            results[m] = dict(status=1, output="",
+                              err="no result returned for machine")
+    log.debug("Remote run results: {r}".format(r=results))
+    return results
+
+
+def run_one(juju, machine_id, cmds, files=None, timeout=600):
+    """ Convenience for run() on a single machine, returns its result """
+    return run(juju, [machine_id], cmds, files, timeout)[str(machine_id)]
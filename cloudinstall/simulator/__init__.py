@@ -0,0 +1,79 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Local stand-ins for the Juju API, MAAS and the charm store
+
+Lets a complete headless multi install run on a laptop against
+simulated machines and units:
+
+    python3 -m cloudinstall.simulator --machines 12 --speed 20
+
+See cloudinstall/simulator/__main__.py for all options.
+"""
+
+import random
+import time
+
+# Simulated durations in seconds, as (min, max) ranges, and failure
+# rates (0 to 1). Override any of them with the 'settings' argument of
+# SimulatedJuju and SimulatedMaas.
+DEFAULT_SETTINGS = {
+    'latency': (0.005, 0.05),        # per API call
+    'commission': (60, 180),         # MAAS node declared -> ready
+    'machine_start': (60, 240),      # juju machine pending -> started
+    'container_start': (20, 60),
+    'unit_install': (60, 300),       # install hook
+    'unit_start': (10, 60),          # config-changed and start hooks
+    'machine_failure_rate': 0.0,
+    'unit_failure_rate': 0.0,
+    'api_failure_rate': 0.0,
+}
+
+
+class Clock:
+    """ Simulated time in seconds since creation, running 'speed' times
+    faster than wall-clock time.
+    """
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self._start = time.time()
+
+    def now(self):
+        return (time.time() - self._start) * self.speed
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.speed)
+
+
+class Simulation:
+    """ Base for the simulated services: a clock, seeded randomness and
+    lifecycle settings.
+    """
+
+    def __init__(self, clock=None, seed=None, settings=None):
+        self.clock = clock or Clock()
+        self.random = random.Random(seed)
+        self.settings = dict(DEFAULT_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+
+    def duration(self, key):
+        low, high = self.settings[key]
+        return self.random.uniform(low, high)
+
+    def fails(self, key):
+        return self.random.random() < self.settings[key]
@@ -0,0 +1,104 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Runs a headless multi install against the simulator
+
+    python3 -m cloudinstall.simulator --machines 12 --speed 20
+
+starts the simulated juju, MAAS and charm store, writes a config
+directory pointing at them and runs the deployment Controller in this
+process until post-processing completes. With --serve, only runs the
+servers and prints how to point openstack-status at them; with
+--record, writes the install's API traffic to a file that
+cloudinstall.simulator.replay can play back.
+"""
+
+import argparse
+import sys
+
+from cloudinstall import recorder
+from cloudinstall.maas import MaasMachineStatus
+from cloudinstall.simulator import Clock, driver
+from cloudinstall.simulator.juju import SimulatedJuju
+from cloudinstall.simulator.maas import SimulatedMaas, maas_nodes
+
+
+def parse_options(*args, **kwds):
+    parser = argparse.ArgumentParser(
+        prog='python3 -m cloudinstall.simulator',
+        description='Runs a headless multi install against simulated '
+        'juju, MAAS and charm store servers')
+    parser.add_argument('--machines', type=int, default=12,
+                        help='number of MAAS nodes, default: %(default)s')
+    parser.add_argument('--speed', type=float, default=20.0,
+                        help='simulated seconds per wall-clock second, '
+                        'default: %(default)s')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed for hardware, durations and '
+                        'failures')
+    parser.add_argument('--machine-failure-rate', type=float, default=0.0,
+                        help='fraction of machines failing to start')
+    parser.add_argument('--unit-failure-rate', type=float, default=0.0,
+                        help='fraction of units failing their install hook')
+    parser.add_argument('--api-failure-rate', type=float, default=0.0,
+                        help='fraction of API calls returning an error')
+    parser.add_argument('--latency', type=float, nargs=2,
+                        metavar=('MIN', 'MAX'), default=[0.005, 0.05],
+                        help='wall-clock seconds added to each API call')
+    parser.add_argument('--dir', dest='directory',
+                        help='config directory, default: a temporary one')
+    parser.add_argument('--serve', action='store_true',
+                        help='only run the servers')
+    parser.add_argument('--record', metavar='FILE',
+                        help='record the install\'s API traffic to FILE')
+    return parser.parse_args(*args, **kwds)
+
+
+def main(argv=None):
+    opts = parse_options(argv)
+    directory = driver.setup(opts.directory)
+
+    settings = dict(latency=tuple(opts.latency),
+                    machine_failure_rate=opts.machine_failure_rate,
+                    unit_failure_rate=opts.unit_failure_rate,
+                    api_failure_rate=opts.api_failure_rate)
+    clock = Clock(opts.speed)
+    maas = SimulatedMaas(maas_nodes(opts.machines, opts.seed,
+                                    status=MaasMachineStatus.READY),
+                         clock, opts.seed, settings)
+    juju = SimulatedJuju(maas, clock, opts.seed, settings)
+    juju_server, http_server, cfg_file = driver.start_servers(juju, maas,
+                                                              directory)
+    if opts.serve:
+        return driver.serve_forever(directory, http_server)
+
+    if opts.record:
+        recording = recorder.install(opts.record)
+    rc, elapsed = driver.install(cfg_file, directory, http_server)
+    if opts.record:
+        recording.close()
+    juju_server.stop()
+    http_server.stop()
+
+    print("\nInstall {} in {:.1f}s wall-clock, {:.0f}s simulated, "
+          "{} juju API requests".format(
+              "completed" if rc == 0 else "failed (exit code {})".format(rc),
+              elapsed, clock.now(), juju.requests))
+    driver.report()
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main())
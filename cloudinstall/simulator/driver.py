@@ -0,0 +1,182 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Shared plumbing of the simulator and replay drivers: starting the
+servers, writing a config directory that points at them and running
+the deployment Controller in-process.
+"""
+
+import logging
+import os
+import stat
+import tempfile
+import time
+
+import yaml
+
+import macumba.api
+from cloudinstall import async, metrics, trace, utils
+from cloudinstall.simulator.server import (HTTPAPIServer, JujuAPIServer,
+                                           make_certificate)
+
+log = logging.getLogger('cloudinstall.simulator')
+
+ENVIRON_UUID = '00000000-0000-4000-8000-00000000c0de'
+PASSWORD = 'simulated'
+
+# The post-processing scripts call the OpenStack clients against the
+# deployed cloud; in a simulation they just succeed.
+STUB_COMMANDS = ['openstack', 'neutron', 'nova', 'openstack-config']
+
+# templates and helper scripts, taken from the source tree
+SHARE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), 'share')
+
+
+def write_config(directory, juju_server, http_server):
+    """ writes config.yaml, the juju environments and stub commands to
+    directory, returns the config file path.
+    """
+    env_dir = os.path.join(directory, 'juju', 'environments')
+    os.makedirs(env_dir, exist_ok=True)
+    with open(os.path.join(env_dir, 'maas.jenv'), 'w') as f:
+        yaml.safe_dump({'state-servers': [juju_server.address],
+                        'environ-uuid': ENVIRON_UUID,
+                        'user': 'admin',
+                        'password': PASSWORD,
+                        'bootstrap-config': {
+                            'name': 'maas',
+                            'maas-server': "http://{}/MAAS/".format(
+                                http_server.address)}},
+                       f, default_flow_style=False)
+
+    with open(os.path.join(directory, 'juju', 'environments.yaml'),
+              'w') as f:
+        yaml.safe_dump({'default': 'maas',
+                        'environments': {
+                            'maas': {'type': 'maas'},
+                            'openstack': {'type': 'openstack',
+                                          'auth-url': 'http://keystoneurl'}}},
+                       f, default_flow_style=False)
+
+    bin_dir = os.path.join(directory, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    for name in STUB_COMMANDS:
+        stub = os.path.join(bin_dir, name)
+        with open(stub, 'w') as f:
+            f.write("#!/bin/sh\nexit 0\n")
+        os.chmod(stub, os.stat(stub).st_mode | stat.S_IEXEC)
+
+    cfg_file = os.path.join(directory, 'config.yaml')
+    with open(cfg_file, 'w') as f:
+        yaml.safe_dump({'install_type': 'Multi',
+                        'headless': True,
+                        'openstack_password': 'simulated',
+                        'openstack_release': 'liberty',
+                        'ubuntu_series': 'trusty',
+                        'share_path': SHARE_PATH,
+                        'maascreds': {'api_host': http_server.address,
+                                      'api_key': 'sim:ulated:key'}},
+                       f, default_flow_style=False)
+    return cfg_file
+
+
+def run_install(cfg_file):
+    """ runs the headless deployment, returns its exit code """
+    # imported here so --serve doesn't need the UI dependencies
+    from cloudinstall.config import Config
+    from cloudinstall.consoleui import ConsoleUI
+    from cloudinstall.core import Controller
+    from cloudinstall.ev import EventLoop
+
+    with open(cfg_file) as f:
+        config = Config(yaml.safe_load(f), cfg_file)
+    metrics.install(config, interval=0)
+    ui = ConsoleUI()
+    ev = EventLoop(ui, config, log)
+    try:
+        Controller(ui=ui, config=config, loop=ev).start()
+    except SystemExit as e:
+        return e.code
+    finally:
+        async.shutdown()
+    return ev.error_code
+
+
+def setup(directory=None):
+    """ creates the config directory and logs to commands.log in it,
+    returns its path.
+    """
+    directory = directory or tempfile.mkdtemp(prefix='cloudinstall-sim-')
+    os.makedirs(directory, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(directory, 'commands.log'),
+                        level=logging.DEBUG,
+                        format="%(asctime)s [%(levelname)s] %(name)s "
+                        "%(message)s")
+    return directory
+
+
+def start_servers(juju, maas, directory):
+    """ serves the juju and MAAS backends, returns (juju server, HTTP
+    server, config file).
+    """
+    certfile, keyfile = make_certificate(directory)
+    juju_server = JujuAPIServer(juju, certfile, keyfile).start()
+    http_server = HTTPAPIServer(maas).start()
+    cfg_file = write_config(directory, juju_server, http_server)
+    print("Juju API at wss://{}, MAAS and charm store at "
+          "http://{}".format(juju_server.address, http_server.address))
+    print("Config and logs in {}".format(directory))
+    return juju_server, http_server, cfg_file
+
+
+def charmstore_url(http_server):
+    return "http://{}/charmstore".format(http_server.address)
+
+
+def serve_forever(directory, http_server):
+    print("\nexport MACUMBA_CHARMSTORE_URL={}".format(
+        charmstore_url(http_server)))
+    print("export PATH={}:$PATH".format(os.path.join(directory, 'bin')))
+    print("\nPress Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        return 0
+
+
+def install(cfg_file, directory, http_server):
+    """ runs the install against the servers, returns (exit code,
+    wall-clock seconds).
+    """
+    macumba.api.CHARMSTORE_URL = charmstore_url(http_server)
+    utils.TEMPLATE_PATH = os.path.join(SHARE_PATH, 'templates')
+    os.environ['PATH'] = os.pathsep.join([os.path.join(directory, 'bin'),
+                                          os.environ.get('PATH', '')])
+    trace.configure(os.getenv('UCI_TRACE', 'phase,api,wait,deploy,'
+                              'relations,postproc'))
+    trace.install_api_observers()
+
+    start = time.time()
+    rc = run_install(cfg_file)
+    elapsed = time.time() - start
+    trace.export(directory)
+    return rc, elapsed
+
+
+def report():
+    print("\nAPI calls:\n  " + "\n  ".join(metrics.registry.summary()))
+    print("\nTrace:\n  " + "\n  ".join(trace.summary()))
@@ -0,0 +1,629 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Simulated juju environment
+
+Implements the Client, Admin and AllWatcher facade requests macumba
+makes. Machines and units move through their lifecycles as simulated
+time passes:
+
+  machine   pending -> started (or error)
+  unit      pending -> installed -> started (or error in the install
+            hook, until Resolved)
+"""
+
+import copy
+import logging
+import threading
+import time
+
+from cloudinstall.simulator import Simulation
+
+log = logging.getLogger('cloudinstall.simulator.juju')
+
+AGENT_VERSION = '1.25.0'
+SINCE = '2015-10-01T12:00:00Z'
+
+
+class SimulatedAPIError(Exception):
+    """ An error returned to the client, not raised by it """
+
+    def __init__(self, message, code=''):
+        super().__init__(message)
+        self.code = code
+
+
+def _filter_status(status, patterns):
+    """ FullStatus Patterns, as juju applies them: a unit matches by its
+    own, its service's or its machine's name; matched units bring in
+    their service and machine.
+    """
+    patterns = set(patterns)
+    services = {}
+    machine_ids = set(p for p in patterns if p.split('/')[0].isdigit())
+    for name, svc in status['Services'].items():
+        units = {}
+        for uname, unit in svc['Units'].items():
+            mid = unit.get('Machine', '')
+            if patterns & {uname, name, mid, mid.split('/')[0]}:
+                units[uname] = unit
+                machine_ids.add(mid.split('/')[0])
+        if units or name in patterns:
+            services[name] = dict(svc, Units=units)
+    machines = {mid: m for mid, m in status['Machines'].items()
+                if mid in machine_ids or
+                patterns & set(m.get('Containers', {}))}
+    return dict(status, Machines=machines, Services=services)
+
+
+class SimulatedJuju(Simulation):
+    """ In-memory juju environment.
+
+    If maas (a SimulatedMaas) is given, new machines acquire its nodes,
+    honouring 'tags' constraints, and fail to start when none is left.
+    """
+
+    def __init__(self, maas=None, clock=None, seed=None, settings=None):
+        super().__init__(clock, seed, settings)
+        self.maas = maas
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.machines = {}     # id -> machine record
+        self.services = {}     # name -> service record
+        self.relations = []    # [(endpoint, endpoint)]
+        self.annotations = {}  # tag -> {key: value}
+        self.env_constraints = {}
+        self._next_machine = 1
+        self._watchers = {}    # id -> last delta snapshot
+        self.requests = 0
+        with self.lock:
+            self._add_machine(series='trusty', bootstrap=True)
+
+    # Lifecycle
+    def _add_machine(self, constraints=None, parent=None,
+                     container_type='', series='trusty', bootstrap=False):
+        now = self.clock.now()
+        if parent is not None:
+            host = self.machines[parent]
+            mid = "{}/{}/{}".format(parent, container_type,
+                                    len(host['containers']))
+            host['containers'].append(mid)
+            start_at = max(now, host['start_at']) + \
+                self.duration('container_start')
+            instance_id = "juju-machine-{}".format(mid.replace('/', '-'))
+            node = None
+        else:
+            mid = "0" if bootstrap else str(self._next_machine)
+            if not bootstrap:
+                self._next_machine += 1
+            start_at = now if bootstrap else \
+                now + self.duration('machine_start')
+            node = None
+            if self.maas is not None and not bootstrap:
+                node = self.maas.allocate((constraints or {}).get('tags'))
+            if node is not None:
+                instance_id = node['resource_uri']
+            elif self.maas is not None and not bootstrap:
+                instance_id = ''
+            else:
+                instance_id = "/MAAS/api/1.0/nodes/node-{}/".format(
+                    'juju-bootstrap' if bootstrap else mid)
+        m = dict(id=mid, parent=parent, containers=[], series=series,
+                 constraints=constraints or {}, node=node,
+                 instance_id=instance_id, created=now, start_at=start_at,
+                 failed=not bootstrap and self.fails('machine_failure_rate'),
+                 no_node=self.maas is not None and node is None and
+                 parent is None and not bootstrap)
+        self.machines[mid] = m
+        self.changed.notify_all()
+        return m
+
+    def _machine_target(self, spec, constraints=None):
+        """ returns the machine for a ToMachineSpec, creating one for ''
+        and 'lxc:N' / 'kvm:N' specs
+        """
+        if not spec:
+            return self._add_machine(constraints)
+        if ':' in spec:
+            ctype, parent = spec.split(':', 1)
+            if parent not in self.machines:
+                raise SimulatedAPIError(
+                    'machine {} not found'.format(parent), 'not found')
+            return self._add_machine(parent=parent, container_type=ctype)
+        if spec not in self.machines:
+            raise SimulatedAPIError('machine {} not found'.format(spec),
+                                    'not found')
+        return self.machines[spec]
+
+    def _unit_specs(self, params, num_units):
+        """ returns the machine spec of each new unit, from ToMachineSpec
+        or the Placement directives
+        """
+        placement = params.get('Placement') or []
+        if placement:
+            specs = [p['Directive'] if p['Scope'] == '#' else
+                     "{}:{}".format(p['Scope'], p['Directive'])
+                     for p in placement]
+        else:
+            specs = [params.get('ToMachineSpec', '')][:num_units]
+        if len(specs) > num_units:
+            raise SimulatedAPIError("{} placement directives for {} "
+                                    "units".format(len(specs), num_units))
+        return specs + [''] * (num_units - len(specs))
+
+    def _add_unit(self, service, machine):
+        svc = self.services[service]
+        name = "{}/{}".format(service, svc['next_unit'])
+        svc['next_unit'] += 1
+        unit = dict(name=name, machine=machine['id'])
+        self._schedule_unit(unit)
+        svc['units'][name] = unit
+        self.changed.notify_all()
+        return name
+
+    def _schedule_unit(self, unit):
+        machine = self.machines[unit['machine']]
+        begin = max(self.clock.now(), machine['start_at'])
+        unit['install_at'] = begin + self.duration('unit_install')
+        unit['start_at'] = unit['install_at'] + self.duration('unit_start')
+        unit['failed'] = self.fails('unit_failure_rate')
+
+    def _machine_state(self, m, now):
+        if m['no_node']:
+            return ('', 'cannot run instances: gomaasapi: got error back '
+                    'from server: 409 CONFLICT (No available node matches '
+                    'constraints)')
+        if now < m['start_at']:
+            return ('pending', '')
+        if m['failed']:
+            return ('error', 'failed to start instance (simulated)')
+        return ('started', '')
+
+    def _unit_state(self, unit, now):
+        """ returns (agent state, info, workload status, workload info) """
+        machine = self.machines[unit['machine']]
+        mstate, _ = self._machine_state(machine, now)
+        if mstate != 'started':
+            return ('pending', '', 'waiting', 'waiting for machine')
+        if now < unit['install_at']:
+            return ('pending', '', 'maintenance',
+                    'installing charm software')
+        if unit['failed']:
+            return ('error', 'hook failed: "install"', 'error',
+                    'hook failed: "install"')
+        if now < unit['start_at']:
+            return ('installed', '', 'maintenance', 'configuring')
+        return ('started', '', 'active', 'Unit is ready')
+
+    # Status
+    def _machine_status(self, m, now):
+        state, info = self._machine_state(m, now)
+        node = m['node']
+        if node is not None:
+            hardware = "arch=amd64 cpu-cores={} mem={}M root-disk={}M".format(
+                node['cpu_count'], node['memory'], node['storage'])
+            address = node['hostname']
+        else:
+            hardware = ''
+            address = '10.0.{}.{}'.format(len(m['id']) % 256,
+                                          hash(m['id']) % 250 + 2) \
+                if state == 'started' else ''
+        return {
+            'Id': m['id'],
+            'InstanceId': m['instance_id'] if state != '' else 'pending',
+            'AgentState': state,
+            'AgentStateInfo': info,
+            'AgentVersion': AGENT_VERSION,
+            'Agent': {'Status': state or 'pending', 'Info': info,
+                      'Data': {}, 'Since': SINCE,
+                      'Version': AGENT_VERSION, 'Life': '', 'Err': None},
+            'DNSName': address,
+            'Series': m['series'],
+            'Hardware': hardware,
+            'Jobs': ['JobManageEnviron'] if m['id'] == '0'
+            else ['JobHostUnits'],
+            'Life': '',
+            'HasVote': m['id'] == '0',
+            'WantsVote': m['id'] == '0',
+            'Err': None,
+            'Containers': {cid: self._machine_status(self.machines[cid], now)
+                           for cid in m['containers']},
+        }
+
+    def _unit_status(self, svc, unit, now, statuses):
+        state, info, wstatus, winfo = self._unit_state(unit, now)
+        machine = statuses.get(unit['machine'])
+        return {
+            'AgentState': state,
+            'AgentStateInfo': info,
+            'AgentVersion': AGENT_VERSION,
+            'Life': '',
+            'Err': None,
+            'Machine': unit['machine'],
+            'PublicAddress': machine['DNSName'] if machine else '',
+            'OpenedPorts': [],
+            'Charm': svc['charm'],
+            'Subordinates': {},
+            'Workload': {'Status': wstatus, 'Info': winfo},
+            'UnitAgent': {'Status': 'idle' if state == 'started'
+                          else 'executing'},
+        }
+
+    def _all_machine_statuses(self, now):
+        statuses = {}
+        for mid, m in self.machines.items():
+            if m['parent'] is None:
+                status = self._machine_status(m, now)
+                statuses[mid] = status
+                statuses.update(status['Containers'])
+        return statuses
+
+    def full_status(self, patterns=None):
+        if patterns:
+            return _filter_status(self.full_status(), patterns)
+        with self.lock:
+            now = self.clock.now()
+            statuses = self._all_machine_statuses(now)
+            services = {}
+            for name, svc in self.services.items():
+                units = {uname: self._unit_status(svc, u, now, statuses)
+                         for uname, u in svc['units'].items()}
+                relations = {}
+                for a, b in self.relations:
+                    sa, sb = a.split(':')[0], b.split(':')[0]
+                    if name in (sa, sb):
+                        other = sb if sa == name else sa
+                        key = (a if sa == name else b).split(':')[-1]
+                        relations.setdefault(key, []).append(other)
+                services[name] = {
+                    'Charm': svc['charm'],
+                    'Exposed': svc['exposed'],
+                    'Life': '',
+                    'Err': None,
+                    'CanUpgradeTo': '',
+                    'SubordinateTo': svc['subordinate_to'],
+                    'Networks': {'Enabled': None, 'Disabled': None},
+                    'Relations': relations,
+                    'Units': units,
+                }
+            # subordinate units live on their principals' units
+            for name, svc in self.services.items():
+                if not svc['subordinate']:
+                    continue
+                n = 0
+                for principal in svc['subordinate_to']:
+                    for unit in services[principal]['Units'].values():
+                        unit['Subordinates']["{}/{}".format(name, n)] = {
+                            'AgentState': unit['AgentState'],
+                            'Charm': svc['charm'],
+                            'PublicAddress': unit['PublicAddress'],
+                            'Workload': dict(unit['Workload'])}
+                        n += 1
+            return {
+                'EnvironmentName': 'simulated',
+                'AvailableVersion': '',
+                'Machines': {mid: s for mid, s in statuses.items()
+                             if '/' not in mid},
+                'Services': services,
+                'Networks': {},
+                'Relations': [],
+            }
+
+    def _snapshot(self):
+        """ entity -> info, for AllWatcher deltas """
+        status = self.full_status()
+        entities = {}
+        for mid, m in status['Machines'].items():
+            entities[('machine', mid)] = dict(Id=mid,
+                                              InstanceId=m['InstanceId'],
+                                              Status=m['AgentState'],
+                                              StatusInfo=m['AgentStateInfo'])
+            for cid, c in m['Containers'].items():
+                entities[('machine', cid)] = dict(
+                    Id=cid, InstanceId=c['InstanceId'],
+                    Status=c['AgentState'], StatusInfo=c['AgentStateInfo'])
+        for name, s in status['Services'].items():
+            entities[('service', name)] = dict(Name=name, CharmURL=s['Charm'],
+                                               Exposed=s['Exposed'])
+            for uname, u in s['Units'].items():
+                entities[('unit', uname)] = dict(
+                    Name=uname, Service=name, MachineId=u['Machine'],
+                    Status=u['AgentState'], StatusInfo=u['AgentStateInfo'],
+                    PublicAddress=u['PublicAddress'])
+        for a, b in self.relations:
+            key = "{} {}".format(a, b)
+            entities[('relation', key)] = dict(Key=key)
+        return entities
+
+    def next_deltas(self, watcher_id, timeout=None):
+        """ blocks until something changed since the watcher's last call,
+        returns the AllWatcher deltas.
+        """
+        if watcher_id not in self._watchers:
+            raise SimulatedAPIError('unknown watcher id', 'not found')
+        deadline = None if timeout is None else \
+            self.clock.now() + timeout
+        while True:
+            with self.lock:
+                previous = self._watchers[watcher_id]
+                current = self._snapshot()
+                deltas = [[kind, 'change', info]
+                          for (kind, key), info in sorted(current.items())
+                          if previous.get((kind, key)) != info]
+                deltas += [[kind, 'remove', info]
+                           for (kind, key), info in sorted(previous.items())
+                           if (kind, key) not in current]
+                if deltas:
+                    self._watchers[watcher_id] = current
+                    return deltas
+                if deadline is not None and self.clock.now() >= deadline:
+                    return []
+                # lifecycle transitions happen without requests, so wake
+                # up periodically as well as on changes
+                self.changed.wait(1.0 / self.clock.speed)
+
+    # Request handling
+    def reply(self, request):
+        """ returns the response message for a request message """
+        request_id = request.get('RequestId')
+        # latency is wall-clock time, not simulated
+        time.sleep(self.duration('latency'))
+        try:
+            response = self.handle(request)
+        except SimulatedAPIError as e:
+            return dict(RequestId=request_id, Error=str(e), ErrorCode=e.code)
+        return dict(RequestId=request_id, Response=response)
+
+    def handle(self, request):
+        facade, name = request.get('Type'), request.get('Request')
+        params = request.get('Params') or {}
+        self.requests += 1
+        handler = getattr(self, "_{}_{}".format(facade, name), None)
+        if handler is None:
+            raise SimulatedAPIError(
+                "unknown request {}.{}".format(facade, name),
+                'not implemented')
+        if facade != 'Admin' and self.fails('api_failure_rate'):
+            raise SimulatedAPIError("simulated API failure in {}.{}".format(
+                facade, name))
+        if facade == 'AllWatcher':
+            return handler(request)
+        with self.lock:
+            return handler(params)
+
+    def _Admin_Login(self, params):
+        return {'EnvironTag': 'environment-simulated',
+                'Servers': [],
+                'Facades': [],
+                'LastConnection': None}
+
+    def _Client_FullStatus(self, params):
+        return self.full_status(params.get('Patterns'))
+
+    def _Client_EnvironmentInfo(self, params):
+        return {'DefaultSeries': 'trusty', 'ProviderType': 'maas',
+                'Name': 'simulated', 'UUID': 'simulated'}
+
+    def _Client_GetEnvironmentConstraints(self, params):
+        return {'Constraints': self.env_constraints}
+
+    def _Client_SetEnvironmentConstraints(self, params):
+        self.env_constraints = params.get('Constraints', params)
+        return {}
+
+    def _Client_WatchAll(self, params):
+        watcher_id = str(len(self._watchers) + 1)
+        self._watchers[watcher_id] = {}
+        return {'AllWatcherId': watcher_id}
+
+    def _AllWatcher_Next(self, request):
+        return {'Deltas': self.next_deltas(request.get('Id'))}
+
+    def _AllWatcher_Stop(self, request):
+        with self.lock:
+            self._watchers.pop(request.get('Id'), None)
+        return {}
+
+    def _Client_AddMachines(self, params):
+        results = []
+        for mp in params.get('MachineParams', []):
+            try:
+                if mp.get('ParentId'):
+                    m = self._machine_target("{}:{}".format(
+                        mp.get('ContainerType') or 'lxc', mp['ParentId']))
+                else:
+                    m = self._add_machine(mp.get('Constraints'),
+                                          series=mp.get('Series') or 'trusty')
+                results.append({'Machine': m['id'], 'Error': None})
+            except SimulatedAPIError as e:
+                results.append({'Machine': '',
+                                'Error': {'Message': str(e), 'Code': e.code}})
+        return {'Machines': results}
+
+    def _Client_DestroyMachines(self, params):
+        for mid in params.get('MachineNames', []):
+            m = self.machines.pop(mid, None)
+            if m and m['node'] is not None:
+                self.maas.release(m['node']['system_id'])
+        self.changed.notify_all()
+        return {}
+
+    def _Client_AddCharm(self, params):
+        return {}
+
+    def _Client_CharmInfo(self, params):
+        return {'URL': params.get('CharmURL'), 'Revision': 1,
+                'Meta': {}, 'Config': {'Options': {}}}
+
+    def _Client_ServiceDeploy(self, params):
+        name = params['ServiceName']
+        if name in self.services:
+            raise SimulatedAPIError(
+                'service "{}" already exists'.format(name))
+        num_units = params.get('NumUnits', 1)
+        self.services[name] = dict(
+            charm=params.get('CharmUrl') or "cs:trusty/{}-1".format(name),
+            config=params.get('ConfigYAML', ''),
+            constraints=params.get('Constraints') or {},
+            subordinate=num_units == 0 and not params.get('ToMachineSpec'),
+            subordinate_to=[], exposed=False, units={}, next_unit=0)
+        for spec in self._unit_specs(params, num_units):
+            machine = self._machine_target(
+                spec, self.services[name]['constraints'])
+            self._add_unit(name, machine)
+        return {}
+
+    def _Client_AddServiceUnits(self, params):
+        name = params['ServiceName']
+        if name not in self.services:
+            raise SimulatedAPIError(
+                'service "{}" not found'.format(name), 'not found')
+        units = []
+        for spec in self._unit_specs(params, params.get('NumUnits', 1)):
+            machine = self._machine_target(
+                spec, self.services[name]['constraints'])
+            units.append(self._add_unit(name, machine))
+        return {'Units': units}
+
+    def _Client_DestroyServiceUnits(self, params):
+        for uname in params.get('UnitNames', []):
+            svc = self.services.get(uname.split('/')[0])
+            if svc:
+                svc['units'].pop(uname, None)
+        self.changed.notify_all()
+        return {}
+
+    def _Client_ServiceDestroy(self, params):
+        self.services.pop(params['ServiceName'], None)
+        self.changed.notify_all()
+        return {}
+
+    def _Client_AddRelation(self, params):
+        a, b = params['Endpoints']
+        sa, sb = a.split(':')[0], b.split(':')[0]
+        for s in (sa, sb):
+            if s not in self.services:
+                raise SimulatedAPIError(
+                    'service "{}" not found'.format(s), 'not found')
+        for ra, rb in self.relations:
+            if {ra.split(':')[0], rb.split(':')[0]} == {sa, sb}:
+                raise SimulatedAPIError(
+                    'cannot add relation "{} {}": relation already '
+                    'exists'.format(a, b))
+        self.relations.append((a, b))
+        for sub, principal in [(sa, sb), (sb, sa)]:
+            if self.services[sub]['subordinate'] and \
+               not self.services[principal]['subordinate'] and \
+               principal not in self.services[sub]['subordinate_to']:
+                self.services[sub]['subordinate_to'].append(principal)
+        self.changed.notify_all()
+        return {'Endpoints': {sa: {'Name': a.split(':')[-1]},
+                              sb: {'Name': b.split(':')[-1]}}}
+
+    def _Client_DestroyRelation(self, params):
+        a, b = params['Endpoints']
+        self.relations = [r for r in self.relations
+                          if set(r) != {a, b}]
+        self.changed.notify_all()
+        return {}
+
+    def _Client_SetAnnotations(self, params):
+        self.annotations.setdefault(params['Tag'], {}).update(
+            params.get('Pairs', {}))
+        return {}
+
+    def _Client_GetAnnotations(self, params):
+        return {'Annotations': copy.deepcopy(
+            self.annotations.get(params['Tag'], {}))}
+
+    def _Annotations_Get(self, params):
+        return {'Results': [
+            {'EntityTag': e['Tag'],
+             'Annotations': copy.deepcopy(self.annotations.get(e['Tag'], {})),
+             'Error': {'Error': None}}
+            for e in params.get('Entities', [])]}
+
+    def _Annotations_Set(self, params):
+        for a in params.get('Annotations', []):
+            self.annotations.setdefault(a['EntityTag'], {}).update(
+                a.get('Annotations', {}))
+        return {'Results': []}
+
+    def _Client_ServiceSet(self, params):
+        svc = self._service(params)
+        svc.setdefault('options', {}).update(params.get('Options', {}))
+        return {}
+
+    def _Client_ServiceUnset(self, params):
+        svc = self._service(params)
+        for key in params.get('Options', []):
+            svc.setdefault('options', {}).pop(key, None)
+        return {}
+
+    def _Client_ServiceGet(self, params):
+        svc = self._service(params)
+        return {'Service': params['ServiceName'],
+                'Charm': svc['charm'].split('/')[-1].rsplit('-', 1)[0],
+                'Config': {k: {'value': v} for k, v in
+                           svc.get('options', {}).items()},
+                'Constraints': svc['constraints']}
+
+    def _Client_ServiceExpose(self, params):
+        self._service(params)['exposed'] = True
+        self.changed.notify_all()
+        return {}
+
+    def _Client_ServiceUnexpose(self, params):
+        self._service(params)['exposed'] = False
+        self.changed.notify_all()
+        return {}
+
+    def _service(self, params):
+        svc = self.services.get(params.get('ServiceName'))
+        if svc is None:
+            raise SimulatedAPIError('service "{}" not found'.format(
+                params.get('ServiceName')), 'not found')
+        return svc
+
+    def _Client_Resolved(self, params):
+        name = params['UnitName']
+        unit = self._service(dict(ServiceName=name.split('/')[0]))[
+            'units'].get(name)
+        if unit is None:
+            raise SimulatedAPIError('unit "{}" not found'.format(name),
+                                    'not found')
+        if unit['failed']:
+            self._schedule_unit(unit)
+            unit['failed'] = False
+            self.changed.notify_all()
+        return {}
+
+    def _run_results(self, machine_ids):
+        return {'Results': [{'MachineId': mid, 'Code': 0, 'Stdout': '',
+                             'Stderr': '', 'Error': ''}
+                            for mid in machine_ids]}
+
+    def _Client_Run(self, params):
+        machine_ids = list(params.get('Machines') or [])
+        for uname in params.get('Units') or []:
+            svc = self.services.get(uname.split('/')[0], {})
+            unit = svc.get('units', {}).get(uname)
+            if unit:
+                machine_ids.append(unit['machine'])
+        return self._run_results(machine_ids)
+
+    def _Client_RunOnAllMachines(self, params):
+        return self._run_results(sorted(m for m in self.machines
+                                        if '/' not in m))
@@ -0,0 +1,189 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Simulated MAAS region controller """
+
+import copy
+import logging
+import random
+import threading
+import time
+import uuid
+
+from cloudinstall.maas import MaasMachineStatus
+from cloudinstall.simulator import Simulation
+
+log = logging.getLogger('cloudinstall.simulator.maas')
+
+MEMORY = [4096, 8192, 16384, 32768, 65536]
+CPUS = [2, 4, 8, 16, 32]
+STORAGE = [20480, 40960, 102400, 512000, 1024000]
+
+
+def maas_nodes(count, seed=0, status=MaasMachineStatus.READY):
+    """ returns a list of 'count' MAAS node dicts, as returned by the
+    MAAS nodes API, deterministic for a given seed.
+    """
+    rand = random.Random(seed)
+    nodes = []
+    for i in range(count):
+        system_id = "node-{}".format(uuid.UUID(int=rand.getrandbits(128)))
+        uri = "/MAAS/api/1.0/nodes/{}/".format(system_id)
+        mac = ":".join("{:02x}".format(rand.randrange(256))
+                       for _ in range(6))
+        tags = rand.sample(['ssd', 'hdd', 'compute', 'storage', 'fast-net',
+                            'use-fastpath-installer'], rand.randrange(3))
+        nodes.append({
+            'status': status.value,
+            'macaddress_set': [{
+                'resource_uri': "{}macs/{}/".format(
+                    uri, mac.replace(':', '%3A')),
+                'mac_address': mac}],
+            'hostname': "node-{:05d}.maas".format(i),
+            'zone': {'resource_uri': '/MAAS/api/1.0/zones/default/',
+                     'name': 'default',
+                     'description': ''},
+            'routers': None,
+            'netboot': True,
+            'cpu_count': rand.choice(CPUS),
+            'storage': rand.choice(STORAGE),
+            'owner': 'root' if status != MaasMachineStatus.READY else None,
+            'system_id': system_id,
+            'architecture': 'amd64/generic',
+            'memory': rand.choice(MEMORY),
+            'power_type': rand.choice(['ipmi', 'virsh', 'amt']),
+            'tag_names': tags,
+            'ip_addresses': ["10.{}.{}.{}".format(i // 65536 % 256,
+                                                  i // 256 % 256,
+                                                  i % 256)],
+            'resource_uri': uri,
+        })
+    return nodes
+
+
+class SimulatedMaas(Simulation):
+    """ Nodes and tags of a MAAS region, with commissioning taking
+    'commission' simulated seconds after accept_all().
+    """
+
+    def __init__(self, nodes, clock=None, seed=None, settings=None):
+        super().__init__(clock, seed, settings)
+        self.lock = threading.RLock()
+        self.nodes = copy.deepcopy(nodes)
+        self.tags = set(t for n in self.nodes for t in n['tag_names'])
+        self._ready_at = {}  # system_id -> simulated time
+
+    def _advance(self):
+        now = self.clock.now()
+        for node in self.nodes:
+            ready_at = self._ready_at.get(node['system_id'])
+            if ready_at is not None and ready_at <= now:
+                node['status'] = MaasMachineStatus.READY.value
+                del self._ready_at[node['system_id']]
+
+    def node(self, system_id):
+        return next((n for n in self.nodes
+                     if n['system_id'] == system_id), None)
+
+    def list_nodes(self):
+        with self.lock:
+            self._advance()
+            return copy.deepcopy(self.nodes)
+
+    def accept_all(self):
+        with self.lock:
+            for node in self.nodes:
+                if node['status'] == MaasMachineStatus.NEW.value:
+                    node['status'] = MaasMachineStatus.COMMISSIONING.value
+                    self._ready_at[node['system_id']] = \
+                        self.clock.now() + self.duration('commission')
+
+    def new_tag(self, name):
+        with self.lock:
+            self.tags.add(name)
+
+    def tag_nodes(self, tag, system_ids):
+        with self.lock:
+            if tag not in self.tags:
+                return False
+            for system_id in system_ids:
+                node = self.node(system_id)
+                if node is not None and tag not in node['tag_names']:
+                    node['tag_names'].append(tag)
+            return True
+
+    def allocate(self, tags=None):
+        """ Acquires a ready node carrying all tags, returns it or None """
+        with self.lock:
+            self._advance()
+            for node in self.nodes:
+                if node['status'] != MaasMachineStatus.READY.value:
+                    continue
+                if tags and not set(tags).issubset(node['tag_names']):
+                    continue
+                node['status'] = MaasMachineStatus.ALLOCATED.value
+                node['owner'] = 'root'
+                return node
+            return None
+
+    def release(self, system_id):
+        with self.lock:
+            node = self.node(system_id)
+            if node is None:
+                return False
+            node['status'] = MaasMachineStatus.READY.value
+            node['owner'] = None
+            return True
+
+    def request(self, method, path, params):
+        """ answers a MAAS API request for path (relative to the API
+        root), returns (HTTP status, JSON body).
+        """
+        # latency is wall-clock time, not simulated
+        time.sleep(self.duration('latency'))
+        parts = [p for p in path.split('/') if p]
+        op = params.get('op')
+        if self.fails('api_failure_rate'):
+            return 503, {'error': 'simulated failure'}
+
+        if parts == ['nodes'] and op == 'list':
+            return 200, self.list_nodes()
+        if parts == ['nodes'] and op == 'accept_all' and method == 'POST':
+            self.accept_all()
+            return 200, []
+        if parts == ['tags'] and op == 'list':
+            return 200, [{'name': t, 'definition': '', 'comment': ''}
+                         for t in sorted(self.tags)]
+        if parts == ['tags'] and op == 'new' and method == 'POST':
+            self.new_tag(params['name'])
+            return 200, {'name': params['name']}
+        if len(parts) == 2 and parts[0] == 'tags' and \
+           op == 'update_nodes' and method == 'POST':
+            add = params.get('add', [])
+            if isinstance(add, str):
+                add = [add]
+            if not self.tag_nodes(parts[1], add):
+                return 404, {'error': 'no such tag'}
+            return 200, {'added': len(add), 'removed': 0}
+        if parts == ['nodegroups'] and op == 'list':
+            return 200, [{'uuid': 'simulated', 'status': 1,
+                          'name': 'maas', 'cluster_name': 'maas'}]
+        if len(parts) == 2 and parts[0] == 'nodes' and method == 'GET':
+            with self.lock:
+                node = copy.deepcopy(self.node(parts[1]))
+            if node is None:
+                return 404, {'error': 'not found'}
+            return 200, node
+        return 400, {'error': 'unsupported request'}
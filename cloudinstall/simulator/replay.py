@@ -0,0 +1,224 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Replays a recorded install
+
+    python3 -m cloudinstall.simulator.replay install.rec.gz --speed 10
+
+serves the juju and MAAS replies of a recording made with UCI_RECORD
+(see cloudinstall.recorder) and runs the deployment Controller against
+them.
+
+Queries such as FullStatus or the MAAS node list are answered with the
+latest reply recorded at the same point of the original install, so
+the replayed install sees machines and units come up when they did
+originally. Other calls get their recorded replies in order, matched
+per service, unit or relation so that a different deploy order still
+gets the right reply. Comparing the wall-clock time and call counts
+of the replay with the original's shows what a change to polling,
+caching or scheduling would have saved.
+"""
+
+import argparse
+import bisect
+import logging
+import sys
+import threading
+from collections import Counter
+
+from cloudinstall import recorder
+from cloudinstall.simulator import Clock, driver
+
+log = logging.getLogger('cloudinstall.simulator.replay')
+
+# Answered from the recording's timeline rather than in order
+JUJU_QUERIES = [('Client', 'FullStatus'), ('Client', 'ServiceGet'),
+                ('Client', 'GetAnnotations'), ('Annotations', 'Get'),
+                ('Client', 'CharmInfo'),
+                ('Client', 'EnvironmentInfo'),
+                ('Client', 'GetEnvironmentConstraints'),
+                ('AllWatcher', 'Next')]
+
+
+def juju_key(request):
+    params = request.get('Params') or {}
+    key = [request.get('Type'), request.get('Request')]
+    for name in ['ServiceName', 'UnitName', 'Tag', 'CharmURL', 'URL']:
+        if name in params:
+            key.append(params[name])
+    if 'Endpoints' in params:
+        key.append(" ".join(sorted(params['Endpoints'])))
+    return tuple(key)
+
+
+def maas_key(method, path, params):
+    path = "/".join(p for p in path.split('/') if p)
+    return (method, path, (params or {}).get('op'))
+
+
+class Track:
+    """ The recorded replies to one kind of request """
+
+    def __init__(self):
+        self.entries = []
+        self._times = []
+        self._next = 0
+
+    def add(self, entry):
+        self.entries.append(entry)
+        self._times.append(entry['t'])
+
+    def at(self, t):
+        """ returns the latest entry recorded at or before t, or the
+        first one
+        """
+        i = bisect.bisect_right(self._times, t)
+        return self.entries[max(i - 1, 0)]
+
+    def next(self):
+        """ returns the entries in order, then keeps returning the last """
+        entry = self.entries[min(self._next, len(self.entries) - 1)]
+        self._next += 1
+        return entry
+
+
+class _ReplayBackend:
+
+    def __init__(self, entries, clock):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.tracks = {}
+        self.requests = 0
+        self.missing = Counter()
+        for entry in sorted(entries, key=lambda e: e['t']):
+            key = self.key_for(entry)
+            self.tracks.setdefault(key, Track()).add(entry)
+
+    def lookup(self, key, query):
+        """ returns the recorded entry answering key, after its recorded
+        duration, or None
+        """
+        with self.lock:
+            self.requests += 1
+            track = self.tracks.get(key)
+            if track is None:
+                self.missing[key] += 1
+                log.warning("no recorded reply for {}".format(key))
+                return None
+            entry = track.at(self.clock.now()) if query else track.next()
+        self.clock.sleep(entry['dt'])
+        return entry
+
+
+class ReplayJuju(_ReplayBackend):
+    """ Answers juju API requests from a recording """
+
+    @staticmethod
+    def key_for(entry):
+        return juju_key(entry['juju'])
+
+    def reply(self, request):
+        request_id = request.get('RequestId')
+        if request.get('Type') == 'Admin':
+            return dict(RequestId=request_id, Response={})
+        query = (request.get('Type'), request.get('Request')) in JUJU_QUERIES
+        entry = self.lookup(juju_key(request), query)
+        if entry is None:
+            return dict(RequestId=request_id, Response={})
+        reply = dict(entry['reply'])
+        reply['RequestId'] = request_id
+        return reply
+
+
+class ReplayMaas(_ReplayBackend):
+    """ Answers MAAS API requests from a recording """
+
+    @staticmethod
+    def key_for(entry):
+        method, url, params = entry['maas']
+        return maas_key(method, url, params)
+
+    def request(self, method, path, params):
+        entry = self.lookup(maas_key(method, path, params), method == 'GET')
+        if entry is None:
+            return 404, {'error': 'not recorded'}
+        return entry['status'] or 503, entry['body']
+
+
+def summarize(entries):
+    """ returns (duration, juju calls, MAAS requests) of a recording """
+    if not entries:
+        return 0.0, 0, 0
+    duration = max(e['t'] + e['dt'] for e in entries)
+    juju = sum(1 for e in entries if 'juju' in e)
+    return duration, juju, len(entries) - juju
+
+
+def parse_options(*args, **kwds):
+    parser = argparse.ArgumentParser(
+        prog='python3 -m cloudinstall.simulator.replay',
+        description='Replays a recorded multi install against the '
+        'deployment controller')
+    parser.add_argument('recording', help='file written with UCI_RECORD')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay this many times faster than the '
+                        'original, default: %(default)s')
+    parser.add_argument('--dir', dest='directory',
+                        help='config directory, default: a temporary one')
+    parser.add_argument('--serve', action='store_true',
+                        help='only run the servers')
+    return parser.parse_args(*args, **kwds)
+
+
+def main(argv=None):
+    opts = parse_options(argv)
+    header, entries = recorder.load(opts.recording)
+    install_type = header.get('install_type') or 'Multi'
+    if install_type != 'Multi':
+        print("Only multi installs can be replayed, {} is a {} "
+              "install.".format(opts.recording, install_type))
+        return 1
+    directory = driver.setup(opts.directory)
+
+    clock = Clock(opts.speed)
+    juju = ReplayJuju([e for e in entries if 'juju' in e], clock)
+    maas = ReplayMaas([e for e in entries if 'maas' in e], clock)
+    juju_server, http_server, cfg_file = driver.start_servers(juju, maas,
+                                                              directory)
+    if opts.serve:
+        return driver.serve_forever(directory, http_server)
+
+    rc, elapsed = driver.install(cfg_file, directory, http_server)
+    juju_server.stop()
+    http_server.stop()
+
+    duration, juju_calls, maas_calls = summarize(entries)
+    print("\nOriginal install: {:.1f}s, {} juju calls, {} MAAS "
+          "requests".format(duration, juju_calls, maas_calls))
+    print("Replay at {}x: {} in {:.1f}s, {} juju calls, {} MAAS "
+          "requests".format(
+              opts.speed,
+              "completed" if rc == 0 else "failed (exit code {})".format(rc),
+              elapsed, juju.requests, maas.requests))
+    for key, count in sorted(list(juju.missing.items()) +
+                             list(maas.missing.items())):
+        print("  not in the recording: {} ({}x)".format(" ".join(
+            str(k) for k in key), count))
+    driver.report()
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main())
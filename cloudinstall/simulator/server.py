@@ -0,0 +1,233 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Network front ends for the simulated services
+
+JujuAPIServer speaks the juju websocket API over TLS, as macumba
+expects; HTTPAPIServer serves the MAAS 1.0 API and the charm store
+metadata endpoint.
+"""
+
+import json
+import logging
+import os
+import ssl
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+from wsgiref.simple_server import WSGIServer as _BaseWSGIServer
+from wsgiref.simple_server import make_server
+
+from ws4py.server.wsgirefserver import (WSGIServer,
+                                        WebSocketWSGIRequestHandler)
+from ws4py.server.wsgiutils import WebSocketWSGIApplication
+from ws4py.websocket import WebSocket
+
+log = logging.getLogger('cloudinstall.simulator.server')
+
+CHARMSTORE_ETAG = '"revision-1"'
+
+
+def make_certificate(directory):
+    """ writes a self-signed certificate and key to directory, returns
+    (certfile, keyfile).
+    """
+    certfile = os.path.join(directory, 'simulator.crt')
+    keyfile = os.path.join(directory, 'simulator.key')
+    if not os.path.exists(certfile):
+        subprocess.check_call(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+             '-days', '365', '-subj', '/CN=localhost',
+             '-keyout', keyfile, '-out', certfile],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+class _ServerThread:
+    """ Runs a socketserver in a daemon thread """
+
+    server = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return "{}:{}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name=type(self).__name__,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _JujuWebSocket(WebSocket):
+    """ One client connection; each request is answered from its own
+    thread so blocking calls such as AllWatcher.Next don't hold up the
+    rest.
+    """
+
+    juju = None
+
+    def opened(self):
+        self._send_lock = threading.Lock()
+
+    def received_message(self, message):
+        request = json.loads(message.data.decode('utf-8'))
+        threading.Thread(target=self._answer, args=(request,),
+                         daemon=True).start()
+
+    def _answer(self, request):
+        try:
+            response = self.juju.reply(request)
+        except Exception as e:
+            log.exception("simulator failed handling {}".format(request))
+            response = dict(RequestId=request.get('RequestId'),
+                            Error=str(e), ErrorCode='')
+        if self.terminated:
+            return
+        with self._send_lock:
+            self.send(json.dumps(response))
+
+
+class _WebSocketServer(WSGIServer):
+    """ Runs each websocket in its own thread rather than in ws4py's
+    epoll manager, which misses frames already decrypted and buffered
+    by the TLS layer.
+    """
+
+    def initialize_websockets_manager(self):
+        self.websockets = []
+
+    def link_websocket_to_server(self, ws):
+        self.websockets.append(ws)
+        threading.Thread(target=ws.run, name='simulator-websocket',
+                         daemon=True).start()
+
+    def server_close(self):
+        for ws in self.websockets:
+            if not ws.terminated:
+                ws.close()
+        _BaseWSGIServer.server_close(self)
+
+
+class JujuAPIServer(_ServerThread):
+    """ TLS websocket server answering requests with the backend's
+    reply(request) method, accepting any environment uuid and
+    credentials.
+    """
+
+    def __init__(self, juju, certfile, keyfile, host='127.0.0.1', port=0):
+        handler_cls = type('JujuWebSocket', (_JujuWebSocket,),
+                           dict(juju=juju))
+        self.server = make_server(
+            host, port, server_class=_WebSocketServer,
+            handler_class=_QuietWebSocketHandler,
+            app=WebSocketWSGIApplication(handler_cls=handler_cls))
+        context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+        context.load_cert_chain(certfile, keyfile)
+        self.server.socket = context.wrap_socket(self.server.socket,
+                                                 server_side=True)
+        self.server.initialize_websockets_manager()
+
+
+class _QuietWebSocketHandler(WebSocketWSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    """ Charm store requests, and MAAS 1.0 API requests passed on to the
+    backend's request(method, path, params) method.
+    """
+
+    maas = None
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+    def _reply(self, body, status=200, headers={}):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _params(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            params.update(parse_qs(self.rfile.read(length).decode('utf-8')))
+        return url.path, {k: v[0] if len(v) == 1 else v
+                          for k, v in params.items()}
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        path, params = self._params()
+        if path.startswith('/charmstore/'):
+            return self._charmstore(params)
+        prefix = '/MAAS/api/1.0'
+        if not path.startswith(prefix):
+            return self._reply({'error': 'not found'}, 404)
+        status, body = self.maas.request(method, path[len(prefix):], params)
+        self._reply(body, status)
+
+    def _charmstore(self, params):
+        """ /charmstore/v5/meta/any?id=series/name[&id=...], with a
+        fixed ETag as every charm is at revision 1
+        """
+        charm_ids = params.get('id', [])
+        if isinstance(charm_ids, str):
+            charm_ids = [charm_ids]
+        if not charm_ids or not all('/' in c for c in charm_ids):
+            return self._reply({'Message': 'not found'}, 404)
+        if self.headers.get('If-None-Match') == CHARMSTORE_ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self._reply({c: {'Id': "cs:{}-1".format(c), 'Meta': {}}
+                     for c in charm_ids},
+                    headers={'ETag': CHARMSTORE_ETAG})
+
+
+class HTTPAPIServer(_ServerThread):
+    """ HTTP server for a MAAS backend and the charm store """
+
+    def __init__(self, maas, host='127.0.0.1', port=0):
+        handler_cls = type('HTTPHandler', (_HTTPHandler,), dict(maas=maas))
+        self.server = _HTTPServer((host, port), handler_cls)
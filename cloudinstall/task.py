@@ -14,12 +14,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import os
 import time
-import yaml
 
-from cloudinstall import utils
 from cloudinstall import async
+from cloudinstall import trace
+from cloudinstall.profiler import profiler
 from cloudinstall.alarms import AlarmMonitor
 from cloudinstall.config import Config
 
@@ -57,6 +56,7 @@ class Tasker:
         self.stopped = False
         self.alarm = None
         self.task_info_func = None
+        self.current_span = trace.NULL_SPAN
 
     def register_tasks(self, tasks):
         self.tasks = [(n, None, None) for n in tasks]
@@ -88,23 +88,11 @@ class Tasker:
 
         self.tasks[self.current_task_index] = (expectedname,
                                                time.time(), None)
+        self.current_span = trace.span(expectedname, 'phase')
+        profiler.mark_phase(expectedname)
         self.stopped = False
         if self.alarm is None:
             self.update_progress()
-        self.write_timings()
-
-    def write_timings(self):
-        readable_tasks = []
-        for n, s, e in self.tasks:
-            if e is not None and s is not None:
-                timing = e - s
-            else:
-                timing = None
-            readable_tasks.append((n, s, e, timing))
-
-        utils.spew(os.path.join(self.config.cfg_path, 'timings.yaml'),
-                   yaml.dump(readable_tasks),
-                   utils.install_user())
 
     def stop_current_task(self):
         if self.current_task_index >= len(self.tasks):
@@ -116,9 +104,10 @@ class Tasker:
             return
         n, s, _ = self.tasks[self.current_task_index]
         self.tasks[self.current_task_index] = (n, s, time.time())
+        self.current_span.end()
+        self.current_span = trace.NULL_SPAN
         self.current_task_index += 1
         self.stopped = True
-        self.write_timings()
 
     def update_progress(self, loop=None, userdata=None):
         self.alarm = None
@@ -192,7 +181,8 @@ class FakeInstall:
         self.tasker.register_tasks(self.tl)
         self.update_progress()
         async.submit(self.async_go,
-                     self.display_controller.show_exception_message)
+                     self.display_controller.show_exception_message,
+                     lane='io')
 
     def async_go(self):
         for t in self.tl:
@@ -0,0 +1,240 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Install tracing
+
+Records timed spans (installer phases, API calls, subprocesses, remote
+runs, waits, deploys, relations and post processing) from any thread and
+exports them as Chrome trace-event JSON, viewable in chrome://tracing,
+plus a flat per-span summary.
+
+Which categories are recorded is set with UCI_TRACE:
+    unset         installer phases only
+    all           everything
+    off           nothing
+    wait,api,...  a comma separated list of categories
+
+Spans of disabled categories cost a set lookup.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from functools import wraps
+
+log = logging.getLogger('cloudinstall.trace')
+
+CATEGORIES = ['phase', 'api', 'subprocess', 'remote', 'wait', 'task',
+              'deploy', 'relations', 'postproc']
+
+_categories = set()
+_events = []
+_events_lock = threading.Lock()
+_thread_names = {}
+
+
+def configure(spec=None):
+    """ Sets the recorded categories from a UCI_TRACE style string """
+    global _categories
+    if spec is None:
+        spec = os.getenv('UCI_TRACE', 'phase')
+    spec = spec.strip()
+    if spec == 'all':
+        _categories = set(CATEGORIES)
+    elif spec in ['off', '']:
+        _categories = set()
+    else:
+        _categories = set(c.strip() for c in spec.split(','))
+
+
+def enabled(cat):
+    return cat in _categories
+
+
+def record(name, cat, start, duration, args=None):
+    """ Records a span that already finished.
+
+    :param float start: epoch seconds
+    :param float duration: seconds
+    """
+    if cat not in _categories:
+        return
+    t = threading.current_thread()
+    event = dict(name=name, cat=cat, ph='X', pid=os.getpid(), tid=t.ident,
+                 ts=int(start * 1e6), dur=int(duration * 1e6))
+    if args:
+        event['args'] = args
+    with _events_lock:
+        _thread_names[t.ident] = t.name
+        _events.append(event)
+
+
+class Span:
+    """ A running span, recorded when it ends """
+
+    __slots__ = ['name', 'cat', 'args', 'start']
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = time.time()
+
+    def set_arg(self, key, value):
+        self.args[key] = value
+
+    def end(self, error=None):
+        if error is not None:
+            self.args['error'] = str(error)
+        record(self.name, self.cat, self.start, time.time() - self.start,
+               self.args)
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc)
+        return False
+
+
+class _NullSpan:
+    """ Stands in for Span when its category is not recorded """
+
+    def set_arg(self, key, value):
+        pass
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(name, cat, **args):
+    """ returns a span, to be used as a context manager or ended
+    explicitly with end()
+    """
+    if cat not in _categories:
+        return NULL_SPAN
+    return Span(name, cat, args)
+
+
+def traced(cat, name=None):
+    """ Decorator recording each call of the function as a span """
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def reset():
+    with _events_lock:
+        del _events[:]
+        _thread_names.clear()
+
+
+def chrome_trace():
+    """ returns recorded spans in Chrome trace-event format """
+    with _events_lock:
+        events = list(_events)
+        names = dict(_thread_names)
+    pid = os.getpid()
+    meta = [dict(name='thread_name', ph='M', pid=pid, tid=tid,
+                 args=dict(name=n)) for tid, n in names.items()]
+    return dict(traceEvents=meta + events, displayTimeUnit='ms')
+
+
+def summary():
+    """ returns text lines with count, total and max time per span
+    name, longest total first
+    """
+    totals = {}
+    with _events_lock:
+        for e in _events:
+            key = (e['cat'], e['name'])
+            count, total, mx = totals.get(key, (0, 0, 0))
+            totals[key] = (count + 1, total + e['dur'], max(mx, e['dur']))
+    lines = []
+    for (cat, name), (count, total, mx) in sorted(
+            totals.items(), key=lambda kv: kv[1][1], reverse=True):
+        lines.append("{cat:<10} {total:>10.2f}s {count:>6}x "
+                     "{mx:>9.2f}s max  {name}".format(
+                         cat=cat, name=name, count=count,
+                         total=total / 1e6, mx=mx / 1e6))
+    return lines
+
+
+def export(directory, owner=None):
+    """ Writes trace-<program>.json and trace-<program>-summary.txt to
+    directory.
+    """
+    if not _categories:
+        return
+    prog = os.path.basename(sys.argv[0]) or 'cloudinstall'
+    paths = [os.path.join(directory, 'trace-{}.json'.format(prog)),
+             os.path.join(directory, 'trace-{}-summary.txt'.format(prog))]
+    try:
+        with open(paths[0], 'w') as f:
+            json.dump(chrome_trace(), f)
+        with open(paths[1], 'w') as f:
+            f.write("\n".join(summary()) + "\n")
+        if owner:
+            for p in paths:
+                shutil.chown(p, owner)
+    except OSError as e:
+        log.warning("Unable to write trace to {}: {}".format(directory, e))
+
+
+def _record_juju_call(facade, request, elapsed, sent, received, error):
+    record("{}.{}".format(facade, request), 'api',
+           time.time() - elapsed, elapsed,
+           dict(error=str(error)) if error else None)
+
+
+def _record_maas_request(method, url, params, elapsed, sent, received,
+                         status_code, error):
+    record("MAAS {} {}".format(method, url), 'api',
+           time.time() - elapsed, elapsed, dict(status=status_code))
+
+
+def install_api_observers():
+    """ Records juju and MAAS API calls as 'api' spans """
+    if 'api' not in _categories:
+        return
+    import maasclient
+    import macumba.api
+    if _record_juju_call not in macumba.api.call_observers:
+        macumba.api.call_observers.append(_record_juju_call)
+    if _record_maas_request not in maasclient.request_observers:
+        maasclient.request_observers.append(_record_maas_request)
+
+
+configure()
@@ -17,5 +17,6 @@ from .error import ErrorView  # NOQA
 from .services import ServicesView  # NOQA
 from .machinewait import MachineWaitView  # noqa
 from .help import HelpView  # noqa
+from .metrics import MetricsView  # noqa
 from .nodeinstallwait import NodeInstallWaitView  # noqa
 from .stepinfo import StepInfoView  # noqa
@@ -63,6 +63,13 @@ installed, one for OpenStack Horizon and the other for the Juju GUI.
 
 - '(H/h/?)' displays this help screen.
 
+- '(M/m)' displays API call latencies, wait times and background task
+  metrics. They are also summarized in ~/.cloud-install/commands.log and
+  saved to ~/.cloud-install/metrics.json on exit.
+
+- '(P/p)' starts or stops profiling, writing profiles for each phase to
+  ~/.cloud-install/profiles/
+
 - 'q' quits.
             """),
             Color.header_title(Text("Troubleshooting")),
@@ -27,6 +27,17 @@ log = logging.getLogger('cloudinstall.machinewait')
 
 class MachineWaitView(WidgetWrap):
 
+    """ Waits for enough machines in MAAS. The inventory is fetched in
+    the background, see watch_maas(), and the view renders the latest
+    snapshot, so a slow MAAS doesn't hold up the UI.
+    """
+
+    # Seconds between MAAS refreshes: reset to REFRESH_INTERVAL when
+    # something changed, else multiplied by REFRESH_BACKOFF
+    REFRESH_INTERVAL = 1
+    REFRESH_BACKOFF = 1.5
+    MAX_REFRESH_INTERVAL = 15
+
     def __init__(self, display_controller, installer, config):
         self.display_controller = display_controller
         self.installer = installer
@@ -38,9 +49,17 @@ class MachineWaitView(WidgetWrap):
         else:
             self.maas_client, self.maas_state = connect_to_maas(creds)
         self.spinner = Spinner(15, 4)
+        # (global_ok, [ok, condition]) from the last refresh, None
+        # until the first one
+        self.status = None
+        self.rendered_status = None
+        self.watching = True
         w = self.build_widgets()
         super().__init__(w)
-        self.update()
+        self.render_status()
+        async.submit(self.watch_maas,
+                     self.display_controller.show_exception_message,
+                     lane='refresh')
 
     def build_widgets(self):
         self.message = Text("Please review available machines in MAAS",
@@ -82,21 +101,60 @@ class MachineWaitView(WidgetWrap):
         global_ok = all([ok for ok, _ in conditions])
         return global_ok, conditions
 
+    def refresh(self):
+        """ Fetches the MAAS inventory, returns True if the status
+        changed
+        """
+        status = self.get_status()
+        if status == self.status:
+            return False
+        self.status = status
+        return True
+
+    def watch_maas(self):
+        """ Refreshes the status until the install continues, less often
+        while it doesn't change
+        """
+        interval = self.REFRESH_INTERVAL
+        try:
+            while self.watching:
+                try:
+                    changed = self.refresh()
+                except Exception:
+                    log.exception("Error fetching machines from MAAS")
+                    changed = False
+                if changed:
+                    interval = self.REFRESH_INTERVAL
+                else:
+                    interval = min(interval * self.REFRESH_BACKOFF,
+                                   self.MAX_REFRESH_INTERVAL)
+                async.sleep_until(interval)
+        except async.ThreadCancelledException:
+            pass
+
     def update(self):
         msg = ("Before continuing, ensure that at least one machine is "
                "enlisted into MAAS:")
-        self.message = Text(self.spinner.next_frame() + ['\n', msg, '\n'],
-                            align='center')
-        contents = [(self.message,
-                     self.main_pile.options())]
-
-        global_ok, statuses = self.get_status()
+        self.message.set_text(self.spinner.next_frame() + ['\n', msg, '\n'])
+        if self.status != self.rendered_status:
+            self.render_status()
+
+    def render_status(self):
+        """ Rebuilds the conditions and buttons from the latest status """
+        status = self.status
+        if status is None:
+            global_ok = False
+            statuses = [(None, "Checking MAAS\N{HORIZONTAL ELLIPSIS}")]
+        else:
+            global_ok, statuses = status
         status_map = {True: ('success_icon', "\u2713 "),
-                      False: ('error_icon', "<!> ")}
-        contents += [(Text([status_map[status], condition],
+                      False: ('error_icon', "<!> "),
+                      None: ('info_minor', "")}
+        contents = [(self.message, self.main_pile.options())]
+        contents += [(Text([status_map[ok], condition],
                            align='center'),
                       self.main_pile.options())
-                     for status, condition
+                     for ok, condition
                      in statuses]
         contents += [(Divider(), self.main_pile.options()),
                      (self.button_pile, self.main_pile.options())]
@@ -122,8 +180,10 @@ class MachineWaitView(WidgetWrap):
 
         # ensure that the button is always focused:
         self.main_pile.focus_position = len(self.main_pile.contents) - 1
+        self.rendered_status = status
 
     def do_continue(self, *args, **kwargs):
+        self.watching = False
         async.submit(self.installer.do_install,
                      self.display_controller.show_exception_message)
 
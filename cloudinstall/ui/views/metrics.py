@@ -0,0 +1,52 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+from urwid import Text, WidgetWrap, Divider
+from cloudinstall import async, metrics
+from cloudinstall.ui.lists import SimpleList
+from cloudinstall.ui.utils import Color, Padding
+
+
+class MetricsView(WidgetWrap):
+
+    def __init__(self):
+        request_lines = metrics.registry.summary() or ["No calls recorded."]
+        wait_lines = ["{}: {count} waits, {polls} polls, {total:.1f}s total, "
+                      "{max:.1f}s max, {timeouts} timeouts".format(k, **v)
+                      for k, v in sorted(async.wait_stats().items())]
+        lane_lines = ["{}: {workers} workers, {depth} queued, "
+                      "{completed} done, {failed} failed, "
+                      "{wait_time:.1f}s waiting, {run_time:.1f}s running"
+                      .format(k, **v)
+                      for k, v in sorted(async.lane_stats().items())]
+        metrics_text = [
+            Padding.line_break(""),
+            Text("OpenStack Installer - Metrics \u21C5 Scroll (ESC) Close",
+                 align="center"),
+            Divider('-', 1, 1),
+            Color.header_title(Text("API Calls")),
+            Divider('-'),
+            Text("\n".join(request_lines)),
+            Divider(),
+            Color.header_title(Text("Waits")),
+            Divider('-'),
+            Text("\n".join(wait_lines) or "No waits recorded."),
+            Divider(),
+            Color.header_title(Text("Background Tasks")),
+            Divider('-'),
+            Text("\n".join(lane_lines))]
+        w = Padding.center_79(SimpleList(metrics_text))
+        super().__init__(w)
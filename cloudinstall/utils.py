@@ -21,14 +21,12 @@ try:
 except ImportError:
     Mapping = dict
 
-from jinja2 import Environment, FileSystemLoader
 import os
 import re
 import string
 import random
 import fnmatch
 import logging
-import urwid
 import itertools
 import configparser
 import time
@@ -39,9 +37,16 @@ import errno
 import shutil
 import json
 import yaml
-import requests
 from urllib.parse import urlparse
 
+from cloudinstall import async
+from cloudinstall import charm_config
+from cloudinstall import trace
+
+# urwid, jinja2 and requests are imported by the functions using them:
+# cloudinstall.config needs this module, and 'openstack-install -g' and
+# openstack-config, which shell scripts call in loops, need no more.
+
 log = logging.getLogger('cloudinstall.utils')
 
 # String with number of minutes, or None.
@@ -241,21 +246,45 @@ def render_charm_config(config):
         if pv:
             template_args[pk] = pv
 
-    charm_conf_modified = charm_conf.render(**template_args)
     dest_yaml_path = os.path.join(config.cfg_path, 'charmconf.yaml')
-    spew(dest_yaml_path, charm_conf_modified)
-
-    # Check for custom charm options
     charm_conf_custom_file = config.getopt('charm_config_file')
     if charm_conf_custom_file and os.path.exists(charm_conf_custom_file):
+        charm_conf_custom_raw = slurp(charm_conf_custom_file)
+    else:
+        charm_conf_custom_raw = None
+
+    # skip rendering and merging again what is already in place
+    template_source = None
+    if getattr(charm_conf, 'filename', None):
+        template_source = slurp(charm_conf.filename)
+    if template_source is not None:
+        digest = charm_config.inputs_digest(template_source, template_args,
+                                            charm_conf_custom_raw)
+        if charm_config.is_current(dest_yaml_path, digest):
+            log.debug("Charm config is up to date.")
+            return
+    else:
+        digest = None
+
+    charm_conf_modified = charm_conf.render(**template_args)
+    charm_conf_options = yaml.safe_load(charm_conf_modified)
+
+    # Check for custom charm options
+    if charm_conf_custom_raw is not None:
         log.debug("Found custom charm config, updating charm settings.")
-        charm_conf = yaml.load(slurp(dest_yaml_path))
-        charm_conf_custom = yaml.load(
-            slurp(config.getopt('charm_config_file')))
-        charm_conf_merged = merge_dicts(charm_conf,
-                                        charm_conf_custom)
-        spew(dest_yaml_path, yaml.safe_dump(
-            charm_conf_merged, default_flow_style=False))
+        charm_conf_custom = yaml.safe_load(charm_conf_custom_raw)
+        charm_config.validate(charm_conf_custom, charm_conf_custom_file)
+        charm_conf_options = merge_dicts(charm_conf_options,
+                                         charm_conf_custom or {})
+        charm_conf_modified = yaml.safe_dump(charm_conf_options,
+                                             default_flow_style=False)
+    # fail now rather than when deploying
+    charm_config.validate(charm_conf_options)
+
+    spew(dest_yaml_path, charm_conf_modified)
+    if digest is not None:
+        charm_config.record_inputs(dest_yaml_path, digest,
+                                   charm_conf_modified)
 
 
 def chown(path, user, group=None, recursive=False):
@@ -337,16 +366,17 @@ def get_command_output(command, timeout=None, user_sudo=False):
     if user_sudo:
         command = "sudo -E -H -u {0} {1}".format(install_user(), command)
 
-    try:
-        p = Popen(command, shell=True,
-                  stdout=PIPE, stderr=PIPE,
-                  bufsize=-1, env=cmd_env, close_fds=True)
-    except OSError as e:
-        if e.errno == errno.ENOENT:
-            return dict(ret=127, output="", err="")
-        else:
-            raise e
-    stdout, stderr = p.communicate()
+    with trace.span(command[:60], 'subprocess'):
+        try:
+            p = Popen(command, shell=True,
+                      stdout=PIPE, stderr=PIPE,
+                      bufsize=-1, env=cmd_env, close_fds=True)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return dict(ret=127, output="", err="")
+            else:
+                raise e
+        stdout, stderr = p.communicate()
     if p.returncode == 126 or p.returncode == 127:
         stdout = bytes()
     if not stderr:
@@ -369,23 +399,18 @@ def poll_until_true(cmd, predicate, frequency, timeout=600,
     are re-raised.
 
     """
-    start_time = time.time()
-    frequency_stub = time.time()
-    while True:
-        # continue if frequency not met
-        if time.time() - frequency_stub <= frequency:
-            continue
+    def check():
         try:
             output = get_command_output(cmd)
         except Exception as e:
             if not ignore_exceptions:
                 raise e
-            else:
-                log.debug("**Ignoring** exception: {}".format(e))
-        if predicate(output):
-            return True
-        if time.time() - start_time >= timeout:
+            log.debug("**Ignoring** exception: {}".format(e))
             return False
+        return predicate(output)
+
+    return bool(async.wait_until(check, name="poll '{}'".format(cmd),
+                                 interval=frequency, timeout=timeout))
 
 
 def remote_cp(machine_id, src, dst, juju_home):
@@ -563,14 +588,20 @@ def find(file_pattern, top_dir, max_depth=None, path_pattern=None):
             yield os.path.join(path, name)
 
 
+# where load_template() looks by default
+TEMPLATE_PATH = '/usr/share/openstack/templates'
+
+
 def load_template(name, path=None):
     """ load template file
 
     :param str name: name of template file
     :param str path: alternate location of template location
     """
+    from jinja2 import Environment, FileSystemLoader
+
     if path is None:
-        path = '/usr/share/openstack/templates'
+        path = TEMPLATE_PATH
     env = Environment(
         loader=FileSystemLoader(path))
     return env.get_template(name)
@@ -722,6 +753,8 @@ def make_screen_hicolor(screen):
 
 
 def get_hicolor_screen(palette):
+    import urwid
+
     screen = urwid.raw_display.Screen()
     screen.register_palette(palette)
     return make_screen_hicolor(screen)
@@ -742,6 +775,8 @@ def download_url(url, output_file):
     :param str url: HTTP resource
     :param str output_file: path to store downloaded contents
     """
+    import requests
+
     res = requests.get(url)
     if res.ok:
         spew(output_file, res.content.decode('utf-8'))
@@ -20,6 +20,20 @@ import bson
 from requests_oauthlib import OAuth1
 import requests
 import json
+import logging
+import time
+
+log = logging.getLogger('maasclient')
+
+# Callables invoked after every MAAS request with
+# (method, url, params, elapsed seconds, bytes sent, bytes received,
+#  status code, error) where error is None or the exception raised.
+request_observers = []
+
+# Callables invoked after every MAAS request with the full exchange:
+# (method, url, params, start time, elapsed seconds, response, error)
+# where response is the requests.Response, or None if the request failed.
+response_observers = []
 
 
 class MaasClient:
@@ -48,15 +62,53 @@ class MaasClient:
                        signature_type='query')
         return oauth
 
+    def _request(self, method, url, params=None, params_arg=None):
+        """ Performs the request, reporting it to request_observers
+
+        :param params_arg: requests keyword to send params as, if any
+        """
+        kwargs = {params_arg: params} if params_arg else {}
+        start_time = time.time()
+        res = None
+        error = None
+        try:
+            res = getattr(requests, method)(url=self.auth.api_url + url,
+                                            auth=self._oauth(), **kwargs)
+            return res
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.time() - start_time
+            if request_observers:
+                self._notify_request_observers(method, url, params,
+                                               elapsed, res, error)
+            for observer in response_observers:
+                try:
+                    observer(method.upper(), url, params, start_time,
+                             elapsed, res, error)
+                except Exception:
+                    log.exception("response observer failed")
+
+    def _notify_request_observers(self, method, url, params, elapsed,
+                                  res, error):
+        sent = len(str(params)) if params else 0
+        received = len(res.content) if res is not None else 0
+        status_code = res.status_code if res is not None else None
+        for observer in request_observers:
+            try:
+                observer(method.upper(), url, params, elapsed, sent,
+                         received, status_code, error)
+            except Exception:
+                log.exception("request observer failed")
+
     def get(self, url, params=None):
         """ Performs a authenticated GET against a MAAS endpoint
 
         :param url: MAAS endpoint
         :param params: extra data sent with the HTTP request
         """
-        return requests.get(url=self.auth.api_url + url,
-                            auth=self._oauth(),
-                            params=params)
+        return self._request('get', url, params, 'params')
 
     def post(self, url, params=None):
         """ Performs a authenticated POST against a MAAS endpoint
@@ -64,9 +116,7 @@ class MaasClient:
         :param url: MAAS endpoint
         :param params: extra data sent with the HTTP request
         """
-        return requests.post(url=self.auth.api_url + url,
-                             auth=self._oauth(),
-                             data=params)
+        return self._request('post', url, params, 'data')
 
     def delete(self, url, params=None):
         """ Performs a authenticated DELETE against a MAAS endpoint
@@ -74,8 +124,7 @@ class MaasClient:
         :param url: MAAS endpoint
         :param params: extra data sent with the HTTP request
         """
-        return requests.delete(url=self.auth.api_url + url,
-                               auth=self._oauth())
+        return self._request('delete', url)
 
     ###########################################################################
     # Boot Images API
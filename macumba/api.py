@@ -1,10 +1,14 @@
+import json
 import time
+import os
 import os.path as path
 import requests
 import logging
 import threading
 from .errors import (LoginError,
                      CharmNotFoundError,
+                     ConnectionClosedError,
+                     ConnectionLostError,
                      RequestTimeout,
                      ServerError,
                      BadResponseError,
@@ -13,35 +17,211 @@ from .ws import JujuWS
 
 log = logging.getLogger('macumba')
 
+# Callables invoked after every Base.call with
+# (facade, request, elapsed seconds, bytes sent, bytes received, error)
+# where error is None or the exception raised by the call.
+call_observers = []
+
+# Callables invoked after every Base.call with the full exchange:
+# (request params, reply message, start time, elapsed seconds) where the
+# reply is the message juju sent, or {'Error': ..., 'ErrorCode': ...}
+# describing a client side failure such as a timeout.
+message_observers = []
+
+# Callables invoked with (state, url) as the connection changes state,
+# one of the CONNECTION_* states below.
+connection_observers = []
+
+CONNECTION_LOST = 'lost'
+CONNECTION_RESTORED = 'restored'
+CONNECTION_FAILED = 'failed'
+
+# Seconds between websocket pings; a link that misses a few of them
+# is reconnected. 0 turns heartbeats off.
+HEARTBEAT_INTERVAL = float(os.getenv('MACUMBA_HEARTBEAT_INTERVAL', 3))
+
+# Seconds connecting and logging in may take, 0 to wait forever
+CONNECT_TIMEOUT = float(os.getenv('MACUMBA_CONNECT_TIMEOUT', 30))
+
+RECONNECT_ATTEMPTS = 5
+RECONNECT_DELAY = 1
+
+# Requests that only read, and are sent again on the new connection
+# when the connection is lost while waiting for their reply
+REPLAYABLE_REQUESTS = {('Client', 'FullStatus'),
+                       ('Client', 'EnvironmentInfo'),
+                       ('Client', 'GetEnvironmentConstraints'),
+                       ('Client', 'ServiceGet'),
+                       ('Client', 'CharmInfo'),
+                       ('Client', 'GetAnnotations'),
+                       ('Annotations', 'Get')}
+
+# Charm store API root, overridable for testing against a local stand-in
+CHARMSTORE_URL = os.getenv('MACUMBA_CHARMSTORE_URL',
+                           'https://api.jujucharms.com/charmstore')
+
+
+# On-disk charm store metadata cache shared between runs, only used
+# once a path is set
+CHARMSTORE_CACHE_PATH = os.getenv('MACUMBA_CHARMSTORE_CACHE')
+# Seconds a charm cached on disk is used before asking the store again.
+# Within a process the revision first found is kept, see _cs_cache.
+CHARMSTORE_CACHE_TTL = 3600
+# Answer only from the cache, never asking the store
+CHARMSTORE_OFFLINE = os.getenv('MACUMBA_CHARMSTORE_OFFLINE',
+                               '') not in ['', '0']
+
+# charm id -> query_cs result. The revision found first is kept for the
+# life of the process, whatever CHARMSTORE_CACHE_TTL, so a charm added
+# ahead of its deploy is the one deployed. Newer revisions are picked
+# up by the next run.
+_cs_cache = {}
+_cs_cache_lock = threading.Lock()
+_cs_disk_cache_lock = threading.Lock()
+
+
+def _charm_id(charm):
+    try:
+        series, charm = charm.split('/')
+    except ValueError:
+        series = 'trusty'
+    return "{}/{}".format(series, charm)
+
 
 def query_cs(charm):
     """ This helper routine will query the charm store to pull latest revisions
     and charmstore url for the api.
 
+    Results are kept for the life of the process, revisions included,
+    and cached on disk for CHARMSTORE_CACHE_TTL seconds if
+    CHARMSTORE_CACHE_PATH is set.
+
     :param str charm: charm name, can be in the form of 'precise/<charm>' to
                       specify an alternate series.
     """
-    try:
-        series, charm = charm.split('/')
-    except ValueError:
-        series = 'trusty'
-    charm_id = "{}/{}".format(series, charm)
-    base_url = "https://api.jujucharms.com/charmstore/v5/meta/any?id={}"
-    url = base_url.format(charm_id)
-    r = requests.get(url)
-    if r.status_code != 200:
-        log.error("error accessing charm store API: '{}'".format(url))
-        raise CharmNotFoundError("Unknown Error accessing Juju Charm Store")
-    results = r.json()
-    if len(results) == 0:
+    results = query_cs_many([charm])
+    if charm not in results:
         raise CharmNotFoundError("Charm {} not found on Juju Charm"
                                  " Store.".format(charm))
-    result = r.json()[charm_id]
+    return results[charm]
+
+
+def query_cs_many(charms):
+    """ Returns {charm: query_cs(charm)} for the given charm names,
+    asking the store about all of the uncached ones in one request.
+    Charms the store doesn't know are left out.
+    """
+    charm_ids = {charm: _charm_id(charm) for charm in charms}
+    with _cs_cache_lock:
+        missing = sorted(set(charm_id for charm_id in charm_ids.values()
+                             if charm_id not in _cs_cache))
+    if missing:
+        found = _resolve_charm_ids(missing)
+        with _cs_cache_lock:
+            for charm_id, result in found.items():
+                _cs_cache.setdefault(charm_id, result)
+
+    with _cs_cache_lock:
+        return {charm: dict(_cs_cache[charm_id])
+                for charm, charm_id in charm_ids.items()
+                if charm_id in _cs_cache}
+
+
+def _read_cs_disk_cache():
+    """ dict(charms={charm id: dict(result, fetched)},
+             etags={request url: ETag of its reply})
+    """
+    cache = dict(charms={}, etags={})
+    if not CHARMSTORE_CACHE_PATH:
+        return cache
+    try:
+        with open(CHARMSTORE_CACHE_PATH) as f:
+            saved = json.load(f)
+        cache.update((k, saved[k]) for k in cache
+                     if isinstance(saved.get(k), dict))
+    except (OSError, ValueError, AttributeError):
+        pass
+    return cache
 
-    # ensure that series is in the charm Id:
-    revno = result['Id'].split('-')[-1]
-    result['Id'] = "cs:{}-{}".format(charm_id, revno)
-    return result
+
+def _write_cs_disk_cache(cache):
+    if not CHARMSTORE_CACHE_PATH:
+        return
+    try:
+        os.makedirs(path.dirname(CHARMSTORE_CACHE_PATH), exist_ok=True)
+        tmp_path = CHARMSTORE_CACHE_PATH + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.rename(tmp_path, CHARMSTORE_CACHE_PATH)
+    except OSError as e:
+        log.warning("Unable to write charm store cache: {}".format(e))
+
+
+def _resolve_charm_ids(charm_ids):
+    """ Returns charm id -> result for charm_ids, from the disk cache
+    while fresh, else from the store in one request, revalidated with
+    the ETag of the last reply to the same request.
+    """
+    with _cs_disk_cache_lock:
+        cache = _read_cs_disk_cache()
+        entries = cache['charms']
+        now = time.time()
+        found = {}
+        stale = []
+        for charm_id in charm_ids:
+            entry = entries.get(charm_id)
+            if entry and (CHARMSTORE_OFFLINE or
+                          now - entry['fetched'] < CHARMSTORE_CACHE_TTL):
+                found[charm_id] = entry['result']
+            else:
+                stale.append(charm_id)
+        if not stale:
+            return found
+        if CHARMSTORE_OFFLINE:
+            log.warning("Charm store offline, not resolving "
+                        "{}".format(", ".join(stale)))
+            return found
+
+        url = "{}/v5/meta/any?{}".format(
+            CHARMSTORE_URL, "&".join("id={}".format(charm_id)
+                                     for charm_id in stale))
+        headers = {}
+        etag = cache['etags'].get(url)
+        if etag and all(charm_id in entries for charm_id in stale):
+            headers['If-None-Match'] = etag
+
+        try:
+            r = requests.get(url, headers=headers, timeout=60)
+        except requests.RequestException as e:
+            log.warning("Unable to reach the charm store, using cached "
+                        "charms: {}".format(e))
+            found.update({charm_id: entries[charm_id]['result']
+                          for charm_id in stale if charm_id in entries})
+            return found
+
+        if r.status_code == 304:
+            for charm_id in stale:
+                entries[charm_id]['fetched'] = now
+                found[charm_id] = entries[charm_id]['result']
+        elif r.status_code != 200:
+            log.error("error accessing charm store API: '{}'".format(url))
+            raise CharmNotFoundError("Unknown Error accessing Juju Charm "
+                                     "Store")
+        else:
+            results = r.json()
+            if r.headers.get('ETag'):
+                cache['etags'][url] = r.headers['ETag']
+            for charm_id in stale:
+                if charm_id not in results:
+                    continue
+                result = results[charm_id]
+                # ensure that series is in the charm Id:
+                revno = result['Id'].split('-')[-1]
+                result['Id'] = "cs:{}-{}".format(charm_id, revno)
+                entries[charm_id] = dict(result=result, fetched=now)
+                found[charm_id] = result
+        _write_cs_disk_cache(cache)
+        return found
 
 
 class Base:
@@ -52,19 +232,26 @@ class Base:
     CREDS_VERSION = None
     FACADE_VERSIONS = {}
 
-    def __init__(self, url, password, user='user-admin'):
+    def __init__(self, url, password, user='user-admin',
+                 heartbeat_interval=None):
         """ init
 
         Params:
         url: URL in form of wss://{api-endpoint}/model/{uuid}/api
         password: Password for user
         user: juju user with access to endpoint
+        heartbeat_interval: seconds between pings, HEARTBEAT_INTERVAL by
+                            default
         """
         self.url = url
         self.password = password
+        if heartbeat_interval is None:
+            heartbeat_interval = HEARTBEAT_INTERVAL
+        self.heartbeat_interval = heartbeat_interval or None
         self.connlock = threading.RLock()
         with self.connlock:
-            self.conn = JujuWS(url, password)
+            self.conn = JujuWS(url, password,
+                               heartbeat_interval=self.heartbeat_interval)
 
         self.creds = {'Type': 'Admin',
                       'Version': self.CREDS_VERSION,
@@ -85,15 +272,22 @@ class Base:
                 constraints[k] = int(constraints[k])
         return constraints
 
+    def _prepare_timeout(self, timeout):
+        """ juju expects durations in nanoseconds, 0 meaning its default """
+        if not timeout:
+            return 0
+        return int(timeout * 1e9)
+
     def login(self):
         """Connect and log in to juju websocket endpoint.
 
         block other threads until done.
         """
         with self.connlock:
-            req_id = self.conn.do_connect(self.creds)
+            timeout = CONNECT_TIMEOUT or None
+            req_id = self.conn.do_connect(self.creds, timeout=timeout)
             try:
-                res = self.receive(req_id)
+                res = self.receive(req_id, timeout=timeout)
                 if 'Error' in res:
                     raise LoginError(res['ErrorCode'])
             except Exception as e:
@@ -101,19 +295,58 @@ class Base:
 
     def reconnect(self):
         with self.connlock:
-            self.close()
+            try:
+                if self.conn.is_dead():
+                    self.conn.abort()
+                else:
+                    self.close()
+            except Exception as e:
+                log.debug("Error closing the old connection: {}".format(e))
             start_id = self.conn.get_current_request_id() + 1
             self.conn = JujuWS(self.url,
                                self.password,
-                               start_reqid=start_id)
+                               start_reqid=start_id,
+                               heartbeat_interval=self.heartbeat_interval)
             self.login()
 
+    def _recover(self, conn):
+        """ Reconnects and logs in again after conn was lost, unless
+        another thread already did.
+        """
+        with self.connlock:
+            if self.conn is not conn:
+                return
+            log.warning("Lost connection to {}, reconnecting".format(
+                self.url))
+            self._notify_connection_observers(CONNECTION_LOST)
+            for attempt in range(RECONNECT_ATTEMPTS):
+                try:
+                    self.reconnect()
+                except Exception as e:
+                    log.warning("Reconnect attempt {} failed: {}".format(
+                        attempt + 1, e))
+                    time.sleep(RECONNECT_DELAY * (attempt + 1))
+                    continue
+                log.info("Reconnected to {}".format(self.url))
+                self._notify_connection_observers(CONNECTION_RESTORED)
+                return
+            self._notify_connection_observers(CONNECTION_FAILED)
+            raise ConnectionClosedError("Unable to reconnect to "
+                                        "{}".format(self.url))
+
+    def _notify_connection_observers(self, state):
+        for observer in connection_observers:
+            try:
+                observer(state, self.url)
+            except Exception:
+                log.exception("connection observer failed")
+
     def close(self):
         """ Closes connection to juju websocket """
         with self.connlock:
             self.conn.do_close()
 
-    def receive(self, request_id, timeout=None):
+    def receive(self, request_id, timeout=None, conn=None):
         """receives expected message.
 
         returns parsed response object.
@@ -121,13 +354,20 @@ class Base:
         if timeout is set, raises RequestTimeout after 'timeout' seconds
         with no received message.
 
+        raises ConnectionLostError once the connection the request was
+        sent on, by default the current one, stops answering heartbeats.
+
         """
+        if conn is None:
+            conn = self.conn
         res = None
         start_time = time.time()
         while res is None:
             with self.connlock:
-                res = self.conn.do_receive(request_id)
+                res = conn.do_receive(request_id)
             if res is None:
+                if conn.is_dead():
+                    raise ConnectionLostError(request_id)
                 time.sleep(0.1)
                 if timeout and (time.time() - start_time > timeout):
                     raise RequestTimeout(request_id)
@@ -151,7 +391,74 @@ class Base:
         else:
             raise MacumbaError(
                 'Unknown facade type: {}'.format(params['Type']))
+        return self._send_and_receive(params, timeout)
+
+    def _send_and_receive(self, params, timeout=None):
+        """ Sends params, reconnecting if the connection was lost, and
+        then sending them again if they are a replayable request
+        """
+        replayable = (params['Type'],
+                      params.get('Request')) in REPLAYABLE_REQUESTS
+        while True:
+            conn = self.conn
+            try:
+                return self._send_and_receive_once(params, timeout, conn)
+            except ConnectionClosedError:
+                self._recover(conn)
+                if not replayable:
+                    raise
+                log.debug("Replaying {}".format(params.get('Request')))
+
+    def _send_and_receive_once(self, params, timeout, conn):
+        start_time = time.time()
         with self.connlock:
-            req_id = self.conn.do_send(params)
+            try:
+                req_id = conn.do_send(params)
+            except ConnectionClosedError:
+                raise
+            except Exception as e:
+                # the socket went away under us
+                raise ConnectionClosedError(str(e))
+
+        error = None
+        reply = None
+        try:
+            result = self.receive(req_id, timeout, conn)
+            reply = {'RequestId': req_id, 'Response': result}
+            return result
+        except ServerError as e:
+            error = e
+            reply = e.args[1]
+            raise
+        except Exception as e:
+            error = e
+            reply = {'RequestId': req_id, 'Error': str(e),
+                     'ErrorCode': type(e).__name__}
+            raise
+        finally:
+            elapsed = time.time() - start_time
+            self._notify_call_observers(conn, params, req_id, elapsed,
+                                        error)
+            if message_observers:
+                self._notify_message_observers(params, reply, start_time,
+                                               elapsed)
 
-        return self.receive(req_id, timeout)
+    def _notify_call_observers(self, conn, params, req_id, elapsed,
+                               error):
+        sent, received = conn.pop_message_size(req_id)
+        if not call_observers:
+            return
+        for observer in call_observers:
+            try:
+                observer(params['Type'], params.get('Request'), elapsed,
+                         sent, received, error)
+            except Exception:
+                log.exception("call observer failed")
+
+    def _notify_message_observers(self, params, reply, start_time,
+                                  elapsed):
+        for observer in message_observers:
+            try:
+                observer(params, reply, start_time, elapsed)
+            except Exception:
+                log.exception("message observer failed")
@@ -32,6 +32,11 @@ class ConnectionClosedError(MacumbaError):
     "Attempted to receive messages from closed connection"
 
 
+class ConnectionLostError(ConnectionClosedError):
+
+    "The connection stopped answering heartbeats"
+
+
 class UnknownRequestError(MacumbaError):
 
     "Attempted to receive a message with an unknown ID"
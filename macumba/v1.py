@@ -61,11 +61,17 @@ class JujuClient(Base):
     CREDS_VERSION = 2
     FACADE_VERSIONS = _FACADE_VERSIONS
 
-    def status(self):
-        """ Returns status of juju environment """
-        return self.call(dict(Type="Client",
-                              Request="FullStatus"),
-                         timeout=60)
+    def status(self, patterns=None):
+        """ Returns status of juju environment
+
+        :param list patterns: only return the machines, services and
+                              units matching these, e.g. ['mysql', '3']
+        """
+        params = dict(Type="Client",
+                      Request="FullStatus")
+        if patterns:
+            params['Params'] = dict(Patterns=list(patterns))
+        return self.call(params, timeout=60)
 
     def get_watcher(self):
         """ Returns watcher """
@@ -94,18 +100,23 @@ class JujuClient(Base):
                     machine_spec="", parent_id="", container_type=""):
         """Allocate a new machine from the iaas provider.
         """
+        return self.add_machines([self.machine_params(
+            series, constraints, machine_spec, parent_id, container_type)])
+
+    def machine_params(self, series="", constraints={},
+                       machine_spec="", parent_id="", container_type=""):
+        """ Returns the add_machines() entry for one machine """
         if machine_spec:
             err_msg = "Cant specify machine spec with container_type/parent_id"
             assert not (parent_id or container_type), err_msg
             parent_id, container_type = machine_spec.split(":", 1)
 
-        params = dict(
+        return dict(
             Series=series,
             ContainerType=container_type,
             ParentId=parent_id,
             Constraints=self._prepare_constraints(constraints),
             Jobs=[Jobs.HostUnits])
-        return self.add_machines([params])
 
     def add_machines(self, machines):
         """ Add machines """
@@ -121,6 +132,39 @@ class JujuClient(Base):
                               Request="DestroyMachines",
                               Params=params))
 
+    def _run_call_timeout(self, timeout):
+        # leave juju time to report its own timeout before we give up
+        if not timeout:
+            return None
+        return timeout + 30
+
+    def run(self, commands, machines=[], services=[], units=[],
+            timeout=None):
+        """ Runs a shell script on the given machines, services and units
+
+        :param str commands: script to run
+        :param int timeout: seconds to wait for the commands to finish
+        :returns dict: per-target results
+        """
+        params = dict(Commands=commands,
+                      Timeout=self._prepare_timeout(timeout),
+                      Machines=machines,
+                      Services=services,
+                      Units=units)
+        return self.call(dict(Type="Client",
+                              Request="Run",
+                              Params=params),
+                         timeout=self._run_call_timeout(timeout))
+
+    def run_on_all_machines(self, commands, timeout=None):
+        """ Runs a shell script on all machines in the environment """
+        params = dict(Commands=commands,
+                      Timeout=self._prepare_timeout(timeout))
+        return self.call(dict(Type="Client",
+                              Request="RunOnAllMachines",
+                              Params=params),
+                         timeout=self._run_call_timeout(timeout))
+
     def resolved(self, unit_name, retry=0):
         """ Resolved """
         return self.call(dict(Type="Client",
@@ -184,22 +228,40 @@ class JujuClient(Base):
                               Params=dict(Endpoints=[endpoint_a,
                                                      endpoint_b])))
 
+    def _prepare_placement(self, machine_specs):
+        """ juju placement directives for machine specs such as '3' or
+        'lxc:3', skipping '' which lets juju pick the machine
+        """
+        placement = []
+        for spec in machine_specs:
+            if not spec:
+                continue
+            scope, _, directive = spec.rpartition(':')
+            placement.append(dict(Scope=scope or '#', Directive=directive))
+        return placement
+
     def deploy(self, charm, service_name, num_units=1, config_yaml="",
-               constraints=None, machine_spec=""):
+               constraints=None, machine_spec="", placement=None):
         """ Deploy a charm to an instance
 
-        :param str charm: Name of charm
+        :param str charm: Name of charm, or url of a local charm
         :param str service_name: name of service
         :param int num_units: number of units
         :param str config_yaml: charm configuration options
         :param dict constraints: deploy constraints
         :param str machine_spec: Type of machine to deploy to
+        :param list placement: machine specs of the units, in place of
+                               machine_spec
         :returns: Deployed charm status
         """
         params = {'ServiceName': service_name}
 
-        charm_info = query_cs(charm)
-        params['CharmUrl'] = charm_info['Id']
+        if charm.startswith('local:'):
+            # uploaded earlier, not in the charm store
+            params['CharmUrl'] = charm
+        else:
+            charm_info = query_cs(charm)
+            params['CharmUrl'] = charm_info['Id']
         params['NumUnits'] = num_units
         params['ConfigYAML'] = config_yaml
 
@@ -208,6 +270,8 @@ class JujuClient(Base):
                 constraints)
         if machine_spec:
             params['ToMachineSpec'] = machine_spec
+        if placement:
+            params['Placement'] = self._prepare_placement(placement)
         return self.call(dict(Type="Client",
                               Request="ServiceDeploy",
                               Params=dict(params)))
@@ -228,6 +292,27 @@ class JujuClient(Base):
                               Params=dict(Tag="%s-%s" % (entity_type,
                                                          entity))))
 
+    def get_entities_annotations(self, tags):
+        """ Gets the annotations of many entities in one call
+
+        :param list tags: entity tags, eg. machine-1
+        """
+        return self.call(dict(Type="Annotations",
+                              Request="Get",
+                              Params=dict(Entities=[dict(Tag=tag)
+                                                    for tag in tags])))
+
+    def set_entities_annotations(self, annotations):
+        """ Sets the annotations of many entities in one call
+
+        :param dict annotations: entity tag -> dict with string pairs
+        """
+        return self.call(dict(Type="Annotations",
+                              Request="Set",
+                              Params=dict(Annotations=[
+                                  dict(EntityTag=tag, Annotations=pairs)
+                                  for tag, pairs in annotations.items()])))
+
     def set_config(self, service_name, config_keys):
         """ Sets machine config """
         return self.call(dict(Type="Client",
@@ -308,12 +393,15 @@ class JujuClient(Base):
                               Request="ServiceCharmRelations",
                               Params=dict(ServiceName=service_name)))
 
-    def add_unit(self, service_name, num_units=1, machine_spec=""):
+    def add_unit(self, service_name, num_units=1, machine_spec="",
+                 placement=None):
         """ Add unit
 
         :param str service_name: Name of charm
         :param int num_units: Number of units
         :param str machine_spec: Type of machine to deploy to
+        :param list placement: machine specs of the units, in place of
+                               machine_spec
         :returns dict: Units added
         """
         params = {}
@@ -321,6 +409,8 @@ class JujuClient(Base):
         params['NumUnits'] = num_units
         if machine_spec:
             params['ToMachineSpec'] = machine_spec
+        if placement:
+            params['Placement'] = self._prepare_placement(placement)
 
         return self.call(dict(Type="Client",
                               Request="AddServiceUnits",
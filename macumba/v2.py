@@ -124,7 +124,4 @@ class JujuClient(Base):
         Params:
         params: Additional params to be passed into request
         """
-        with self.connlock:
-            req_id = self.conn.do_send(params)
-
-        return self.receive(req_id, timeout)
+        return self._send_and_receive(params, timeout)
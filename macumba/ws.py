@@ -1,49 +1,125 @@
 from ws4py.client.threadedclient import WebSocketClient
 import json
+import socket
 import threading
+import time
 import logging
 from .errors import ConnectionClosedError, UnknownRequestError
 
 log = logging.getLogger('macumba')
 
+# The link is taken as dead once this many heartbeats went unanswered
+HEARTBEAT_MISSES = 3
+
 
 class JujuWS(WebSocketClient):
 
     def __init__(self, url, password, protocols=['https-only'],
                  extensions=None, ssl_options=None, headers=None,
-                 start_reqid=1):
+                 start_reqid=1, heartbeat_interval=None):
+        """ heartbeat_interval: seconds between pings, None for none """
         WebSocketClient.__init__(self, url, protocols, extensions,
                                  ssl_options=ssl_options, headers=headers)
+        self.heartbeat_interval = heartbeat_interval
+        # time anything, message or pong, was last received
+        self.last_heard = None
+        self.heartbeat_stop = threading.Event()
+        # requests and heartbeats are sent from different threads
+        self.sendlock = threading.Lock()
         self.open_done = threading.Event()
         self.rid_lock = threading.RLock()
         self.msglock = threading.RLock()
         self.messages = {}
+        # request_id -> [bytes sent, bytes received]
+        self.message_sizes = {}
         self._cur_request_id = start_reqid
 
     # WebSocketClient subclass overrides, run in private thread:
     def opened(self):
+        self.last_heard = time.time()
+        if self.heartbeat_interval:
+            threading.Thread(target=self._send_heartbeats,
+                             name='macumba-heartbeat', daemon=True).start()
         self.open_done.set()
 
+    def ponged(self, pong):
+        self.last_heard = time.time()
+
+    def process(self, data):
+        # bytes of a frame still being read count as heard, a large
+        # reply takes longer than the heartbeats to arrive
+        self.last_heard = time.time()
+        return WebSocketClient.process(self, data)
+
     def received_message(self, m):
+        self.last_heard = time.time()
         msg = json.loads(m.data.decode('utf-8'))
         msg_req_id = msg['RequestId']
         with self.msglock:
             self.messages[msg_req_id] = msg
+            if msg_req_id in self.message_sizes:
+                self.message_sizes[msg_req_id][1] = len(m.data)
 
     def closed(self, code, reason=None):
+        self.heartbeat_stop.set()
         log.debug("socket closed: code:{} reason:{}".format(code, reason))
 
+    def _send_heartbeats(self):
+        while not self.heartbeat_stop.wait(self.heartbeat_interval):
+            if self.terminated:
+                return
+            try:
+                with self.sendlock:
+                    self.ping('macumba')
+            except Exception as e:
+                log.debug("heartbeat failed: {}".format(e))
+                return
+
+    def is_dead(self):
+        """ True once the connection is closed, or the peer didn't answer
+        the last HEARTBEAT_MISSES heartbeats
+        """
+        if self.terminated:
+            return True
+        if not self.heartbeat_interval or self.last_heard is None:
+            return False
+        silence = time.time() - self.last_heard
+        return silence > self.heartbeat_interval * HEARTBEAT_MISSES
+
     # actions for users of the class:
     def get_current_request_id(self):
         "only intended to pass to constructor of a replacing client"
         return self._cur_request_id
 
     def do_close(self):
+        self.heartbeat_stop.set()
         self.close()
 
-    def do_connect(self, creds):
-        self.connect()
-        self.open_done.wait()
+    def abort(self):
+        """ Drops the connection without the closing handshake, which
+        a dead link would block sending
+        """
+        self.heartbeat_stop.set()
+        self.client_terminated = self.server_terminated = True
+        self.close_connection()
+
+    def do_connect(self, creds, timeout=None):
+        """ timeout: seconds the connection and handshake may take, None
+        to wait forever
+        """
+        # only covers the handshake, the reader thread makes the socket
+        # blocking again
+        self.sock.settimeout(timeout)
+        try:
+            self.connect()
+        except socket.timeout:
+            self.abort()
+            raise ConnectionClosedError("Timed out connecting to "
+                                        "{}".format(self.url))
+        if not self.open_done.wait(timeout):
+            self.abort()
+            raise ConnectionClosedError("Timed out opening "
+                                        "{}".format(self.url))
         self.open_done.clear()
         rv = self.do_send(creds)
         return rv
@@ -55,10 +131,14 @@ class JujuWS(WebSocketClient):
 
         json_message['RequestId'] = request_id
 
-        self.send(json.dumps(json_message))
+        data = json.dumps(json_message)
 
         with self.msglock:
             self.messages[request_id] = None
+            self.message_sizes[request_id] = [len(data), 0]
+
+        with self.sendlock:
+            self.send(data)
 
         return request_id
 
@@ -86,3 +166,10 @@ class JujuWS(WebSocketClient):
                 del self.messages[request_id]
 
         return message
+
+    def pop_message_size(self, request_id):
+        """returns (bytes sent, bytes received) for request_id and forgets
+        about it.
+        """
+        with self.msglock:
+            return tuple(self.message_sizes.pop(request_id, (0, 0)))
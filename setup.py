@@ -69,6 +69,7 @@ setup(name='openstack',
                'bin/openstack-juju',
                'bin/openstack-config'],
       packages=find_packages(exclude=["test"]),
+      package_data={'cloudinstall.charms': ['manifest.json']},
       data_files=[
           ('share/man/man1', ['man/en/openstack-status.1',
                               'man/en/openstack-install.1',
@@ -0,0 +1,214 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Synthetic MAAS node lists and juju FullStatus payloads
+
+Both are deterministic for a given count and seed. Nodes come from the
+simulator (see cloudinstall.simulator.maas.maas_nodes), status payloads
+like the result of the juju API's Client.FullStatus call for a cloud
+laid out the way gen_defaults() places it: compute, storage and
+network nodes on bare metal, controller services in LXC containers on
+the first machines, subordinates on every compute unit.
+"""
+
+import random
+from collections import Counter
+
+from cloudinstall.maas import MaasMachineStatus
+from cloudinstall.simulator.maas import maas_nodes
+
+# service -> number of units per 100 machines, minimum 1
+CONTROLLER_SERVICES = {
+    'mysql': 1,
+    'rabbitmq-server': 1,
+    'keystone': 1,
+    'glance': 1,
+    'nova-cloud-controller': 2,
+    'openstack-dashboard': 1,
+    'neutron-api': 1,
+    'cinder': 1,
+    'swift-proxy': 1,
+    'ceilometer': 1,
+    'heat': 1,
+    'juju-gui': 0,
+}
+
+# service -> share of the bare metal machines
+ISOLATED_SERVICES = [
+    ('nova-compute', 0.7),
+    ('ceph-osd', 0.15),
+    ('swift-storage', 0.1),
+    ('neutron-gateway', 0.05),
+]
+
+SUBORDINATES = {
+    'nova-compute': ['ntp', 'neutron-openvswitch', 'ceilometer-agent'],
+    'neutron-gateway': ['ntp'],
+}
+
+RELATIONS = {
+    'keystone': ['mysql', 'nova-cloud-controller', 'glance', 'cinder',
+                 'openstack-dashboard', 'neutron-api', 'swift-proxy'],
+    'nova-compute': ['nova-cloud-controller', 'rabbitmq-server', 'glance',
+                     'ntp', 'neutron-openvswitch', 'ceilometer-agent'],
+    'nova-cloud-controller': ['mysql', 'rabbitmq-server', 'keystone',
+                              'glance', 'neutron-api', 'nova-compute'],
+    'ceph-osd': ['ntp'],
+}
+
+
+def _agent(status='started', info=''):
+    return {'Status': status, 'Info': info, 'Data': {},
+            'Since': '2015-10-01T12:00:00Z', 'Version': '1.25.0',
+            'Life': '', 'Err': None}
+
+
+def _machine(machine_id, instance_id, node=None, address=None):
+    if node is not None:
+        hardware = "arch=amd64 cpu-cores={} mem={}M root-disk={}M".format(
+            node['cpu_count'], node['memory'], node['storage'])
+    else:
+        hardware = ''
+    return {
+        'Id': machine_id,
+        'InstanceId': instance_id,
+        'AgentState': 'started',
+        'AgentStateInfo': '',
+        'AgentVersion': '1.25.0',
+        'Agent': _agent(),
+        'DNSName': address or '',
+        'Series': 'trusty',
+        'Hardware': hardware,
+        'Jobs': ['JobHostUnits'],
+        'Life': '',
+        'HasVote': False,
+        'WantsVote': False,
+        'Err': None,
+        'Containers': {},
+    }
+
+
+def _unit(machine_id, address, state, charm):
+    return {
+        'AgentState': state,
+        'AgentStateInfo': '',
+        'AgentVersion': '1.25.0',
+        'Life': '',
+        'Err': None,
+        'Machine': machine_id,
+        'PublicAddress': address,
+        'OpenedPorts': [],
+        'Charm': charm,
+        'Subordinates': {},
+        'Workload': {'Status': 'active' if state == 'started'
+                     else 'maintenance',
+                     'Info': 'Unit is ready' if state == 'started'
+                     else 'installing charm software'},
+        'UnitAgent': {'Status': 'idle' if state == 'started'
+                      else 'executing'},
+    }
+
+
+def _service(name):
+    return {
+        'Charm': "cs:trusty/{}-{}".format(name, 30),
+        'Exposed': False,
+        'Life': '',
+        'Err': None,
+        'CanUpgradeTo': '',
+        'SubordinateTo': [s for s, subs in SUBORDINATES.items()
+                          if name in subs],
+        'Networks': {'Enabled': None, 'Disabled': None},
+        'Relations': {},
+        'Units': {},
+    }
+
+
+def full_status(count, seed=0, nodes=None, pending=0.1):
+    """ returns a FullStatus result for a cloud of 'count' machines
+    plus the bootstrap node.
+
+    If nodes (from maas_nodes()) is given, juju machines use their
+    instance ids and hardware. 'pending' is the share of units that
+    are not started yet.
+    """
+    rand = random.Random(seed)
+    if nodes is None:
+        nodes = maas_nodes(count, seed, MaasMachineStatus.DEPLOYED)
+
+    machines = {'0': _machine('0', '/MAAS/api/1.0/nodes/juju-bootstrap/',
+                              address='juju-bootstrap.maas')}
+    services = {}
+    sub_counts = Counter()
+
+    def add_unit(service, machine_id, address):
+        svc = services.setdefault(service, _service(service))
+        n = len(svc['Units'])
+        name = "{}/{}".format(service, n)
+        state = 'pending' if rand.random() < pending else 'started'
+        unit = _unit(machine_id, address, state, svc['Charm'])
+        svc['Units'][name] = unit
+        return unit
+
+    def add_subordinate(unit, service, address):
+        svc = services.setdefault(service, _service(service))
+        name = "{}/{}".format(service, sub_counts[service])
+        sub_counts[service] += 1
+        unit['Subordinates'][name] = _unit('', address, 'started',
+                                           svc['Charm'])
+
+    for i in range(1, count + 1):
+        node = nodes[(i - 1) % len(nodes)]
+        address = node['hostname']
+        mid = str(i)
+        machines[mid] = _machine(mid, node['resource_uri'], node, address)
+
+    # bare metal services
+    ids = [str(i) for i in range(1, count + 1)]
+    start = 0
+    for service, share in ISOLATED_SERVICES:
+        n = max(1, int(round(count * share)))
+        for mid in ids[start:start + n]:
+            unit = add_unit(service, mid, machines[mid]['DNSName'])
+            for sub in SUBORDINATES.get(service, []):
+                add_subordinate(unit, sub, machines[mid]['DNSName'])
+        start = (start + n) % count
+
+    # controller services in containers spread over the first machines
+    hosts = ids[:max(1, min(count, 3 + count // 100))]
+    host = 0
+    for service, per_100 in sorted(CONTROLLER_SERVICES.items()):
+        for _ in range(max(1, per_100 * count // 100)):
+            mid = hosts[host % len(hosts)]
+            host += 1
+            containers = machines[mid]['Containers']
+            cid = "{}/lxc/{}".format(mid, len(containers))
+            address = "10.0.{}.{}".format(int(mid) % 256, len(containers) + 2)
+            containers[cid] = _machine(
+                cid, "juju-machine-{}-lxc-{}".format(mid, len(containers)),
+                address=address)
+            add_unit(service, cid, address)
+
+    for name, svc in services.items():
+        svc['Relations'] = {
+            'shared-db' if other == 'mysql' else other: [other]
+            for other in RELATIONS.get(name, []) if other in services}
+
+    return {'Machines': machines,
+            'Services': services,
+            'Networks': {},
+            'EnvironmentName': 'benchmark',
+            'AvailableVersion': '',
+            'Relations': []}
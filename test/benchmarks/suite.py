@@ -0,0 +1,386 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Synthetic-scale benchmarks
+
+Times the status, placement and UI refresh paths against generated
+clouds of 10 to 5000 machines, appends the results to a history file
+and compares them with the previous run:
+
+    make benchmark BENCH_ARGS="--sizes 10,100 --filter placement"
+
+Each benchmark is a setup function registered with @benchmark, taking
+the machine count and returning the callable to time.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+from types import SimpleNamespace
+
+from cloudinstall.charms.compute import CharmNovaCompute
+from cloudinstall.config import Config
+from cloudinstall.juju import JujuState
+from cloudinstall.maas import MaasMachineStatus, MaasState, satisfies
+from cloudinstall.placement.controller import (AssignmentType,
+                                               PlacementController)
+from cloudinstall.placement.ui.machines_list import MachinesList
+from cloudinstall.ui.views.services import ServicesView
+
+from benchmarks import generators
+
+log = logging.getLogger('cloudinstall.benchmarks')
+
+SIZES = [10, 100, 1000, 5000]
+HISTORY = os.path.expanduser('~/.cloud-install/benchmark-history.json')
+
+# name -> setup(size)
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+class FakeJuju:
+    """ Stands in for the juju API client, returning a canned status """
+
+    def __init__(self, status):
+        self._status = status
+
+    def status(self, patterns=None):
+        return self._status
+
+
+_tmpdir = tempfile.TemporaryDirectory(prefix='cloudinstall-bench-')
+
+
+def make_config():
+    cfg_file = tempfile.NamedTemporaryFile(suffix='.yaml', dir=_tmpdir.name,
+                                           delete=False)
+    cfg_file.close()
+    return Config({}, cfg_file.name, save_backups=False)
+
+
+def make_juju_state(size):
+    nodes = generators.maas_nodes(size, status=MaasMachineStatus.DEPLOYED)
+    state = JujuState(FakeJuju(generators.full_status(size, nodes=nodes)))
+    return state, MaasState(SimpleNamespace(nodes=nodes))
+
+
+def make_placement(size, assign=True):
+    """ returns a controller for 'size' ready machines, with the default
+    placement plus nova-compute on every other free machine.
+    """
+    nodes = generators.maas_nodes(size)
+    pc = PlacementController(MaasState(SimpleNamespace(nodes=nodes)),
+                             make_config())
+    if assign:
+        pc.set_all_assignments(pc.gen_defaults())
+        for m in pc.machines(include_placeholders=False):
+            if not pc.assignments_for_machine(m):
+                pc.assign(m, CharmNovaCompute, AssignmentType.BareMetal)
+    return pc
+
+
+@benchmark('juju.machines')
+def bench_juju_machines(size):
+    state, _ = make_juju_state(size)
+    return state.machines
+
+
+@benchmark('juju.machine')
+def bench_juju_machine(size):
+    state, _ = make_juju_state(size)
+    return lambda: state.machine(str(size))
+
+
+@benchmark('juju.machine_or_container')
+def bench_juju_machine_or_container(size):
+    state, _ = make_juju_state(size)
+    return lambda: state.machine_or_container('1/lxc/0')
+
+
+@benchmark('juju.service')
+def bench_juju_service(size):
+    state, _ = make_juju_state(size)
+    return lambda: state.service('nova-compute')
+
+
+@benchmark('juju.all_agents_started')
+def bench_juju_all_agents_started(size):
+    state, _ = make_juju_state(size)
+    return state.all_agents_started
+
+
+@benchmark('maas.satisfies')
+def bench_satisfies(size):
+    pc = make_placement(size, assign=False)
+    machines = pc.machines(include_placeholders=False)
+    constraints = CharmNovaCompute.constraints
+    return lambda: [satisfies(m, constraints) for m in machines]
+
+
+@benchmark('placement.gen_defaults')
+def bench_gen_defaults(size):
+    pc = make_placement(size, assign=False)
+    machines = pc.machines(include_placeholders=False)
+    return lambda: pc.gen_defaults(maas_machines=list(machines))
+
+
+@benchmark('placement.get_charm_state')
+def bench_get_charm_state(size):
+    pc = make_placement(size)
+    charm_classes = pc.charm_classes()
+    return lambda: [pc.get_charm_state(cc) for cc in charm_classes]
+
+
+@benchmark('placement.can_deploy')
+def bench_can_deploy(size):
+    pc = make_placement(size)
+    return pc.can_deploy
+
+
+@benchmark('placement.save')
+def bench_placement_save(size):
+    pc = make_placement(size)
+    return lambda: pc.save(io.StringIO())
+
+
+@benchmark('placement.load')
+def bench_placement_load(size):
+    pc = make_placement(size)
+    f = io.StringIO()
+    pc.save(f)
+    saved = f.getvalue()
+    return lambda: pc.load(io.StringIO(saved))
+
+
+@benchmark('ui.machines_list.update')
+def bench_machines_list_update(size):
+    ml = MachinesList(make_placement(size), [], show_hardware=True)
+    return ml.update
+
+
+def _service_nodes(juju_state):
+    charm_classes = {cc.charm_name: cc for cc in
+                     make_placement(0, assign=False).charm_classes()}
+    return [(charm_classes.get(s.service_name, CharmNovaCompute), s)
+            for s in juju_state.services]
+
+
+@benchmark('ui.services.refresh_nodes')
+def bench_refresh_nodes(size):
+    juju_state, maas_state = make_juju_state(size)
+    config = make_config()
+    nodes = _service_nodes(juju_state)
+    view = ServicesView(None, juju_state, maas_state, config)
+    view.refresh_nodes(nodes)
+    return lambda: view.refresh_nodes(nodes)
+
+
+@benchmark('ui.services.refresh_nodes.cold')
+def bench_refresh_nodes_cold(size):
+    juju_state, maas_state = make_juju_state(size)
+    config = make_config()
+    nodes = _service_nodes(juju_state)
+    return lambda: ServicesView(None, juju_state, maas_state,
+                                config).refresh_nodes(nodes)
+
+
+def measure(func, repeat=5, min_time=0.05):
+    """ returns per-call times of 'repeat' runs, each looping func
+    enough times to last at least min_time seconds.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 10 ** 6:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+    times = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        times.append((time.perf_counter() - start) / loops)
+    return times, loops
+
+
+def run(names, sizes, repeat=5, max_time=10.0, out=sys.stdout):
+    """ runs the named benchmarks at each size, returns
+    {"name@size": dict(min, median, loops)}.
+
+    Larger sizes of a benchmark are skipped once a call would take more
+    than max_time seconds, assuming the time grows quadratically.
+    """
+    results = {}
+    for name in names:
+        previous = None
+        for size in sorted(sizes):
+            if previous is not None and \
+               previous[1] * (size / previous[0]) ** 2 > max_time:
+                out.write("{:<40} skipped, estimated over {}s\n".format(
+                    "{}@{}".format(name, size), max_time))
+                break
+            func = BENCHMARKS[name](size)
+            times, loops = measure(func, repeat)
+            key = "{}@{}".format(name, size)
+            results[key] = dict(min=min(times), median=median(times),
+                                loops=loops)
+            out.write("{:<40} {:>12.6f}s min {:>12.6f}s median "
+                      "({} loops)\n".format(key, min(times), median(times),
+                                            loops))
+            out.flush()
+            previous = (size, min(times))
+    return results
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def load_history(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def save_history(path, history):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=2, sort_keys=True)
+
+
+def compare(previous, results, threshold=0.2):
+    """ compares min times with a previous run's, returns lists of
+    (key, old, new) for regressions and improvements larger than
+    'threshold' (a fraction).
+    """
+    regressions, improvements = [], []
+    for key, r in sorted(results.items()):
+        if key not in previous:
+            continue
+        old, new = previous[key]['min'], r['min']
+        if old <= 0:
+            continue
+        if new > old * (1 + threshold):
+            regressions.append((key, old, new))
+        elif new < old * (1 - threshold):
+            improvements.append((key, old, new))
+    return regressions, improvements
+
+
+def parse_options(*args, **kwds):
+    parser = argparse.ArgumentParser(description='Synthetic-scale '
+                                     'benchmarks of status, placement and '
+                                     'UI refresh paths')
+    parser.add_argument('--sizes', default=",".join(map(str, SIZES)),
+                        help='comma separated machine counts, '
+                        'default: %(default)s')
+    parser.add_argument('--filter', default='',
+                        help='only run benchmarks matching this regex')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed runs per benchmark and size')
+    parser.add_argument('--max-time', type=float, default=10.0,
+                        help='skip sizes where a call is estimated to take '
+                        'longer than this many seconds, default: '
+                        '%(default)s')
+    parser.add_argument('--history', default=HISTORY,
+                        help='JSON file results are appended to, '
+                        'default: %(default)s')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown (fraction) reported as a '
+                        'regression, default: %(default)s')
+    parser.add_argument('--no-save', action='store_true',
+                        help='do not append this run to the history')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='exit with status 1 on any regression')
+    parser.add_argument('--list', action='store_true',
+                        help='list benchmarks and exit')
+    return parser.parse_args(*args, **kwds)
+
+
+def main(argv=None, out=sys.stdout):
+    opts = parse_options(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    names = [n for n in sorted(BENCHMARKS) if re.search(opts.filter, n)]
+    if opts.list:
+        out.write("\n".join(names) + "\n")
+        return 0
+    sizes = [int(s) for s in opts.sizes.split(',')]
+
+    results = run(names, sizes, opts.repeat, opts.max_time, out)
+
+    history = load_history(opts.history)
+    regressions = []
+    if history:
+        previous = history[-1]
+        regressions, improvements = compare(previous['results'], results,
+                                            opts.threshold)
+        out.write("\nCompared with {} ({}):\n".format(previous['git_rev'],
+                                                      previous['date']))
+        for label, changes in [('REGRESSION', regressions),
+                               ('improved', improvements)]:
+            for key, old, new in changes:
+                out.write("  {:<10} {:<40} {:.6f}s -> {:.6f}s "
+                          "({:+.0%})\n".format(label, key, old, new,
+                                               new / old - 1))
+        if not regressions and not improvements:
+            out.write("  no changes over {:.0%}\n".format(opts.threshold))
+
+    if not opts.no_save:
+        # keep earlier results of benchmarks not run this time, so
+        # filtered runs still compare against the last full run
+        merged = dict(history[-1]['results']) if history else {}
+        merged.update(results)
+        history.append(dict(date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                            git_rev=git_rev(),
+                            python=platform.python_version(),
+                            host=platform.node(),
+                            results=merged))
+        save_history(opts.history, history)
+
+    if regressions and opts.fail_on_regression:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cloudinstall import async
+
+log = logging.getLogger('cloudinstall.test_async')
+
+
+class WaitUntilTestCase(unittest.TestCase):
+
+    def test_returns_predicate_value(self):
+        p = MagicMock(side_effect=[False, None, 'done'])
+        with patch('cloudinstall.async.sleep_until') as mock_sleep:
+            self.assertEqual(async.wait_until(p, name='t'), 'done')
+        self.assertEqual(len(mock_sleep.mock_calls), 2)
+
+    def test_backoff_is_capped(self):
+        p = MagicMock(side_effect=[False] * 5 + [True])
+        with patch('cloudinstall.async.sleep_until') as mock_sleep:
+            async.wait_until(p, name='t', interval=1, backoff=2,
+                             max_interval=4, jitter=0)
+        delays = [c[1][0] for c in mock_sleep.mock_calls]
+        self.assertEqual(delays, [1, 2, 4, 4, 4])
+
+    def test_timeout_returns_false(self):
+        self.assertFalse(async.wait_until(lambda: False, name='timeout',
+                                          interval=0.01, timeout=0.05))
+        self.assertEqual(async.wait_stats()['timeout']['timeouts'], 1)
+
+    def test_records_stats(self):
+        with patch('cloudinstall.async.sleep_until'):
+            async.wait_until(MagicMock(side_effect=[False, True]),
+                             name='stats')
+        stats = async.wait_stats()['stats']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['polls'], 2)
+
+    def test_notify_wakes_wakeable_sleep(self):
+        t = threading.Timer(0.1, async.notify_waiters)
+        t.start()
+        start = time.time()
+        async.sleep_until(5, wakeable=True)
+        self.assertLess(time.time() - start, 2)
+        t.join()
+
+
+class LaneTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.lane = async.Lane('test', workers=1)
+
+    def tearDown(self):
+        self.lane.shutdown()
+
+    def test_priority_order(self):
+        gate = threading.Event()
+        ran = []
+        self.lane.submit(gate.wait)
+        self.lane.submit(lambda: ran.append('low'), async.PRIORITY_LOW)
+        self.lane.submit(lambda: ran.append('normal'))
+        f = self.lane.submit(lambda: ran.append('high'), async.PRIORITY_HIGH)
+        gate.set()
+        f.result(timeout=5)
+        while len(ran) < 3:
+            time.sleep(0.01)
+        self.assertEqual(ran, ['high', 'normal', 'low'])
+
+    def test_stats_and_exceptions(self):
+        def boom():
+            raise Exception("boom")
+        self.assertEqual(self.lane.submit(lambda: 42).result(timeout=5), 42)
+        f = self.lane.submit(boom)
+        self.assertRaises(Exception, f.result, timeout=5)
+        self.assertEqual(self.lane.stats['submitted'], 2)
+        self.assertEqual(self.lane.stats['completed'], 1)
+        self.assertEqual(self.lane.stats['failed'], 1)
+
+    def test_shutdown_cancels_queued(self):
+        gate = threading.Event()
+        self.lane.submit(gate.wait)
+        queued = self.lane.submit(lambda: None)
+        self.lane.shutdown()
+        gate.set()
+        self.assertTrue(queued.cancelled())
+        self.assertTrue(self.lane.submit(lambda: None).cancelled())
+
+    def test_lanes_run_concurrently(self):
+        gate = threading.Event()
+        other = async.Lane('other', workers=1)
+        try:
+            self.lane.submit(gate.wait)
+            f = other.submit(lambda: 'ran')
+            self.assertEqual(f.result(timeout=5), 'ran')
+        finally:
+            gate.set()
+            other.shutdown()
+
+    def test_submit_calls_exc_callback(self):
+        called = threading.Event()
+        cb = MagicMock(side_effect=lambda exc: called.set())
+        e = Exception("failed")
+
+        def fail():
+            raise e
+        async.submit(fail, cb, lane='io')
+        self.assertTrue(called.wait(timeout=5))
+        cb.assert_called_once_with(e)
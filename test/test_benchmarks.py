@@ -0,0 +1,78 @@
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import json
+import logging
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from cloudinstall.juju import JujuState
+from cloudinstall.maas import MaasMachineStatus, MaasState
+
+from benchmarks import generators, suite
+
+log = logging.getLogger('cloudinstall.test_benchmarks')
+
+
+class GeneratorsTestCase(unittest.TestCase):
+
+    def test_maas_nodes(self):
+        nodes = generators.maas_nodes(20)
+        self.assertEqual(20, len(nodes))
+        self.assertEqual(nodes, generators.maas_nodes(20))
+        self.assertEqual(20, len(set(n['resource_uri'] for n in nodes)))
+        state = MaasState(suite.SimpleNamespace(nodes=nodes))
+        self.assertEqual(20, len(state.machines(MaasMachineStatus.READY)))
+
+    def test_full_status(self):
+        nodes = generators.maas_nodes(20, status=MaasMachineStatus.DEPLOYED)
+        state = JujuState(suite.FakeJuju(
+            generators.full_status(20, nodes=nodes)))
+        self.assertEqual(20, len(state.machines()))
+        self.assertEqual(nodes[0]['resource_uri'],
+                         state.machine('1').instance_id)
+        self.assertEqual(14, len(state.service('nova-compute').units))
+        for svc in state.services:
+            for unit in svc.units:
+                m = state.machine_or_container(unit.machine_id)
+                self.assertIsNotNone(m, unit.unit_name)
+
+
+class SuiteTestCase(unittest.TestCase):
+
+    def test_compare(self):
+        previous = {'a@10': dict(min=1.0), 'b@10': dict(min=1.0),
+                    'c@10': dict(min=1.0)}
+        results = {'a@10': dict(min=1.5), 'b@10': dict(min=0.5),
+                   'c@10': dict(min=1.1), 'd@10': dict(min=9.0)}
+        regressions, improvements = suite.compare(previous, results, 0.2)
+        self.assertEqual([('a@10', 1.0, 1.5)], regressions)
+        self.assertEqual([('b@10', 1.0, 0.5)], improvements)
+
+    def test_main_appends_history(self):
+        with TemporaryDirectory() as tmpdir:
+            history = os.path.join(tmpdir, 'history.json')
+            args = ['--sizes', '10', '--repeat', '1',
+                    '--filter', r'^juju\.service$', '--history', history]
+            self.assertEqual(0, suite.main(args, out=io.StringIO()))
+            out = io.StringIO()
+            self.assertEqual(0, suite.main(args, out=out))
+            with open(history) as f:
+                runs = json.load(f)
+        self.assertEqual(2, len(runs))
+        self.assertIn('juju.service@10', runs[-1]['results'])
+        self.assertIn("Compared with", out.getvalue())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# tests changes.py
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cloudinstall import changes
+from cloudinstall.changes import ADDRESS, MACHINE, RELATION, UNIT, Change
+from cloudinstall.juju import JujuState
+
+log = logging.getLogger('cloudinstall.test_changes')
+
+
+def status(machine_state='pending', unit_state=None, workload='unknown',
+           address='', related=False):
+    s = {'Machines': {'1': {'AgentState': machine_state,
+                            'DNSName': address,
+                            'Containers': {'1/lxc/0': {
+                                'AgentState': machine_state}}}},
+         'Services': {}}
+    if unit_state:
+        s['Services']['mysql'] = {
+            'Relations': {'shared-db': ['keystone']} if related else {},
+            'Units': {'mysql/0': {
+                'AgentState': unit_state, 'PublicAddress': address,
+                'Machine': '1/lxc/0', 'Workload': {'Status': workload},
+                'Subordinates': {'ntp/0': {'AgentState': unit_state}}}}}
+    return s
+
+
+class DiffTestCase(unittest.TestCase):
+
+    def test_new_machines(self):
+        self.assertEqual(
+            [Change(MACHINE, '1', 'agent_state', None, 'pending'),
+             Change(MACHINE, '1/lxc/0', 'agent_state', None, 'pending')],
+            changes.diff(None, status()))
+
+    def test_unit_lifecycle(self):
+        self.assertEqual(
+            [Change(MACHINE, '1', 'agent_state', 'pending', 'started'),
+             Change(ADDRESS, '1', 'public_address', None, '10.0.0.1'),
+             Change(MACHINE, '1/lxc/0', 'agent_state', 'pending', 'started'),
+             Change(UNIT, 'mysql/0', 'agent_state', None, 'pending'),
+             Change(UNIT, 'mysql/0', 'workload', None, 'unknown'),
+             Change(ADDRESS, 'mysql/0', 'public_address', None, '10.0.0.1'),
+             Change(UNIT, 'ntp/0', 'agent_state', None, 'pending')],
+            changes.diff(status(), status('started', 'pending',
+                                          address='10.0.0.1')))
+        self.assertEqual(
+            [Change(UNIT, 'mysql/0', 'agent_state', 'pending', 'started'),
+             Change(UNIT, 'mysql/0', 'workload', 'unknown', 'active'),
+             Change(UNIT, 'ntp/0', 'agent_state', 'pending', 'started'),
+             Change(RELATION, 'mysql:shared-db', 'related', None,
+                    'keystone')],
+            changes.diff(status('started', 'pending'),
+                         status('started', 'started', 'active',
+                                related=True)))
+        self.assertEqual([], changes.diff(status('started', 'started'),
+                                          status('started', 'started')))
+
+
+class ChangeBusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = changes.ChangeBus()
+        self.started = Change(UNIT, 'mysql/0', 'agent_state', 'pending',
+                              'started')
+        self.active = Change(UNIT, 'mysql/0', 'workload', 'unknown',
+                             'active')
+
+    def test_filters(self):
+        seen, units, workloads = [], [], []
+        self.bus.subscribe(seen.append)
+        self.bus.subscribe(units.append, kind=UNIT,
+                           entity=lambda e: e.startswith('mysql/'))
+        subscription = self.bus.subscribe(workloads.append,
+                                          field='workload', new='active')
+        machine = Change(MACHINE, '1', 'agent_state', None, 'pending')
+        self.bus.publish([machine, self.started, self.active])
+        self.assertEqual([machine, self.started, self.active], seen)
+        self.assertEqual([self.started, self.active], units)
+        self.assertEqual([self.active], workloads)
+
+        self.bus.unsubscribe(subscription)
+        self.bus.publish([self.active])
+        self.assertEqual([self.active], workloads)
+
+    def test_callback_errors_are_contained(self):
+        seen = []
+        self.bus.subscribe(MagicMock(side_effect=Exception("boom")))
+        self.bus.subscribe(seen.append)
+        self.bus.publish([self.started])
+        self.assertEqual([self.started], seen)
+
+    @patch('cloudinstall.changes.async.wait_until')
+    def test_wait_for(self, mock_wait):
+        def wait_until(predicate, **kwargs):
+            self.assertFalse(predicate())
+            self.bus.publish([self.started, self.active])
+            self.assertTrue(predicate())
+            return True
+        mock_wait.side_effect = wait_until
+        self.assertEqual(self.active, self.bus.wait_for(
+            UNIT, 'mysql/0', 'workload', 'active'))
+        self.assertEqual([], self.bus._subscriptions)
+
+    def test_juju_state_publishes_changes(self):
+        juju = MagicMock(name='juju')
+        juju.status.return_value = status()
+        juju_state = JujuState(juju)
+        seen = []
+        juju_state.changes.subscribe(seen.append, kind=UNIT)
+        juju_state.status()
+        juju_state.invalidate_status_cache()
+        juju_state.status()
+        self.assertEqual([], seen)
+
+        juju.status.return_value = status('started', 'pending')
+        juju_state.invalidate_status_cache()
+        juju_state.status()
+        self.assertEqual(['mysql/0', 'mysql/0', 'ntp/0'],
+                         [c.entity for c in seen])
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# tests charm_config.py
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import PropertyMock, patch
+
+from jinja2 import Environment, FileSystemLoader
+import yaml
+
+from cloudinstall import charm_config
+from cloudinstall.charm_config import CharmConfigError
+from cloudinstall.config import Config
+from cloudinstall.utils import render_charm_config
+
+log = logging.getLogger('cloudinstall.test_charm_config')
+
+
+def source_tree_template_loader(name):
+    p = os.path.join(os.path.dirname(__file__), "../share/templates")
+    return Environment(loader=FileSystemLoader(p)).get_template(name)
+
+
+class CharmConfigTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.path = os.path.join(self.tmpdir, 'charmconf.yaml')
+        patcher = patch.dict(charm_config._loaded, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, options, mtime=None):
+        with open(self.path, 'w') as f:
+            yaml.safe_dump(options, f, default_flow_style=False)
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_sections_serialized_once(self):
+        self.write({'mysql': {'dataset-size': '512M'},
+                    'keystone': {'admin-password': 'pw'},
+                    'glance': None})
+        with patch('cloudinstall.charm_config.yaml.safe_dump',
+                   wraps=yaml.safe_dump) as dump:
+            conf = charm_config.load(self.path)
+            self.assertEqual({'mysql': {'dataset-size': '512M'}},
+                             yaml.safe_load(conf.yaml_for('mysql')))
+            conf.yaml_for('mysql')
+            self.assertEqual("", conf.yaml_for('glance'))
+            self.assertEqual("", conf.yaml_for('nova-compute'))
+        self.assertEqual(1, dump.call_count)
+
+    def test_parsed_again_only_on_change(self):
+        self.write({'mysql': {'dataset-size': '512M'}}, mtime=1000)
+        with patch('cloudinstall.charm_config.yaml.safe_load',
+                   wraps=yaml.safe_load) as parse:
+            conf = charm_config.load(self.path)
+            self.assertIs(conf, charm_config.load(self.path))
+            # rewritten, same content
+            self.write({'mysql': {'dataset-size': '512M'}}, mtime=2000)
+            self.assertIs(conf, charm_config.load(self.path))
+            self.assertEqual(1, parse.call_count)
+
+            self.write({'mysql': {'dataset-size': '1G'}}, mtime=3000)
+            self.assertEqual('1G', charm_config.load(
+                self.path).section('mysql')['dataset-size'])
+            self.assertEqual(2, parse.call_count)
+
+        os.remove(self.path)
+        self.assertEqual({}, charm_config.load(self.path).options)
+
+    def test_validate(self):
+        charm_config.validate({'mysql': {'dataset-size': '512M',
+                                         'max-connections': 25000,
+                                         'debug': False},
+                               'glance': None})
+        with self.assertRaises(CharmConfigError) as e:
+            charm_config.validate({'mysql': {'dataset-size': ['512M']},
+                                   'keystone': 'admin-password'})
+        self.assertIn("keystone: not a mapping", str(e.exception))
+        self.assertIn("mysql: dataset-size", str(e.exception))
+        self.write({'mysql': {'max-connections': {'default': 1}}})
+        self.assertRaises(CharmConfigError, charm_config.load, self.path)
+
+
+class RenderCharmConfigTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.config = Config({}, os.path.join(self.tmpdir, 'config.yaml'),
+                             save_backups=False)
+        patcher = patch.object(type(self.config), 'cfg_path',
+                               PropertyMock(return_value=self.tmpdir))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('cloudinstall.utils.load_template',
+                        side_effect=source_tree_template_loader)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.config.setopt('openstack_password', 'fake_pw')
+        self.config.setopt('openstack_release', 'liberty')
+
+    def test_rendered_once_per_inputs(self):
+        custom_path = os.path.join(self.tmpdir, 'custom.yaml')
+        with open(custom_path, 'w') as f:
+            f.write("mysql: {dataset-size: 2048M}\n")
+        self.config.setopt('charm_config_file', custom_path)
+        dest_path = os.path.join(self.tmpdir, 'charmconf.yaml')
+
+        renders = []
+
+        def spew(path, data):
+            if path == dest_path:
+                renders.append(data)
+            with open(path, 'w') as f:
+                f.write(data)
+
+        with patch('cloudinstall.utils.spew', side_effect=spew):
+            render_charm_config(self.config)
+            render_charm_config(self.config)
+            self.assertEqual(1, len(renders))
+            with open(dest_path) as f:
+                self.assertEqual('2048M',
+                                 yaml.safe_load(f)['mysql']['dataset-size'])
+
+            self.config.setopt('openstack_password', 'other_pw')
+            render_charm_config(self.config)
+            self.assertEqual(2, len(renders))
+
+            # hand edits are rendered over
+            with open(dest_path, 'a') as f:
+                f.write("ntp: {source: pool.ntp.org}\n")
+            render_charm_config(self.config)
+            self.assertEqual(3, len(renders))
+
+    def test_invalid_custom_config(self):
+        custom_path = os.path.join(self.tmpdir, 'custom.yaml')
+        with open(custom_path, 'w') as f:
+            f.write("mysql: [dataset-size]\n")
+        self.config.setopt('charm_config_file', custom_path)
+        self.assertRaises(CharmConfigError, render_charm_config, self.config)
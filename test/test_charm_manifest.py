@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cloudinstall import charm_manifest, utils
+from cloudinstall.charms.ceph import CharmCeph
+from cloudinstall.charms.keystone import CharmKeystone
+from cloudinstall.charms.swift import CharmSwift
+
+log = logging.getLogger('cloudinstall.test_charm_manifest')
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'files')
+
+
+class CharmManifestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        patcher = patch.object(charm_manifest, '_cache_path',
+                               lambda d: os.path.join(
+                                   self.tmpdir, d.replace('/', '_')))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.dict(charm_manifest._loaded, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def forget_plugins(self):
+        for name in [m for m in sys.modules if m.split('.')[0] == 'charms']:
+            del sys.modules[name]
+
+    def test_matches_charm_classes(self):
+        manifest = charm_manifest.load(charm_manifest.CHARMS_DIR,
+                                       'cloudinstall.charms')
+        charms = {e['name']: charm_manifest.CharmMetadata(e)
+                  for e in manifest['charms']}
+        for m in utils.load_charms():
+            cc = m.__charm_class__
+            metadata = charms[cc.name()]
+            for attr in charm_manifest.ATTRIBUTES:
+                self.assertEqual(getattr(cc, attr), getattr(metadata, attr))
+            self.assertEqual(cc.required_num_units(),
+                             metadata.required_num_units())
+        self.assertIsNone(charms['swift-storage']._required_num_units)
+        self.assertEqual(3, charms['ceph'].required_num_units())
+
+    def test_equal_to_charm_classes(self):
+        keystone = charm_manifest.by_name('keystone')
+        self.assertEqual(CharmKeystone, keystone)
+        self.assertEqual(keystone, CharmKeystone)
+        self.assertNotEqual(CharmCeph, keystone)
+        self.assertEqual({CharmKeystone, keystone}, {keystone})
+        self.assertIn(CharmSwift, charm_manifest.charm_classes())
+        self.assertIs(CharmKeystone, keystone.load())
+
+    def test_plugin_charms_imported_on_use(self):
+        plugin_path = os.path.join(self.tmpdir, 'plugins')
+        shutil.copytree(os.path.join(DATA_DIR, 'charm_plugins'), plugin_path)
+        with patch.dict(sys.modules):
+            self.forget_plugins()
+            charm_manifest.charm_classes(plugin_path)
+            self.assertIn('charms.bitlbee', sys.modules)
+            del sys.modules['charms.bitlbee']
+            charm_manifest._loaded.clear()
+
+            charms = charm_manifest.charm_classes(plugin_path)
+            self.assertNotIn('charms.bitlbee', sys.modules)
+            bitlbee = [c for c in charms if c.name() == 'bitlbee'][0]
+            horizon = [c for c in charms
+                       if c.name() == 'openstack-dashboard'][0]
+            self.assertEqual('charms.horizon', horizon.module_name)
+            self.assertEqual('bitlbee', bitlbee.display_name)
+            self.assertNotIn('charms.bitlbee', sys.modules)
+            self.assertEqual('CharmBitlbee', bitlbee.load().__name__)
+            self.assertIn('charms.bitlbee', sys.modules)
+
+    def test_rebuilt_when_modules_change(self):
+        plugin_path = os.path.join(self.tmpdir, 'plugins')
+        shutil.copytree(os.path.join(DATA_DIR, 'charm_plugins'), plugin_path)
+        charms_dir = os.path.join(plugin_path, 'charms')
+        with patch.dict(sys.modules), \
+                patch.object(charm_manifest, 'build',
+                             wraps=charm_manifest.build) as build:
+            self.forget_plugins()
+            charm_manifest.load(charms_dir, 'charms', plugin_path=plugin_path)
+            charm_manifest.load(charms_dir, 'charms', plugin_path=plugin_path)
+            self.assertEqual(1, build.call_count)
+            bitlbee = os.path.join(charms_dir, 'bitlbee.py')
+            os.utime(bitlbee, (0, os.path.getmtime(bitlbee) + 10))
+            charm_manifest.load(charms_dir, 'charms', plugin_path=plugin_path)
+            self.assertEqual(2, build.call_count)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+# tests charm_repo.py
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cloudinstall import async, charm_repo
+from cloudinstall.charm_repo import LocalCharmRepo
+from cloudinstall.charms import CharmBase
+
+log = logging.getLogger('cloudinstall.test_charm_repo')
+
+
+def git(*args, cwd=None):
+    cmd = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+    subprocess.check_output(cmd + list(args), cwd=cwd,
+                            stderr=subprocess.STDOUT)
+
+
+class LocalCharmRepoTestCase(unittest.TestCase):
+    """ Local git branches stand in for the Launchpad ones """
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.root = os.path.join(tmpdir.name, 'local-charms')
+        self.branch = os.path.join(tmpdir.name, 'mysql')
+        os.makedirs(self.branch)
+        git('init', '-q', cwd=self.branch)
+        self.commit('metadata.yaml', 'name: mysql\n')
+        # fetches run inline
+        patcher = patch('cloudinstall.charm_repo.async.submit',
+                        side_effect=lambda f, cb, **kwargs: f())
+        self.submit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def commit(self, name, content):
+        with open(os.path.join(self.branch, name), 'w') as f:
+            f.write(content)
+        git('add', name, cwd=self.branch)
+        git('commit', '-q', '-m', name, cwd=self.branch)
+
+    def commands(self, repo):
+        return patch.object(repo, '_run', wraps=repo._run)
+
+    def test_checkouts_kept_and_updated(self):
+        repo = LocalCharmRepo(self.root)
+        with self.commands(repo) as run:
+            digest = repo.fetch('mysql', self.branch)
+            # once per run
+            repo.prefetch('mysql', self.branch)
+            self.assertEqual(digest, repo.fetch('mysql', self.branch))
+        self.assertEqual(1, run.call_count)
+        self.assertEqual(async.PRIORITY_HIGH,
+                         self.submit.call_args[1]['priority'])
+        self.assertEqual('clone', run.call_args[0][0][1])
+        self.assertTrue(os.path.exists(
+            os.path.join(repo.path('mysql', 'trusty'), 'metadata.yaml')))
+
+        # the next run updates the same checkout
+        self.commit('config.yaml', 'options: {}\n')
+        repo = LocalCharmRepo(self.root)
+        with self.commands(repo) as run:
+            self.assertNotEqual(digest, repo.fetch('mysql', self.branch))
+        run.assert_called_once_with(['git', 'pull', '--ff-only'],
+                                    cwd=repo.path('mysql', 'trusty'))
+        self.assertTrue(os.path.exists(
+            os.path.join(repo.path('mysql', 'trusty'), 'config.yaml')))
+
+    def test_uploads_follow_content(self):
+        repo = LocalCharmRepo(self.root)
+        repo.fetch('mysql', self.branch)
+        self.assertIsNone(repo.uploaded('mysql', 'trusty', 'env'))
+        repo.record_upload('mysql', 'trusty', 'env', 'local:trusty/mysql-1')
+
+        repo = LocalCharmRepo(self.root)
+        repo.fetch('mysql', self.branch)
+        self.assertEqual('local:trusty/mysql-1',
+                         repo.uploaded('mysql', 'trusty', 'env'))
+        self.assertIsNone(repo.uploaded('mysql', 'trusty', 'other-env'))
+
+        self.commit('README', 'changed\n')
+        repo = LocalCharmRepo(self.root)
+        repo.fetch('mysql', self.branch)
+        self.assertIsNone(repo.uploaded('mysql', 'trusty', 'env'))
+
+    def test_failed_fetch_retried(self):
+        repo = LocalCharmRepo(self.root)
+        with self.assertRaises(subprocess.CalledProcessError):
+            repo.fetch('mysql', self.branch + '-missing.git')
+        self.assertTrue(repo.fetch('mysql', self.branch))
+
+    def test_charm_source(self):
+        config = MagicMock(name='config')
+        opts = dict(next_charms=True, use_nclxd=False,
+                    ubuntu_series='wily')
+        config.getopt.side_effect = lambda k: opts[k]
+        charm = MagicMock(charm_name='nova-compute',
+                          available_sources=['charmstore', 'next'])
+        self.assertEqual(
+            ('lp:~openstack-charmers/charms/trusty/nova-compute/next',
+             'trusty'), charm_repo.charm_source(charm, config))
+        opts.update(next_charms=False, use_nclxd=True)
+        self.assertEqual(('lp:charms/trusty/nova-compute', 'wily'),
+                         charm_repo.charm_source(charm, config))
+        opts.update(use_nclxd=False)
+        self.assertIsNone(charm_repo.charm_source(charm, config))
+
+
+@patch('cloudinstall.charms.get_service_config_yaml', return_value='')
+@patch('cloudinstall.charms.subprocess.check_output', return_value=b'')
+class LocalDeployTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        config = MagicMock(name='config', cfg_path=tmpdir.name)
+        config.juju_home.return_value = ''
+        self.juju = MagicMock(name='juju')
+        self.juju.info.return_value = {'UUID': 'env'}
+        self.juju.status.return_value = {
+            'Services': {'mysql': {'Charm': 'local:trusty/mysql-1'}}}
+        self.charm = CharmBase(config=config, ui=MagicMock(name='ui'),
+                               juju=self.juju,
+                               juju_state=MagicMock(name='juju_state'))
+        self.charm.charm_name = 'mysql'
+        self.repo = charm_repo.get(config)
+        self.repo._state['trusty/mysql'] = dict(branch='lp:charms/mysql',
+                                                hash='abc')
+
+    def test_unchanged_charm_not_uploaded_again(self, mock_check_output,
+                                                mock_config):
+        self.assertFalse(self.charm.local_deploy('1'))
+        self.assertEqual(1, mock_check_output.call_count)
+        self.juju.deploy.assert_not_called()
+
+        self.assertFalse(self.charm.local_deploy('2'))
+        self.assertEqual(1, mock_check_output.call_count)
+        self.juju.deploy.assert_called_once_with(
+            'local:trusty/mysql-1', 'mysql', 1, '', {}, '2')
+
+        # changed checkouts are uploaded
+        self.repo._state['trusty/mysql']['hash'] = 'def'
+        self.assertFalse(self.charm.local_deploy('3'))
+        self.assertEqual(2, mock_check_output.call_count)
@@ -53,6 +53,9 @@ class TestCharmBase(unittest.TestCase):
         self.get_config_patcher = patch('cloudinstall.charms.get_charm_config')
         self.mock_get_config = self.get_config_patcher.start()
         self.mock_get_config.return_value = ({}, None)
+        self.get_yaml_patcher = patch(
+            'cloudinstall.charms.get_service_config_yaml', return_value='')
+        self.get_yaml_patcher.start()
 
         self.charm = CharmBase(juju=self.mock_jujuclient,
                                juju_state=self.mock_juju_state,
@@ -61,6 +64,7 @@ class TestCharmBase(unittest.TestCase):
 
     def tearDown(self):
         self.get_config_patcher.stop()
+        self.get_yaml_patcher.stop()
 
     def test_subordinate_deploy_success(self):
         self.mock_config.getopt.return_value = False
@@ -72,6 +76,23 @@ class TestCharmBase(unittest.TestCase):
                                                        0, ANY, None,
                                                        None)
 
+    def test_deploy_units_in_one_call(self):
+        self.mock_config.getopt.return_value = False
+        self.charm.charm_name = 'fake'
+        self.charm.available_sources = ['charmstore']
+        self.charm.deploy(['1', 'lxc:2', ''])
+        self.mock_jujuclient.deploy.assert_called_once_with(
+            'fake', 'fake', 3, ANY, ANY, '', placement=['1', 'lxc:2', ''])
+
+        self.mock_jujuclient.reset_mock()
+        self.charm.deploy(['lxc:2'])
+        self.mock_jujuclient.deploy.assert_called_once_with(
+            'fake', 'fake', 1, ANY, ANY, 'lxc:2')
+
+        self.charm.add_unit(['3', 'kvm:4'])
+        self.mock_jujuclient.add_unit.assert_called_once_with(
+            'fake', 2, '', ['3', 'kvm:4'])
+
     def test_no_available_sources(self):
         """ Exception raised when no available sources defined
         """
@@ -17,11 +17,17 @@
 
 import logging
 import unittest
+from collections import Counter
 from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs, urlparse
 
+from cloudinstall import async
 from cloudinstall.config import Config
 from cloudinstall.core import Controller
 from cloudinstall.juju import JujuState
+from cloudinstall.simulator.juju import SimulatedJuju
+import macumba.api
+from macumba.v1 import JujuClient
 
 log = logging.getLogger('cloudinstall.test_core')
 
@@ -59,16 +65,281 @@ class WaitForDeployedServicesReadyCoreTestCase(unittest.TestCase):
         self.assertEqual(len(mock_sleep.mock_calls), 0)
 
     def test_validate_services_some_ready(self):
-        """ Verifies wait_for_deployed_services_ready against some of the
-        services in started state
-
-        Here we test if async.sleep_until was called twice due to some services
-        being in an installing and allocating state.
+        """ Verifies wait_for_deployed_services_ready waits for the units
+        that are not started yet to start, fetching the status only as
+        its cache expires
         """
-        self.dc.juju_state.all_agents_started.side_effect = [
-            False, False, True, True]
+        def unit_status(state):
+            return {'Services': {'mysql': {'Units': {
+                'mysql/0': {'AgentState': state}}}}}
+        juju = MagicMock(name='juju')
+        juju.status.side_effect = [unit_status('installing'),
+                                   unit_status('started')]
+        self.dc.juju_state = JujuState(juju=juju)
 
-        with patch('cloudinstall.async.sleep_until') as mock_sleep:
+        with patch('cloudinstall.async.sleep_until',
+                   side_effect=lambda *args, **kwargs:
+                   self.dc.juju_state.invalidate_status_cache()) \
+                as mock_sleep:
             self.dc.wait_for_deployed_services_ready()
-        print(mock_sleep.mock_calls)
-        self.assertEqual(len(mock_sleep.mock_calls), 2)
+        self.assertEqual(1, len(mock_sleep.mock_calls))
+        self.assertEqual(2, juju.status.call_count)
+        self.assertTrue(self.conf.getopt('deploy_complete'))
+
+
+class SimulatedJujuClient(JujuClient):
+    """ macumba client answered by a SimulatedJuju, counting requests """
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.requests = Counter()
+
+    def call(self, params, timeout=None):
+        self.requests[(params['Type'], params['Request'])] += 1
+        return self.sim.handle(params)
+
+
+class AddMachinesToJujuSingleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conf = Config({}, save_backups=False)
+        self.dc = Controller(ui=MagicMock(name='ui'), config=self.conf,
+                             loop=MagicMock(name='loop'))
+        self.sim = SimulatedJuju()
+        self.dc.juju = SimulatedJujuClient(self.sim)
+        self.dc.juju_state = JujuState(self.dc.juju)
+        self.machines = [MagicMock(instance_id=iid, constraints={'mem': 1024})
+                         for iid in ['controller', 'compute', 'storage']]
+        self.dc.placement_controller = MagicMock()
+        self.dc.placement_controller.machines_pending.return_value = \
+            self.machines
+
+    def test_bulk_calls(self):
+        self.dc.juju.add_machine()
+        self.sim.annotations['machine-1'] = {'instance_id': 'controller'}
+        self.dc.juju.requests.clear()
+        self.dc.add_machines_to_juju_single()
+        self.assertEqual(dict(controller='1', compute='2', storage='3'),
+                         self.dc.juju_m_idmap)
+        self.assertEqual(['1', '2', '3'],
+                         [m.machine_id for m in self.machines])
+        self.assertEqual({'instance_id': 'storage'},
+                         self.sim.annotations['machine-3'])
+        self.assertEqual(Counter({('Client', 'FullStatus'): 1,
+                                  ('Annotations', 'Get'): 1,
+                                  ('Client', 'AddMachines'): 1,
+                                  ('Annotations', 'Set'): 1}),
+                         self.dc.juju.requests)
+
+        # restarting finds them all
+        self.dc.add_machines_to_juju_single()
+        self.assertEqual(2, self.dc.juju.requests[('Annotations', 'Get')])
+        self.assertEqual(1, self.dc.juju.requests[('Client', 'AddMachines')])
+        self.assertEqual(4, len(self.sim.machines))
+
+    def test_errors_per_machine(self):
+        juju = MagicMock(name='juju')
+        self.dc.juju = juju
+        self.dc.juju_state = MagicMock(name='juju_state')
+        self.dc.juju_state.machines.return_value = []
+        juju.add_machines.return_value = {'Machines': [
+            {'Machine': '1', 'Error': None},
+            {'Machine': '', 'Error': {'Message': 'no room', 'Code': ''}},
+            {'Machine': '2', 'Error': None}]}
+        juju.set_entities_annotations.return_value = {'Results': []}
+        with self.assertRaisesRegex(Exception, "'compute':no room"):
+            self.dc.add_machines_to_juju_single()
+        juju.get_entities_annotations.assert_not_called()
+        juju.set_entities_annotations.assert_called_once_with(
+            {'machine-1': {'instance_id': 'controller'},
+             'machine-2': {'instance_id': 'storage'}})
+        self.assertEqual(dict(controller='1', storage='2'),
+                         self.dc.juju_m_idmap)
+
+
+class TryDeployTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conf = Config({}, save_backups=False)
+        self.dc = Controller(ui=MagicMock(name='ui'), config=self.conf,
+                             loop=MagicMock(name='loop'))
+        self.dc.placement_controller = MagicMock(name='pc')
+        self.machines = [MagicMock(name=str(i)) for i in range(3)]
+        self.dc.placement_controller.get_assignments.return_value = {
+            'BareMetal': self.machines[:2], 'LXC': self.machines[2:]}
+        specs = {self.machines[0]: '1', self.machines[1]: None,
+                 self.machines[2]: 'lxc:3'}
+        self.dc.get_machine_spec = lambda m, atype: specs[m]
+        self.charm_class = MagicMock(name='charm_class')
+        self.charm = self.charm_class.return_value
+
+    def test_deploys_all_units_at_once(self):
+        self.charm.deploy.return_value = False
+        self.assertTrue(self.dc.try_deploy(self.charm_class))
+        self.charm.deploy.assert_called_once_with(['1', 'lxc:3'])
+        self.charm.add_unit.assert_not_called()
+        self.dc.placement_controller.mark_all_deployed.assert_called_once_with(
+            [(self.machines[0], self.charm_class, 'BareMetal'),
+             (self.machines[2], self.charm_class, 'LXC')])
+
+    def test_deploy_deferred(self):
+        self.charm.deploy.return_value = True
+        self.assertTrue(self.dc.try_deploy(self.charm_class))
+        self.dc.placement_controller.mark_all_deployed.assert_not_called()
+
+
+class DeployPipelinedTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conf = Config({}, save_backups=False)
+        self.dc = Controller(ui=MagicMock(name='ui'), config=self.conf,
+                             loop=MagicMock(name='loop'))
+        self.dc.juju_state = MagicMock(name='juju_state')
+        self.dc.juju_state.services = []
+        self.dc.maas_state = MagicMock(name='maas_state')
+        self.machines = [MagicMock(name=i, instance_id=i)
+                         for i in ['fast', 'slow']]
+        self.charms = {name: MagicMock(charm_name=name, deploy_priority=p)
+                       for name, p in [('ntp', 0), ('mysql', 0),
+                                       ('keystone', 1)]}
+        assignments = {'ntp': {}, 'mysql': {'BareMetal': self.machines[:1]},
+                       'keystone': {'LXC': self.machines[1:]}}
+        pc = self.dc.placement_controller = MagicMock(name='pc')
+        pc.assigned_charm_classes.return_value = list(self.charms.values())
+        pc.machines_pending.return_value = self.machines
+        pc.get_assignments.side_effect = lambda cc: assignments[cc.charm_name]
+        pc.is_placeholder.return_value = False
+
+    def juju_machines(self, **agent_states):
+        return [MagicMock(instance_id=i, agent_state=state)
+                for i, state in agent_states.items()]
+
+    @patch('cloudinstall.core.async.wait_until')
+    def test_deploys_each_charm_once_its_machines_start(self, mock_wait):
+        # (maas ready, juju machines) seen by each pass
+        passes = [(['fast'], {}),
+                  (['fast', 'slow'], dict(fast='started')),
+                  (['fast', 'slow'], dict(fast='started', slow='pending')),
+                  (['fast', 'slow'], dict(fast='started', slow='started'))]
+        deployed = []
+
+        def wait_until(pred, **kwargs):
+            for ready, juju in passes:
+                self.dc.maas_state.machines.side_effect = \
+                    lambda status, constraints: [
+                        m for m in self.machines if m.instance_id in ready]
+                self.dc.juju_state.machines.return_value = \
+                    self.juju_machines(**juju)
+                deployed.append(pred())
+
+        mock_wait.side_effect = wait_until
+        with patch.object(self.dc, 'try_deploy',
+                          return_value=False) as mock_deploy, \
+                patch.object(self.dc, 'add_machines_to_juju_multi') as \
+                mock_add:
+            self.dc.deploy_pipelined()
+
+        self.assertEqual([False, False, False, True], deployed)
+        self.assertEqual([[self.machines[0]], [self.machines[1]]],
+                         [c[0][0] for c in mock_add.call_args_list])
+        self.assertEqual([self.charms[n] for n in ['ntp', 'mysql',
+                                                   'keystone']],
+                         [c[0][0] for c in mock_deploy.call_args_list])
+        self.assertEqual(3, len(self.dc.deployed_charm_classes))
+
+    @patch('cloudinstall.core.async.wait_until')
+    def test_skips_existing_services(self, mock_wait):
+        self.dc.juju_state.services = [MagicMock(service_name=n)
+                                       for n in self.charms]
+        self.dc.juju_state.machines.return_value = []
+        self.dc.maas_state.machines.return_value = []
+        mock_wait.side_effect = lambda pred, **kwargs: self.assertTrue(pred())
+        with patch.object(self.dc, 'try_deploy') as mock_deploy:
+            self.dc.deploy_pipelined()
+        mock_deploy.assert_not_called()
+
+
+class UpdateNodeStatesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conf = Config({}, save_backups=False)
+        self.dc = Controller(ui=MagicMock(name='ui'), config=self.conf,
+                             loop=MagicMock(name='loop'))
+        self.dc.juju_state = MagicMock(name='juju_state')
+        self.dc.juju_state.services = [MagicMock(service_name='mysql')]
+
+    def test_refreshes_services_view_on_changes(self):
+        self.dc.update_node_states()
+        self.dc.update_node_states()
+        self.assertEqual(1, self.dc.ui.refresh_services_view.call_count)
+        self.dc.ui.update_phase_status.assert_called_once_with(self.conf)
+
+        self.dc.juju_status_changed(MagicMock(name='change'))
+        self.dc.update_node_states()
+        self.assertEqual(2, self.dc.ui.refresh_services_view.call_count)
+
+        self.dc.services_refreshed -= self.dc.SERVICES_REFRESH_INTERVAL
+        self.dc.update_node_states()
+        self.assertEqual(3, self.dc.ui.refresh_services_view.call_count)
+
+
+class PrefetchCharmsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conf = Config({}, save_backups=False)
+        self.dc = Controller(ui=MagicMock(name='ui'), config=self.conf,
+                             loop=MagicMock(name='loop'))
+        self.dc.juju = MagicMock(name='juju')
+        self.dc.placement_controller = MagicMock(name='pc')
+        self.dc.placement_controller.assigned_charm_classes.return_value = [
+            MagicMock(charm_name=name, available_sources=sources,
+                      deploy_priority=priority)
+            for name, sources, priority in [
+                ('mysql', ['charmstore'], 10),
+                ('keystone', ['charmstore', 'next'], 10),
+                ('local', [], 10),
+                ('ntp', ['charmstore'], 0)]]
+        for patcher in [patch.dict(macumba.api._cs_cache, clear=True),
+                        patch.object(macumba.api, 'CHARMSTORE_CACHE_PATH',
+                                     None),
+                        patch('cloudinstall.core.async.submit',
+                              side_effect=lambda f, cb, **kwargs: f())]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def response(self, url, **kwargs):
+        charm_ids = parse_qs(urlparse(url).query)['id']
+        r = MagicMock(status_code=200)
+        r.json.return_value = {charm_id: {'Id': 'cs:{}-5'.format(charm_id)}
+                               for charm_id in charm_ids}
+        return r
+
+    @patch('cloudinstall.core.charm_repo.LocalCharmRepo.prefetch')
+    @patch('macumba.api.requests.get')
+    def test_adds_store_charms(self, mock_get, mock_prefetch):
+        mock_get.side_effect = self.response
+        self.conf.setopt('next_charms', True)
+        self.dc.prefetch_charms()
+        self.assertEqual([(('cs:trusty/ntp-5',),), (('cs:trusty/mysql-5',),)],
+                         self.dc.juju.add_charm.call_args_list)
+        self.assertEqual(
+            {async.PRIORITY_LOW},
+            set(c[1]['priority'] for c in async.submit.call_args_list))
+        mock_prefetch.assert_called_once_with(
+            'keystone', 'lp:~openstack-charmers/charms/trusty/keystone/next',
+            'trusty')
+
+        # the deploy resolves the same revision without asking the store
+        self.assertEqual('cs:trusty/mysql-5',
+                         macumba.api.query_cs('mysql')['Id'])
+        self.assertEqual(1, mock_get.call_count)
+
+    @patch('macumba.api.requests.get')
+    def test_failures_left_to_deploy(self, mock_get):
+        mock_get.side_effect = self.response
+        self.dc.juju.add_charm.side_effect = Exception("no such charm")
+        self.dc.prefetch_charms()
+        self.assertEqual(3, self.dc.juju.add_charm.call_count)
+        self.dc.ui.show_exception_message.assert_not_called()
+        # both looked up at once
+        self.assertEqual(1, mock_get.call_count)
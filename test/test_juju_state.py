@@ -16,8 +16,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import threading
 import unittest
-from unittest.mock import MagicMock, PropertyMock
+from unittest.mock import MagicMock, PropertyMock, patch
 
 from cloudinstall.config import Config
 from cloudinstall.juju import JujuState
@@ -55,11 +56,16 @@ class JujuStateTestCase(unittest.TestCase):
                     {'Units': {'fake4': {'AgentState': 'allocating'}}}),
         ]
 
+    def patch_services(self, services):
+        patcher = patch.object(JujuState, 'services', services)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_services_ready(self):
         """ Verifies all ready services  """
         juju_state = JujuState(juju=MagicMock())
         services = PropertyMock(return_value=self.services_ready)
-        type(juju_state).services = services
+        self.patch_services(services)
 
         not_ready = [(a, b) for a, b in juju_state.get_agent_states()
                      if b != 'started']
@@ -70,8 +76,64 @@ class JujuStateTestCase(unittest.TestCase):
         """ Verifies some ready services == not_ready list """
         juju_state = JujuState(juju=MagicMock())
         services = PropertyMock(return_value=self.services_some_ready)
-        type(juju_state).services = services
+        self.patch_services(services)
         not_ready = [(a, b) for a, b in juju_state.get_agent_states()
                      if b != 'started']
         self.assertEqual(len(not_ready), 2)
         self.assertFalse(juju_state.all_agents_started())
+
+
+class ScopedStatusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.juju = MagicMock(name='juju')
+        self.juju.status.side_effect = lambda patterns=None: dict(
+            Machines={'1': {'InstanceId': 'node-1'},
+                      '2': {'InstanceId': 'node-2'}},
+            Services={'mysql': {'Units': {}}})
+        self.juju_state = JujuState(self.juju)
+
+    def test_service_queries_only_that_service(self):
+        self.assertEqual('mysql',
+                         self.juju_state.service('mysql').service_name)
+        self.juju_state.service('mysql')
+        self.assertEqual({}, self.juju_state.service('nova').service)
+        self.assertEqual([(['mysql'],), (['nova'],)],
+                         [c[0] for c in self.juju.status.call_args_list])
+
+        self.juju_state.invalidate_status_cache()
+        self.juju_state.service('mysql')
+        self.assertEqual(3, self.juju.status.call_count)
+
+    def test_full_status_stands_in_while_cached(self):
+        self.juju_state.machines()
+        self.juju_state.service('mysql')
+        self.assertEqual([()], [c[0] for c in self.juju.status.call_args_list])
+
+    def test_machine_by_instance_id(self):
+        self.assertIsNone(self.juju_state.machine_by_instance_id('node-3'))
+        self.juju_state.invalidate_status_cache()
+        self.assertEqual('2', self.juju_state.machine_by_instance_id(
+            'node-2').machine_id)
+        # the id is known from the earlier listing
+        self.assertEqual([(), (['2'],)],
+                         [c[0] for c in self.juju.status.call_args_list])
+
+    def test_concurrent_callers_share_one_fetch(self):
+        fetching = threading.Event()
+        release = threading.Event()
+
+        def slow_status(patterns=None):
+            fetching.set()
+            release.wait(5)
+            return dict(Machines={}, Services={})
+        self.juju.status.side_effect = slow_status
+        first = threading.Thread(target=self.juju_state.status)
+        first.start()
+        fetching.wait(5)
+        second = threading.Thread(target=self.juju_state.status)
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(1, self.juju.status.call_count)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import queue
+import threading
+import unittest
+from unittest.mock import ANY, MagicMock, patch
+
+from cloudinstall.log import (BudgetQueueListener, LazyQueueHandler,
+                              LogBudget, PrettyLog)
+
+log = logging.getLogger('cloudinstall.test_log')
+
+
+def make_record(msg, args=None, name='cloudinstall.test',
+                level=logging.DEBUG):
+    return logging.LogRecord(name, level, __file__, 0, msg, args, None)
+
+
+class Tracked:
+    """ Counts how often it is formatted """
+    reprs = 0
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        Tracked.reprs += 1
+        return repr(self.value)
+
+
+class LogBudgetTestCase(unittest.TestCase):
+
+    def test_truncates_large_messages(self):
+        budget = LogBudget(max_size=10)
+        r = make_record("%s", ("x" * 25,))
+        budget.trim(r)
+        self.assertEqual(r.getMessage(),
+                         "xxxxxxxxxx... [15 characters truncated]")
+        self.assertIn("1 truncated", budget.summary()[0])
+
+    def test_rate_limit_and_note(self):
+        budget = LogBudget(rate=2, window=60)
+        results = [budget.admit(make_record("m")) for _ in range(4)]
+        self.assertEqual(results, [True, True, False, False])
+        self.assertTrue(budget.admit(make_record("w",
+                                                 level=logging.WARNING)))
+        with patch('cloudinstall.log.time.time',
+                   return_value=budget.windows['cloudinstall.test'][0] + 61):
+            r = make_record("next")
+            self.assertTrue(budget.admit(r))
+        budget.trim(r)
+        self.assertIn("2 records from cloudinstall.test suppressed",
+                      r.getMessage())
+
+
+class LazyFormattingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.q = queue.Queue()
+        self.handler = MagicMock(level=logging.DEBUG)
+        self.budget = LogBudget(rate=2)
+        self.listener = BudgetQueueListener(self.q, self.handler,
+                                            budget=self.budget)
+        self.logger = logging.getLogger('cloudinstall.test_log.lazy')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        qh = LazyQueueHandler(self.q, self.budget)
+        self.logger.addHandler(qh)
+        self.addCleanup(self.logger.removeHandler, qh)
+        Tracked.reprs = 0
+
+    def handled(self):
+        self.listener.start()
+        self.listener.stop()
+        return [c[0][0].getMessage()
+                for c in self.handler.handle.call_args_list]
+
+    def test_immutable_args_formatted_in_listener(self):
+        self.logger.debug("n=%s s=%s", 1, "x")
+        record = self.q.get_nowait()
+        self.assertEqual((1, "x"), record.args)
+        self.q.put_nowait(record)
+        self.assertEqual(["n=1 s=x"], self.handled())
+
+    def test_live_state_formatted_in_listener_as_logged(self):
+        state = [Tracked('a')]
+        self.logger.debug("state=%s", PrettyLog(state))
+        # later changes don't show up in the record
+        state.append(Tracked('b'))
+        self.logger.setLevel(logging.INFO)
+        self.logger.debug("skipped=%s", PrettyLog(state))
+        self.assertEqual(0, Tracked.reprs)
+        self.assertEqual(["state=['a']"], self.handled())
+
+    def test_over_rate_never_formatted(self):
+        for i in range(5):
+            self.logger.debug("state=%s", PrettyLog([Tracked(i)]))
+        self.assertEqual(2, self.q.qsize())
+        handled = self.handled()
+        self.assertEqual(["state=[0]", "state=[1]"], handled[:2])
+        self.assertIn("3 records suppressed", handled[2])
+        self.assertEqual(2, Tracked.reprs)
+
+    def test_uncopyable_args_formatted_when_logged(self):
+        lock = threading.Lock()
+        self.logger.debug("lock=%s", PrettyLog({'lock': lock}))
+        record = self.q.get_nowait()
+        self.assertIsNone(record.args)
+        self.assertIn("lock", record.msg)
+
+    def test_bad_record_does_not_stop_listener(self):
+        self.q.put_nowait(logging.LogRecord(
+            'cloudinstall.test', logging.DEBUG, __file__, 0, "bad %s %s",
+            (1,), None))
+        self.logger.error("after")
+        self.assertEqual(["after"], self.handled())
+        self.handler.handleError.assert_called_once_with(ANY)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# tests ui/views/machinewait.py
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cloudinstall import async
+from cloudinstall.ui.views import MachineWaitView
+
+log = logging.getLogger('cloudinstall.test_machinewait')
+
+
+def rendered(w):
+    canvas = w.render((100, 30))
+    return " ".join(t.decode() for t in canvas.text)
+
+
+@patch('cloudinstall.ui.views.machinewait.async.submit')
+@patch('cloudinstall.ui.views.machinewait.connect_to_maas')
+class MachineWaitViewTestCase(unittest.TestCase):
+
+    def make_view(self, mock_connect, n_machines):
+        maas_state = MagicMock(name='maas_state')
+        maas_state.machines.side_effect = lambda **kw: [
+            MagicMock(power_type='ipmi') for _ in range(n_machines[0])]
+        mock_connect.return_value = (MagicMock(name='maas'), maas_state)
+        return MachineWaitView(MagicMock(), MagicMock(), MagicMock())
+
+    def test_update_renders_snapshot(self, mock_connect, mock_submit):
+        n_machines = [0]
+        view = self.make_view(mock_connect, n_machines)
+        self.assertEqual(view.watch_maas, mock_submit.call_args[0][0])
+        self.assertIn("Checking MAAS", rendered(view))
+
+        with patch.object(view, 'render_status',
+                          wraps=view.render_status) as mock_render:
+            view.update()
+            self.assertEqual(0, view.maas_state.machines.call_count)
+            self.assertEqual(0, mock_render.call_count)
+
+            self.assertTrue(view.refresh())
+            view.update()
+            view.update()
+            self.assertEqual(1, mock_render.call_count)
+            self.assertIn("currently 0", rendered(view))
+            self.assertIn("Can't Continue", rendered(view))
+
+            self.assertFalse(view.refresh())
+            n_machines[0] = 2
+            self.assertTrue(view.refresh())
+            view.update()
+            self.assertEqual(2, mock_render.call_count)
+            self.assertIn("currently 2", rendered(view))
+            self.assertNotIn("Can't Continue", rendered(view))
+
+    @patch('cloudinstall.ui.views.machinewait.async.sleep_until')
+    def test_watch_backs_off_until_change(self, mock_sleep, mock_connect,
+                                          mock_submit):
+        view = self.make_view(mock_connect, [1])
+        changes = [True, False, False, Exception("timeout"), True, False]
+
+        def refresh():
+            change = changes.pop(0)
+            if isinstance(change, Exception):
+                raise change
+            return change
+
+        def sleep(interval):
+            if not changes:
+                view.do_continue()
+
+        mock_sleep.side_effect = sleep
+        with patch.object(view, 'refresh', side_effect=refresh):
+            view.watch_maas()
+        self.assertEqual([1, 1.5, 2.25, 3.375, 1, 1.5],
+                         [c[0][0] for c in mock_sleep.call_args_list])
+
+    @patch('cloudinstall.ui.views.machinewait.async.sleep_until')
+    def test_watch_stops_on_shutdown(self, mock_sleep, mock_connect,
+                                     mock_submit):
+        view = self.make_view(mock_connect, [0])
+        mock_sleep.side_effect = async.ThreadCancelledException
+        view.watch_maas()
+        self.assertEqual(1, mock_sleep.call_count)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cloudinstall import metrics
+import maasclient
+from maasclient import MaasClient
+import macumba.api
+from macumba.errors import RequestTimeout
+from macumba.v1 import JujuClient
+
+log = logging.getLogger('cloudinstall.test_metrics')
+
+
+class RequestStatsTestCase(unittest.TestCase):
+
+    def test_histogram_and_percentile(self):
+        s = metrics.RequestStats()
+        for t in [0.01, 0.02, 0.3, 0.4, 100]:
+            s.add(t, 10, 20)
+        self.assertEqual(s.count, 5)
+        self.assertEqual(s.bytes_received, 100)
+        self.assertEqual(s.histogram[0], 2)
+        self.assertEqual(s.histogram[-1], 1)
+        self.assertEqual(s.percentile(50), 0.5)
+        self.assertIsNone(s.percentile(100))
+
+    def test_maas_endpoint(self):
+        self.assertEqual(metrics.maas_endpoint(
+            'POST', '/nodes/node-1234/', {'op': 'release'}),
+            "POST nodes/{id} op=release")
+        self.assertEqual(metrics.maas_endpoint(
+            'GET', '/nodegroups/abc/boot-images/'),
+            "GET nodegroups/{id}/boot-images")
+
+
+class ObserverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+
+    def test_juju_call_recorded(self):
+        with patch.object(macumba.api, 'call_observers',
+                          [metrics.record_juju_call]):
+            jc = JujuClient.__new__(JujuClient)
+            jc.connlock = MagicMock()
+            jc.conn = MagicMock()
+            jc.conn.pop_message_size.return_value = (10, 200)
+            jc.receive = MagicMock(side_effect=[{}, RequestTimeout(1)])
+            jc.status()
+            self.assertRaises(RequestTimeout, jc.status)
+        stats = metrics.registry.to_dict()['juju Client.FullStatus']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['bytes_received'], 400)
+
+    def test_maas_request_recorded(self):
+        res = MagicMock(status_code=404, content=b'nope')
+        auth = MagicMock(api_url='http://maas/api/1.0')
+        with patch.object(maasclient, 'request_observers',
+                          [metrics.record_maas_request]), \
+                patch('maasclient.requests') as mock_requests:
+            mock_requests.get.return_value = res
+            MaasClient(auth).get('/nodes/', dict(op='list'))
+        stats = metrics.registry.to_dict()['maas GET nodes op=list']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['bytes_received'], 4)
+
+    def test_dump(self):
+        metrics.registry.record('juju Client.FullStatus', 0.2)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'metrics.json')
+            metrics.dump(path)
+            with open(path) as f:
+                data = json.load(f)
+        self.assertIn('juju Client.FullStatus', data['requests'])
+        self.assertIn('lanes', data)
@@ -19,7 +19,11 @@ import unittest
 from unittest.mock import MagicMock, patch, call
 
 from cloudinstall.controllers.install import MultiInstall
+from cloudinstall.controllers.install.multi import MaasInstallError
 from cloudinstall.config import Config
+from cloudinstall.controllers.installbase import InstallController
+from cloudinstall.core import Controller
+from cloudinstall.state import InstallState
 from tempfile import NamedTemporaryFile
 
 
@@ -53,3 +57,72 @@ class MultiInstallTestCase(unittest.TestCase):
                     call(set_call_arg,
                          timeout=None, user_sudo=True)]
         self.assertEqual(mock_gco.mock_calls, expected)
+
+    @patch('cloudinstall.controllers.install.multi.metrics')
+    @patch('cloudinstall.controllers.install.multi.AlarmMonitor')
+    @patch('cloudinstall.controllers.install.multi.utils')
+    @patch('cloudinstall.controllers.install.multi.Controller')
+    def test_start_deployment_in_process(self, mock_controller, mock_utils,
+                                         mock_alarms, mock_metrics):
+        dc = self.installer.display_controller
+        with patch.object(self.installer, 'set_perms') as mock_set_perms, \
+                patch.object(self.installer,
+                             'drop_privileges') as mock_drop:
+            self.installer.start_deployment()
+        mock_set_perms.assert_called_once_with()
+        mock_drop.assert_called_once_with()
+        mock_alarms.remove_all.assert_called_once_with()
+        mock_controller.assert_called_once_with(ui=dc, config=self.conf,
+                                                loop=self.installer.loop)
+        core = mock_controller.return_value
+        self.assertEqual(dc.machine_wait_view.maas_client, core.maas)
+        self.assertEqual(dc.machine_wait_view.maas_state, core.maas_state)
+        core.start.assert_called_once_with(run_loop=False)
+        mock_metrics.install.assert_called_once_with(self.conf)
+
+    @patch('os.setuid')
+    @patch('os.setreuid')
+    @patch('os.setregid')
+    @patch('os.initgroups')
+    @patch('pwd.getpwnam')
+    @patch('os.geteuid', return_value=0)
+    def test_drop_privileges_checks_root_is_gone(self, mock_geteuid,
+                                                 mock_getpwnam, *args):
+        mock_setuid = args[-1]
+        mock_getpwnam.return_value = MagicMock(pw_uid=1000, pw_gid=1000)
+        with patch.dict('os.environ', {'SUDO_USER': 'ubuntu'}):
+            mock_setuid.side_effect = PermissionError
+            self.installer.drop_privileges()
+            mock_setuid.side_effect = None
+            self.assertRaises(MaasInstallError,
+                              self.installer.drop_privileges)
+        with patch.dict('os.environ', {'SUDO_USER': ''}):
+            self.assertRaises(MaasInstallError,
+                              self.installer.drop_privileges)
+
+
+@patch('cloudinstall.controllers.installbase.AlarmMonitor')
+class InstallControllerUpdateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        with NamedTemporaryFile(mode='w+', encoding='utf-8') as tempf:
+            self.conf = Config({}, tempf.name, save_backups=False)
+        self.conf.setopt('openstack_release', 'liberty')
+        self.ui = MagicMock(name='ui')
+        self.ic = InstallController(self.ui, self.conf,
+                                    MagicMock(name='loop'))
+        self.conf.setopt('current_state', InstallState.NODE_WAIT.value)
+
+    def test_refresh_continues_under_help_view(self, mock_alarms):
+        # PegasusGUI.show_help_info keeps the body it replaces there
+        self.ui.controller = MagicMock(name='machine_wait_view')
+        self.ic.update()
+        self.ui.render_machine_wait_view.assert_called_once_with(self.conf)
+        self.assertEqual(1, mock_alarms.add_alarm.call_count)
+
+    def test_refresh_stops_after_hand_over(self, mock_alarms):
+        self.ui.controller = Controller(ui=self.ui, config=self.conf,
+                                        loop=MagicMock(name='loop'))
+        self.ic.update()
+        self.ui.render_machine_wait_view.assert_not_called()
+        mock_alarms.add_alarm.assert_not_called()
@@ -294,6 +294,22 @@ class PlacementControllerTestCase(unittest.TestCase):
         self.assertEqual([self.mock_machine_2], ad[AssignmentType.KVM])
         self.assertEqual([self.mock_machine], dd[AssignmentType.KVM])
 
+    def test_mark_all_deployed_saves_once(self):
+        self.pc.assign(self.mock_machine, CharmNovaCompute, AssignmentType.KVM)
+        self.pc.assign(self.mock_machine_2, CharmNovaCompute,
+                       AssignmentType.BareMetal)
+        with patch.object(self.pc, 'update_and_save',
+                          wraps=self.pc.update_and_save) as mock_save:
+            self.pc.mark_all_deployed(
+                [(self.mock_machine, CharmNovaCompute, AssignmentType.KVM),
+                 (self.mock_machine_2, CharmNovaCompute,
+                  AssignmentType.BareMetal)])
+        mock_save.assert_called_once_with()
+        self.assertEqual([], self.pc.assigned_charm_classes())
+        dd = self.pc.get_deployments(CharmNovaCompute)
+        self.assertEqual([self.mock_machine], dd[AssignmentType.KVM])
+        self.assertEqual([self.mock_machine_2], dd[AssignmentType.BareMetal])
+
     def test_get_charm_state(self):
         "Test a sampling of required services and special handling for compute"
         self.assertEqual(self.pc.get_charm_state(CharmKeystone)[0],
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cloudinstall import profiler
+from cloudinstall.profiler import Profiler
+
+log = logging.getLogger('cloudinstall.test_profiler')
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        sum(range(100))
+
+
+class ProfilerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.outdir = self.tmpdir.name
+        self.profiler = Profiler()
+
+    def tearDown(self):
+        self.profiler.stop()
+        self.tmpdir.cleanup()
+
+    def files(self, ext):
+        return sorted(f for f in os.listdir(self.outdir) if f.endswith(ext))
+
+    def test_inactive_is_noop(self):
+        self.profiler.profile_current_thread()
+        self.profiler.mark_phase('x')
+        self.assertEqual(os.listdir(self.outdir), [])
+
+    def test_sampling_worker_thread(self):
+        self.profiler.start('sampling', self.outdir, interval=0.001)
+
+        def worker():
+            self.profiler.profile_current_thread()
+            busy(0.2)
+        t = threading.Thread(target=worker, name='deploy-0')
+        t.start()
+        t.join()
+        self.profiler.mark_phase('deploy')
+        self.assertEqual(len(self.files('.collapsed')), 1)
+        with open(os.path.join(self.outdir,
+                               self.files('.collapsed')[0])) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(any(l.startswith('deploy-0;') and 'busy' in l
+                            for l in lines))
+        stats = pstats.Stats(os.path.join(self.outdir,
+                                          self.files('.pstats')[0]))
+        self.assertTrue(any(k[2] == 'busy' for k in stats.stats))
+
+    def test_deterministic_per_phase(self):
+        self.profiler.start('deterministic', self.outdir)
+        busy(0.01)
+        self.profiler.mark_phase('second')
+        self.profiler.stop()
+        names = self.files('.pstats')
+        self.assertEqual(len(names), 2)
+        self.assertIn('-00-startup', names[0])
+        self.assertIn('-01-second', names[1])
+        first = pstats.Stats(os.path.join(self.outdir, names[0]))
+        self.assertTrue(any(k[2] == 'busy' for k in first.stats))
+
+    def test_setup_registers_hotkey(self):
+        config = MagicMock(cfg_path=self.outdir)
+        config.getopt.return_value = None
+        loop = MagicMock()
+        profiler.setup(config, loop)
+        loop.register_callback.assert_called_once()
+        self.assertEqual(loop.register_callback.call_args[0][0],
+                         'toggle_profiler')
+
+    @patch('cloudinstall.profiler.profiler')
+    @patch.dict(os.environ, clear=True)
+    def test_setup_ignores_saved_config(self, mock_profiler):
+        # left in config.yaml by an earlier --profile run
+        config = MagicMock(cfg_path=self.outdir)
+        config.getopt.return_value = 'sampling'
+        profiler.setup(config)
+        mock_profiler.start.assert_not_called()
+        profiler.setup(config, mode='deterministic')
+        mock_profiler.start.assert_called_once_with(
+            'deterministic', os.path.join(self.outdir, 'profiles'))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from jinja2 import Environment, FileSystemLoader
+import yaml
+
+from cloudinstall import recorder
+from cloudinstall.simulator.replay import ReplayJuju, ReplayMaas, summarize
+
+log = logging.getLogger('cloudinstall.test_recorder')
+
+
+class ManualClock:
+
+    def __init__(self):
+        self.time = 0.0
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.time += seconds
+
+
+def status(t, machines):
+    return dict(t=t, dt=0.5, juju=dict(Type='Client', Request='FullStatus',
+                                       Params={}),
+                reply=dict(Response=dict(Machines=machines)))
+
+
+def deploy(t, service, error=None):
+    reply = dict(Error=error) if error else dict(Response={})
+    return dict(t=t, dt=0.1, juju=dict(Type='Client', Request='ServiceDeploy',
+                                       Params=dict(ServiceName=service)),
+                reply=reply)
+
+
+class RecorderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'install.rec.gz')
+        self.recorder = recorder.Recorder(self.path, install_type='Multi')
+
+    def test_round_trip(self):
+        start = self.recorder.start
+        self.recorder.juju_message(
+            dict(Type='Admin', Request='Login', RequestId=3,
+                 Params=dict(AuthTag='user-admin', Password='secret',
+                             credentials='secret')),
+            dict(RequestId=3, Response={}), start + 1, 0.25)
+        response = MagicMock(status_code=200)
+        response.json.return_value = [{'system_id': 'node-1'}]
+        self.recorder.maas_response('GET', '/nodes/', dict(op='list'),
+                                    start + 2, 0.5, response, None)
+        self.recorder.maas_response('POST', '/tags/', None, start + 3, 0.5,
+                                    None, Exception('refused'))
+        self.recorder.close()
+
+        header, entries = recorder.load(self.path)
+        self.assertEqual('Multi', header['install_type'])
+        login, nodes, tags = entries
+        self.assertEqual(dict(t=1, dt=0.25,
+                              juju=dict(Type='Admin', Request='Login',
+                                        Params=dict(AuthTag='user-admin',
+                                                    Password='***',
+                                                    credentials='***')),
+                              reply=dict(RequestId=3, Response={})), login)
+        self.assertEqual(['GET', '/nodes/', dict(op='list')], nodes['maas'])
+        self.assertEqual((200, [{'system_id': 'node-1'}]),
+                         (nodes['status'], nodes['body']))
+        self.assertEqual((None, 'refused'), (tags['status'], tags['body']))
+
+    def test_charm_config_secrets_scrubbed(self):
+        templates = os.path.join(os.path.dirname(__file__),
+                                 "../share/templates")
+        template = Environment(loader=FileSystemLoader(templates)) \
+            .get_template('charmconf.yaml')
+        charmconf = yaml.safe_load(template.render(
+            openstack_password='pw-in-clear', openstack_release='liberty'))
+        start = self.recorder.start
+        self.recorder.juju_message(
+            dict(Type='Client', Request='ServiceDeploy', RequestId=4,
+                 Params=dict(ServiceName='keystone', NumUnits=1,
+                             ConfigYAML=yaml.safe_dump(charmconf))),
+            dict(RequestId=4, Response={}), start + 1, 0.1)
+        self.recorder.juju_message(
+            dict(Type='Client', Request='ServiceSet', RequestId=5,
+                 Params=dict(ServiceName='ceph',
+                             Options={'monitor-secret': 'ceph-in-clear',
+                                      'fsid': 'f649b7fa'})),
+            dict(RequestId=5, Response={}), start + 2, 0.1)
+        self.recorder.close()
+
+        with gzip.open(self.path, 'rt') as f:
+            content = f.read()
+        self.assertNotIn('pw-in-clear', content)
+        self.assertNotIn('ceph-in-clear', content)
+        _, (deploy, service_set) = recorder.load(self.path)
+        config = yaml.safe_load(deploy['juju']['Params']['ConfigYAML'])
+        self.assertEqual('***', config['keystone']['admin-password'])
+        self.assertEqual('***', config['juju-gui']['password'])
+        self.assertEqual(config['mysql'], charmconf['mysql'])
+        self.assertEqual({'monitor-secret': '***', 'fsid': 'f649b7fa'},
+                         service_set['juju']['Params']['Options'])
+
+    def test_load_rejects_other_files(self):
+        self.recorder.close()
+        with open(self.path, 'wb') as f:
+            f.write(b'')
+        self.assertRaises(Exception, recorder.load, self.path)
+
+
+class ReplayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = ManualClock()
+
+    def test_queries_follow_the_timeline(self):
+        juju = ReplayJuju([status(10, {'1': 'started'}),
+                           status(0, {'1': 'pending'})], self.clock)
+        r = juju.reply(dict(Type='Client', Request='FullStatus',
+                            RequestId=7, Params={}))
+        self.assertEqual(dict(RequestId=7,
+                              Response=dict(Machines={'1': 'pending'})), r)
+        self.assertEqual(0.5, self.clock.now())
+        self.clock.sleep(10)
+        r = juju.reply(dict(Type='Client', Request='FullStatus',
+                            RequestId=8, Params={}))
+        self.assertEqual({'1': 'started'}, r['Response']['Machines'])
+
+    def test_actions_replay_in_order_per_service(self):
+        juju = ReplayJuju([deploy(1, 'mysql', 'busy'), deploy(2, 'mysql'),
+                           deploy(3, 'keystone')], self.clock)
+
+        def call(service):
+            return juju.reply(dict(Type='Client', Request='ServiceDeploy',
+                                   RequestId=1,
+                                   Params=dict(ServiceName=service)))
+        self.assertEqual({}, call('keystone')['Response'])
+        self.assertEqual('busy', call('mysql')['Error'])
+        self.assertEqual({}, call('mysql')['Response'])
+        self.assertEqual({}, call('mysql')['Response'])
+        self.assertEqual({}, call('ntp')['Response'])
+        self.assertEqual(1, sum(juju.missing.values()))
+        self.assertEqual(5, juju.requests)
+
+    def test_maas(self):
+        entries = [dict(t=0, dt=0, maas=['GET', '/nodes/', dict(op='list')],
+                        status=200, body=[]),
+                   dict(t=0, dt=0, maas=['POST', '/tags/', dict(op='new')],
+                        status=None, body='refused')]
+        maas = ReplayMaas(entries, self.clock)
+        self.assertEqual((200, []), maas.request('GET', '/nodes',
+                                                 dict(op='list')))
+        self.assertEqual((503, 'refused'),
+                         maas.request('POST', '/tags/', dict(op='new')))
+        self.assertEqual(404, maas.request('GET', '/files/', {})[0])
+        self.assertEqual((1.5, 1, 2), summarize(entries + [status(1, {})]))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import logging
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from cloudinstall import remote
+
+log = logging.getLogger('cloudinstall.test_remote')
+
+
+def b64(s):
+    return base64.b64encode(s.encode('utf-8')).decode('ascii')
+
+
+class RemoteRunTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.juju = MagicMock(name='juju')
+
+    def test_single_call_for_all_machines(self):
+        self.juju.run.return_value = {'Results': [
+            {'MachineId': '1', 'Code': 0, 'Stdout': b64('ok'),
+             'Stderr': '', 'Error': ''},
+            {'MachineId': '2', 'Code': 2, 'Stdout': '',
+             'Stderr': b64('bad'), 'Error': ''}]}
+        results = remote.run(self.juju, [1, 2], ["a", "b"])
+        self.assertEqual(self.juju.run.call_count, 1)
+        args, kwargs = self.juju.run.call_args
+        self.assertEqual(kwargs['machines'], ['1', '2'])
+        self.assertIn("a\nb", args[0])
+        self.assertEqual(results['1'], dict(status=0, output='ok', err=''))
+        self.assertEqual(results['2']['status'], 2)
+        self.assertEqual(results['2']['err'], 'bad')
+
+    def test_api_error_marks_failure(self):
+        self.juju.run.return_value = {'Results': [
+            {'MachineId': '1', 'Code': 0, 'Error': 'no such machine'}]}
+        out = remote.run_one(self.juju, '1', "true")
+        self.assertEqual(out['status'], 1)
+        self.assertIn('no such machine', out['err'])
+
+    def test_missing_result(self):
+        self.juju.run.return_value = {'Results': []}
+        out = remote.run_one(self.juju, '3', "true")
+        self.assertEqual(out['status'], 1)
+
+    def test_file_bundled_in_script(self):
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, 'src')
+            dst = os.path.join(d, 'dst')
+            with open(src, 'w') as f:
+                f.write("#!/bin/sh\necho 'hi' $1\n")
+            script = remote.build_script("cat {}".format(dst),
+                                         files=[(src, dst)])
+            out = subprocess.check_output(['sh', '-c', script])
+            self.assertEqual(out.decode(), "#!/bin/sh\necho 'hi' $1\n")
@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import macumba.api
+import macumba.errors
+from cloudinstall.juju import JujuState
+from cloudinstall.maas import MaasMachineStatus, connect_to_maas
+from cloudinstall.simulator.juju import SimulatedJuju
+from cloudinstall.simulator.maas import SimulatedMaas, maas_nodes
+from cloudinstall.simulator.server import (HTTPAPIServer, JujuAPIServer,
+                                           make_certificate)
+from macumba.errors import ConnectionClosedError
+from macumba.v1 import JujuClient
+from macumba.ws import JujuWS
+
+log = logging.getLogger('cloudinstall.test_simulator')
+
+FAST = dict(latency=(0, 0), commission=(10, 10), machine_start=(10, 10),
+            container_start=(5, 5), unit_install=(10, 10),
+            unit_start=(10, 10))
+
+
+class StallingProxy:
+    """ Forwards TCP connections to address; stall() makes the current
+    ones silently drop everything, like a dead link.
+    """
+
+    def __init__(self, address):
+        host, port = address.split(':')
+        self.target = (host, int(port))
+        self.connections = []
+        self.stalled = set()
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.address = "127.0.0.1:{}".format(self.sock.getsockname()[1])
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            server = socket.create_connection(self.target)
+            connection = (client, server)
+            self.connections.append(connection)
+            for src, dst in [connection, connection[::-1]]:
+                threading.Thread(target=self._pump,
+                                 args=(connection, src, dst),
+                                 daemon=True).start()
+
+    def _pump(self, connection, src, dst):
+        while True:
+            try:
+                data = src.recv(65536)
+                if not data:
+                    return
+                if connection not in self.stalled:
+                    dst.sendall(data)
+            except OSError:
+                return
+
+    def stall(self):
+        self.stalled.update(self.connections)
+
+    def close(self):
+        self.sock.close()
+        for connection in self.connections:
+            for sock in connection:
+                sock.close()
+
+
+class ManualClock:
+    speed = 1000.0
+
+    def __init__(self):
+        self.time = 0.0
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.time += seconds
+
+
+class FakeJuju:
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def status(self, patterns=None):
+        return self.sim.full_status(patterns)
+
+
+def call(juju, request, **params):
+    facade, name = request.split('.')
+    return juju.reply(dict(Type=facade, Request=name, RequestId=1,
+                           Params=params))
+
+
+class SimulatedMaasTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = ManualClock()
+        self.maas = SimulatedMaas(maas_nodes(3, status=MaasMachineStatus.NEW),
+                                  self.clock, settings=FAST)
+
+    def test_accept_all_commissions(self):
+        self.maas.accept_all()
+        statuses = {n['status'] for n in self.maas.list_nodes()}
+        self.assertEqual({MaasMachineStatus.COMMISSIONING.value}, statuses)
+        self.clock.sleep(10)
+        statuses = {n['status'] for n in self.maas.list_nodes()}
+        self.assertEqual({MaasMachineStatus.READY.value}, statuses)
+
+    def test_allocate_honours_tags(self):
+        self.maas.accept_all()
+        self.clock.sleep(10)
+        system_id = self.maas.nodes[2]['system_id']
+        self.maas.new_tag(system_id)
+        self.assertTrue(self.maas.tag_nodes(system_id, [system_id]))
+        self.assertFalse(self.maas.tag_nodes('missing', [system_id]))
+        node = self.maas.allocate([system_id])
+        self.assertEqual(system_id, node['system_id'])
+        self.assertEqual(MaasMachineStatus.ALLOCATED.value, node['status'])
+        self.assertIsNone(self.maas.allocate([system_id]))
+
+
+class SimulatedJujuTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = ManualClock()
+        self.maas = SimulatedMaas(maas_nodes(2), self.clock, settings=FAST)
+        self.juju = SimulatedJuju(self.maas, self.clock, settings=FAST)
+        self.state = JujuState(FakeJuju(self.juju))
+
+    def agent_states(self):
+        self.state.invalidate_status_cache()
+        return dict(self.state.get_agent_states())
+
+    def test_placement_directives(self):
+        call(self.juju, 'Client.AddMachines',
+             MachineParams=[dict(), dict()])
+        placement = JujuClient._prepare_placement(None, ['1', 'lxc:2', ''])
+        self.assertEqual([dict(Scope='#', Directive='1'),
+                          dict(Scope='lxc', Directive='2')], placement)
+        call(self.juju, 'Client.ServiceDeploy', ServiceName='ceph',
+             NumUnits=3, Placement=placement)
+        r = call(self.juju, 'Client.AddServiceUnits', ServiceName='ceph',
+                 NumUnits=1, Placement=[dict(Scope='kvm', Directive='1')])
+        self.assertEqual(['ceph/3'], r['Response']['Units'])
+        machines = sorted(u['machine'] for u in
+                          self.juju.services['ceph']['units'].values())
+        self.assertEqual(['1', '1/kvm/0', '2/lxc/0', '3'], machines)
+        r = call(self.juju, 'Client.AddServiceUnits', ServiceName='ceph',
+                 NumUnits=1, Placement=placement)
+        self.assertIn('Error', r)
+
+    def test_machine_and_unit_lifecycle(self):
+        system_id = self.maas.nodes[0]['system_id']
+        self.maas.new_tag(system_id)
+        self.maas.tag_nodes(system_id, [system_id])
+        r = call(self.juju, 'Client.AddMachines',
+                 MachineParams=[dict(Constraints=dict(tags=[system_id]))])
+        self.assertEqual('1', r['Response']['Machines'][0]['Machine'])
+        call(self.juju, 'Client.ServiceDeploy', ServiceName='mysql',
+             NumUnits=1, ToMachineSpec='lxc:1')
+        call(self.juju, 'Client.ServiceDeploy', ServiceName='ntp',
+             NumUnits=0)
+        call(self.juju, 'Client.AddRelation',
+             Endpoints=['ntp:juju-info', 'mysql:juju-info'])
+
+        self.state.invalidate_status_cache()
+        self.assertEqual(self.maas.nodes[0]['resource_uri'],
+                         self.state.machine('1').instance_id)
+        self.assertEqual('pending', self.state.machine('1').agent_state)
+        self.assertEqual({'mysql': 'pending'}, self.agent_states())
+
+        self.clock.sleep(15)
+        self.state.invalidate_status_cache()
+        self.assertEqual('started', self.state.machine('1').agent_state)
+        self.assertEqual('started',
+                         self.state.machine_or_container('1/lxc/0')
+                         .agent_state)
+        self.clock.sleep(10)
+        self.assertEqual({'mysql': 'installed'}, self.agent_states())
+        self.clock.sleep(10)
+        self.assertEqual({'mysql': 'started'}, self.agent_states())
+        unit = self.state.service('mysql').unit('mysql')
+        self.assertEqual('active', unit.workload_state)
+        self.assertEqual(['mysql'], self.juju.full_status()[
+            'Services']['ntp']['SubordinateTo'])
+
+    def test_failed_unit_is_resolved(self):
+        self.juju.settings['unit_failure_rate'] = 1.0
+        call(self.juju, 'Client.ServiceDeploy', ServiceName='mysql',
+             NumUnits=1)
+        self.clock.sleep(30)
+        self.assertEqual({'mysql': 'error'}, self.agent_states())
+        call(self.juju, 'Client.Resolved', UnitName='mysql/0')
+        self.clock.sleep(30)
+        self.assertEqual({'mysql': 'started'}, self.agent_states())
+
+    def test_no_available_node_reports_409(self):
+        for _ in range(3):
+            call(self.juju, 'Client.AddMachines', MachineParams=[{}])
+        self.state.invalidate_status_cache()
+        info = self.state.machine('3').machine.get('AgentStateInfo', '')
+        self.assertIn('409', info)
+
+    def test_errors(self):
+        r = call(self.juju, 'Client.AddServiceUnits', ServiceName='nope')
+        self.assertIn('not found', r['Error'])
+        self.assertEqual('not found', r['ErrorCode'])
+        r = call(self.juju, 'Client.Bogus')
+        self.assertIn('Error', r)
+        self.juju.settings['api_failure_rate'] = 1.0
+        r = call(self.juju, 'Client.FullStatus')
+        self.assertIn('simulated API failure', r['Error'])
+
+    def test_status_patterns(self):
+        for _ in range(2):
+            call(self.juju, 'Client.AddMachines', MachineParams=[{}])
+        call(self.juju, 'Client.ServiceDeploy', ServiceName='mysql',
+             NumUnits=1, ToMachineSpec='lxc:1')
+        call(self.juju, 'Client.ServiceDeploy', ServiceName='keystone',
+             NumUnits=1, ToMachineSpec='2')
+
+        def status(*patterns):
+            r = call(self.juju, 'Client.FullStatus', Patterns=patterns)
+            return (sorted(r['Response']['Machines']),
+                    sorted(r['Response']['Services']))
+        self.assertEqual((['1'], ['mysql']), status('mysql'))
+        self.assertEqual((['2'], ['keystone']), status('2'))
+        self.assertEqual((['1'], ['mysql']), status('1/lxc/0'))
+        self.assertEqual(([], []), status('nova-compute'))
+        self.assertEqual((['0', '1', '2'], ['keystone', 'mysql']), status())
+
+    def test_watcher_deltas(self):
+        watcher = call(self.juju, 'Client.WatchAll')['Response']
+        wid = watcher['AllWatcherId']
+        deltas = self.juju.next_deltas(wid)
+        self.assertEqual([['machine', 'change']],
+                         [d[:2] for d in deltas])
+        call(self.juju, 'Client.ServiceDeploy', ServiceName='mysql',
+             NumUnits=0)
+        deltas = self.juju.next_deltas(wid)
+        self.assertEqual([['service', 'change']], [d[:2] for d in deltas])
+        self.assertEqual([], self.juju.next_deltas(wid, timeout=0))
+
+
+class ServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maas = SimulatedMaas(maas_nodes(2), settings=FAST)
+        self.http = HTTPAPIServer(self.maas).start()
+        self.addCleanup(self.http.stop)
+
+    def test_maas_api(self):
+        maas, maas_state = connect_to_maas(dict(api_host=self.http.address,
+                                                api_key='a:b:c'))
+        self.assertEqual(2, len(maas_state.machines(
+            MaasMachineStatus.READY)))
+        system_id = self.maas.nodes[0]['system_id']
+        maas.tag_name(maas.nodes)
+        self.assertIn(system_id, self.maas.node(system_id)['tag_names'])
+
+    def test_charmstore(self):
+        url = "http://{}/charmstore".format(self.http.address)
+        with patch.object(macumba.api, 'CHARMSTORE_URL', url):
+            self.assertEqual('cs:trusty/mysql-1',
+                             macumba.api.query_cs('mysql')['Id'])
+
+    def test_charmstore_cache(self):
+        url = "http://{}/charmstore".format(self.http.address)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        cache_path = os.path.join(tmpdir.name, 'charmstore.json')
+
+        def new_process():
+            return patch.dict(macumba.api._cs_cache, clear=True)
+
+        with patch.object(macumba.api, 'CHARMSTORE_URL', url), \
+                patch.object(macumba.api, 'CHARMSTORE_CACHE_PATH',
+                             cache_path), \
+                patch('macumba.api.requests.get',
+                      wraps=macumba.api.requests.get) as mock_get:
+            with new_process():
+                results = macumba.api.query_cs_many(
+                    ['mysql', 'keystone', 'precise/ntp'])
+                self.assertEqual('cs:precise/ntp-1',
+                                 results['precise/ntp']['Id'])
+                self.assertEqual(1, mock_get.call_count)
+            with new_process():
+                self.assertEqual('cs:trusty/mysql-1',
+                                 macumba.api.query_cs('mysql')['Id'])
+                self.assertEqual(1, mock_get.call_count)
+
+            with new_process(), \
+                    patch.object(macumba.api, 'CHARMSTORE_CACHE_TTL', 0):
+                macumba.api.query_cs_many(['keystone', 'mysql',
+                                           'precise/ntp'])
+                self.assertEqual(2, mock_get.call_count)
+                self.assertIn('If-None-Match',
+                              mock_get.call_args[1]['headers'])
+            # ETags are kept per request, a batch's doesn't cover one
+            # of its charms asked for alone
+            for revalidated in [False, True]:
+                with new_process(), \
+                        patch.object(macumba.api, 'CHARMSTORE_CACHE_TTL', 0):
+                    self.assertEqual('cs:trusty/mysql-1',
+                                     macumba.api.query_cs('mysql')['Id'])
+                    self.assertEqual(revalidated, 'If-None-Match' in
+                                     mock_get.call_args[1]['headers'])
+            self.assertEqual(4, mock_get.call_count)
+            with new_process(), \
+                    patch.object(macumba.api, 'CHARMSTORE_CACHE_TTL', 0):
+                macumba.api.query_cs_many(['keystone', 'mysql',
+                                           'precise/ntp'])
+                self.assertIn('If-None-Match',
+                              mock_get.call_args[1]['headers'])
+
+        unreachable = "http://127.0.0.1:1/charmstore"
+        with new_process(), \
+                patch.object(macumba.api, 'CHARMSTORE_URL', unreachable), \
+                patch.object(macumba.api, 'CHARMSTORE_CACHE_PATH',
+                             cache_path), \
+                patch.object(macumba.api, 'CHARMSTORE_OFFLINE', True):
+            self.assertEqual('cs:trusty/keystone-1',
+                             macumba.api.query_cs('keystone')['Id'])
+            self.assertRaises(macumba.errors.CharmNotFoundError,
+                              macumba.api.query_cs, 'glance')
+
+    @unittest.skipUnless(shutil.which('openssl'), "needs openssl")
+    def test_juju_api(self):
+        juju = SimulatedJuju(self.maas, settings=FAST)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        server = JujuAPIServer(juju, *make_certificate(tmpdir.name)).start()
+        self.addCleanup(server.stop)
+        client = JujuClient(url="wss://{}/environment/x/api".format(
+            server.address), password='secret')
+        client.login()
+        self.addCleanup(client.close)
+        client.add_machine()
+        self.assertEqual(['0', '1'], sorted(client.status()['Machines']))
+
+    @unittest.skipUnless(shutil.which('openssl'), "needs openssl")
+    def test_juju_api_reconnects_dead_link(self):
+        juju = SimulatedJuju(self.maas, settings=FAST)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        server = JujuAPIServer(juju, *make_certificate(tmpdir.name)).start()
+        self.addCleanup(server.stop)
+        proxy = StallingProxy(server.address)
+        self.addCleanup(proxy.close)
+        client = JujuClient(url="wss://{}/environment/x/api".format(
+            proxy.address), password='secret', heartbeat_interval=0.25)
+        client.login()
+        self.addCleanup(client.close)
+        states = []
+        with patch.object(macumba.api, 'connection_observers',
+                          [lambda state, url: states.append(state)]):
+            client.add_machine()
+            proxy.stall()
+            start = time.time()
+            # replayed on the new connection
+            self.assertEqual(['0', '1'], sorted(client.status()['Machines']))
+            self.assertLess(time.time() - start, 5)
+            self.assertEqual([macumba.api.CONNECTION_LOST,
+                              macumba.api.CONNECTION_RESTORED], states)
+
+            proxy.stall()
+            self.assertRaises(ConnectionClosedError, client.add_machine)
+            self.assertEqual(2, states.count(macumba.api.CONNECTION_RESTORED))
+            self.assertEqual(['0', '1'], sorted(client.status()['Machines']))
+
+    def test_juju_api_connect_times_out(self):
+        # accepts connections and never answers the handshake
+        listener = socket.socket()
+        self.addCleanup(listener.close)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        client = JujuClient(url="wss://127.0.0.1:{}/environment/x/api".format(
+            listener.getsockname()[1]), password='secret')
+        start = time.time()
+        with patch.object(macumba.api, 'CONNECT_TIMEOUT', 0.5):
+            self.assertRaises(ConnectionClosedError, client.login)
+        self.assertLess(time.time() - start, 5)
+        self.assertTrue(client.conn.terminated)
+
+    def test_juju_ws_alive_while_reading_frame(self):
+        ws = JujuWS("ws://127.0.0.1:1/", 'secret', heartbeat_interval=0.1)
+        self.addCleanup(ws.close_connection)
+        ws.last_heard = time.time() - 1
+        self.assertTrue(ws.is_dead())
+        # the header of a 64KiB text frame, its payload still to come
+        ws.process(b'\x81\x7f' + (65536).to_bytes(8, 'big'))
+        self.assertFalse(ws.is_dead())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cloudinstall.controllers.install import SingleInstall
+from cloudinstall.config import Config
+from tempfile import NamedTemporaryFile
+
+
+class SnapshotContainers:
+    """ Containers as LXC lays them out: a snapshot clone needs the
+    container it was cloned from, which can't be destroyed before it.
+    """
+
+    def __init__(self):
+        self.lower = {}  # name -> container its rootfs overlays, or None
+
+    def exists(self, name):
+        return name in self.lower
+
+    def create(self, name, userdata):
+        self.lower[name] = None
+
+    def clone(self, src, dst):
+        self.lower[dst] = src
+
+    def copy(self, src, dst):
+        self.lower[dst] = None
+
+    def destroy(self, name):
+        if name in self.lower.values():
+            raise Exception("{} has snapshot clones".format(name))
+        del self.lower[name]
+
+
+@patch('cloudinstall.utils.pollinate')
+class SingleInstallGoldenImageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        with NamedTemporaryFile(mode='w+', encoding='utf-8') as tempf:
+            # Override config file to save to
+            self.conf = Config({}, tempf.name, save_backups=False)
+        self.conf.setopt('topcontainer_type', 'lxc')
+        self.conf.setopt('ubuntu_series', 'trusty')
+
+        self.dc = MagicMock(name="display_controller")
+        self.loop = MagicMock(name="loop")
+
+    def make_installer(self):
+        installer = SingleInstall(self.loop, self.dc, self.conf)
+        installer.cdriver = MagicMock(name='cdriver')
+        installer.cloud_init_finished = MagicMock(return_value=True)
+        installer.configure_container_network = MagicMock()
+        return installer
+
+    @patch('cloudinstall.utils.get_command_output')
+    @patch('cloudinstall.utils.slurp')
+    def test_golden_image_name_keyed_by_inputs(self, mock_slurp, mock_gco,
+                                               mock_pollinate):
+        installer = self.make_installer()
+        mock_slurp.return_value = '#cloud-config'
+        mock_gco.return_value = dict(status=0, output='Candidate: 1.0')
+        name = installer.golden_image_name()
+        self.assertTrue(name.startswith('openstack-golden-'))
+        self.assertEqual(name, installer.golden_image_name())
+
+        mock_gco.return_value = dict(status=0, output='Candidate: 1.1')
+        self.assertNotEqual(name, installer.golden_image_name())
+
+        self.conf.setopt('ubuntu_series', 'xenial')
+        mock_gco.return_value = dict(status=0, output='Candidate: 1.0')
+        self.assertNotEqual(name, installer.golden_image_name())
+
+    def test_clone_reuses_existing_golden_image(self, mock_pollinate):
+        installer = self.make_installer()
+        installer.golden_image_name = MagicMock(return_value='golden')
+        installer.install_dependencies = MagicMock()
+        installer.cdriver.exists.return_value = True
+
+        installer.clone_container_and_wait()
+
+        installer.cdriver.create.assert_not_called()
+        installer.install_dependencies.assert_not_called()
+        installer.cdriver.clone.assert_called_once_with(
+            'golden', installer.container_name)
+        installer.configure_container_network.assert_called_once_with()
+
+    def test_clone_builds_missing_golden_image(self, mock_pollinate):
+        installer = self.make_installer()
+        installer.golden_image_name = MagicMock(return_value='golden')
+        installer.install_dependencies = MagicMock()
+        containers = set()
+        installer.cdriver.exists.side_effect = lambda n: n in containers
+        installer.cdriver.copy.side_effect = lambda s, d: containers.add(d)
+        installer.cdriver.clone.side_effect = lambda s, d: containers.add(d)
+        installer.cdriver.create.side_effect = \
+            lambda n, userdata: containers.add(n)
+        installer.cdriver.destroy.side_effect = containers.discard
+
+        installer.clone_container_and_wait()
+
+        installer.cdriver.create.assert_called_once_with(
+            'golden-build', installer.userdata)
+        installer.install_dependencies.assert_called_once_with(
+            'golden-build')
+        installer.cdriver.copy.assert_called_once_with('golden-build',
+                                                       'golden')
+        installer.cdriver.clone.assert_called_once_with(
+            'golden', installer.container_name)
+        self.assertEqual({'golden', installer.container_name}, containers)
+
+    def test_golden_image_outlives_build_container(self, mock_pollinate):
+        installer = self.make_installer()
+        installer.golden_image_name = MagicMock(return_value='golden')
+        installer.install_dependencies = MagicMock()
+        driver = SnapshotContainers()
+        for op in ['exists', 'create', 'clone', 'copy', 'destroy']:
+            getattr(installer.cdriver, op).side_effect = getattr(driver, op)
+
+        installer.clone_container_and_wait()
+
+        self.assertEqual({'golden', installer.container_name},
+                         set(driver.lower))
+        # snapshot clones only hang off the golden image
+        self.assertIsNone(driver.lower['golden'])
+        self.assertEqual('golden', driver.lower[installer.container_name])
+
+    def test_failed_golden_image_build_not_kept(self, mock_pollinate):
+        installer = self.make_installer()
+        installer.golden_image_name = MagicMock(return_value='golden')
+        installer.install_dependencies = MagicMock(
+            side_effect=Exception("apt failed"))
+        containers = {'golden-build'}
+        installer.cdriver.exists.side_effect = lambda n: n in containers
+        installer.cdriver.create.side_effect = \
+            lambda n, userdata: containers.add(n)
+        installer.cdriver.destroy.side_effect = containers.discard
+
+        self.assertRaises(Exception, installer.clone_container_and_wait)
+
+        self.assertEqual(set(), containers)
+        self.assertEqual(2, installer.cdriver.destroy.call_count)
+        installer.cdriver.copy.assert_not_called()
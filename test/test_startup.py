@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Import-time budget of the config-only entry points, which shell
+scripts call in loops
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+log = logging.getLogger('cloudinstall.test_startup')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds allowed for importing cloudinstall.config in a fresh
+# interpreter, only checked when set, as timings vary too much between
+# test machines; it takes well under 0.1s.
+IMPORT_BUDGET = float(os.getenv('UCI_TEST_IMPORT_BUDGET', 0))
+
+# Never needed to read the config
+HEAVY_MODULES = ['urwid', 'ws4py', 'requests', 'jinja2', 'macumba',
+                 'maasclient', 'cloudinstall.charms', 'cloudinstall.gui',
+                 'cloudinstall.ui', 'cloudinstall.core']
+
+PROBE = """
+import json, sys, time
+start = time.time()
+{}
+elapsed = time.time() - start
+print()
+print(json.dumps(dict(elapsed=elapsed, modules=sorted(sys.modules))))
+"""
+
+
+def run(code, env=None):
+    """ returns (elapsed, modules, stdout) of running code in a new
+    interpreter
+    """
+    env = dict(os.environ, **(env or {}))
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in [ROOT, os.environ.get('PYTHONPATH')] if p)
+    out = subprocess.check_output([sys.executable, '-c', PROBE.format(code)],
+                                  cwd=ROOT, env=env).decode('utf-8')
+    output, _, result = out.rpartition('\n{')
+    result = json.loads('{' + result)
+    return result['elapsed'], result['modules'], output
+
+
+def heavy(modules):
+    return [m for m in modules
+            if any(m == h or m.startswith(h + '.') for h in HEAVY_MODULES)]
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_config_imports_config_only(self):
+        _, modules, _ = run("import cloudinstall.config")
+        self.assertEqual([], heavy(modules))
+
+    @unittest.skipUnless(IMPORT_BUDGET, "set UCI_TEST_IMPORT_BUDGET")
+    def test_config_import_budget(self):
+        elapsed, _, _ = run("import cloudinstall.config")
+        self.assertLess(elapsed, IMPORT_BUDGET)
+
+    def test_get_config_loads_config_only(self):
+        home = tempfile.TemporaryDirectory()
+        self.addCleanup(home.cleanup)
+        os.mkdir(os.path.join(home.name, '.cloud-install'))
+        with open(os.path.join(home.name, '.cloud-install',
+                               'config.yaml'), 'w') as f:
+            f.write("juju_path: /srv/juju\n")
+        elapsed, modules, output = run(
+            "import runpy\n"
+            "sys.argv = ['openstack-install', '-g', 'juju_path']\n"
+            "try:\n"
+            "    runpy.run_path('bin/openstack-install', "
+            "run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    pass",
+            env=dict(HOME=home.name, USER='', SUDO_USER=''))
+        self.assertEqual('/srv/juju', output)
+        self.assertEqual([], heavy(modules))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cloudinstall import trace, utils
+from cloudinstall.task import Tasker
+
+log = logging.getLogger('cloudinstall.test_trace')
+
+
+class TraceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        trace.reset()
+        trace.configure('phase,wait')
+
+    def tearDown(self):
+        trace.reset()
+        trace.configure()
+
+    def test_disabled_category_is_noop(self):
+        self.assertIs(trace.span('x', 'api'), trace.NULL_SPAN)
+        with trace.span('x', 'api'):
+            pass
+        self.assertEqual(trace.chrome_trace()['traceEvents'], [])
+
+    def test_configure(self):
+        trace.configure('all')
+        self.assertTrue(trace.enabled('subprocess'))
+        trace.configure('off')
+        self.assertFalse(trace.enabled('phase'))
+
+    def test_spans_across_threads(self):
+        def worker():
+            with trace.span('inner', 'wait'):
+                pass
+        with trace.span('outer', 'phase', step=1):
+            t = threading.Thread(target=worker, name='worker')
+            t.start()
+            t.join()
+        data = trace.chrome_trace()
+        events = [e for e in data['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual([e['name'] for e in events], ['inner', 'outer'])
+        self.assertNotEqual(events[0]['tid'], events[1]['tid'])
+        self.assertEqual(events[1]['args'], dict(step=1))
+        names = [e['args']['name'] for e in data['traceEvents']
+                 if e['ph'] == 'M']
+        self.assertIn('worker', names)
+
+    def test_error_recorded(self):
+        try:
+            with trace.span('failing', 'phase'):
+                raise Exception("boom")
+        except Exception:
+            pass
+        event = trace.chrome_trace()['traceEvents'][-1]
+        self.assertEqual(event['args']['error'], 'boom')
+
+    def test_export_and_summary(self):
+        trace.record('Installing', 'phase', 100.0, 2.5)
+        trace.record('Installing', 'phase', 110.0, 1.5)
+        self.assertIn("4.00s", trace.summary()[0])
+        with tempfile.TemporaryDirectory() as d:
+            trace.export(d)
+            files = os.listdir(d)
+            jsonfile = [f for f in files if f.endswith('.json')][0]
+            with open(os.path.join(d, jsonfile)) as f:
+                data = json.load(f)
+        self.assertEqual(len(data['traceEvents']), 3)
+        self.assertEqual(len(files), 2)
+
+    @patch('cloudinstall.task.AlarmMonitor')
+    def test_phases_not_exported_per_task(self, mock_alarms):
+        tasker = Tasker(MagicMock(), MagicMock(), MagicMock())
+        tasker.register_tasks(['Bootstrapping', 'Deploying'])
+        with patch('cloudinstall.trace.export') as mock_export:
+            tasker.start_task('Bootstrapping')
+            tasker.start_task('Deploying')
+            tasker.stop_current_task()
+        mock_export.assert_not_called()
+        events = trace.chrome_trace()['traceEvents']
+        self.assertEqual(['Bootstrapping', 'Deploying'],
+                         [e['name'] for e in events if e['ph'] == 'X'])
+
+    def test_subprocess_span_omits_command_line(self):
+        trace.configure('subprocess')
+        secret = 'hunter2-api-key'
+        command = 'true ' + 'x' * 60 + ' ' + secret
+        utils.get_command_output(command)
+        events = [e for e in trace.chrome_trace()['traceEvents']
+                  if e['ph'] == 'X']
+        self.assertEqual([command[:60]], [e['name'] for e in events])
+        self.assertNotIn(secret, json.dumps(events))